@@ -0,0 +1,92 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures how long the hooks are stalled by a slow downstream reader (a fifo drained at a fixed
+# rate), for synchronous writes and for the writer thread with each overflow policy
+#
+#   python bench/bench_async_writer.py [host count]
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from common import RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+
+def slow_reader(path, counts):
+    with open(path, 'rb', buffering=0) as fifo:
+        while True:
+            chunk = fifo.read(16 * 1024)
+            if not chunk:
+                return
+            counts['bytes'] += len(chunk)
+            counts['lines'] += chunk.count(b'\n')
+            time.sleep(0.002)
+
+
+def run(host_count, **env):
+    workdir = tempfile.mkdtemp()
+    fifo_path = os.path.join(workdir, 'events')
+    os.mkfifo(fifo_path)
+    counts = {'bytes': 0, 'lines': 0}
+    reader = threading.Thread(target=slow_reader, args=(fifo_path, counts))
+    reader.start()
+
+    callback = None
+    try:
+        plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=fifo_path,
+                             X_ANSIBLE_RUNNER_FLUSH_EVENTS='50', **env)
+
+        play = FakePlay()
+        hosts = [FakeHost('host-%05d' % index) for index in range(host_count)]
+        task = FakeTask(play, 'slow consumer')
+        stats = FakeStats()
+
+        with RedirectedStdout():
+            callback = make_callback(plugin)
+            callback.v2_playbook_on_start(FakePlaybook())
+            callback.v2_playbook_on_play_start(play)
+            callback.v2_playbook_on_task_start(task, False)
+
+            start = time.perf_counter()
+            for host in hosts:
+                callback.v2_runner_on_ok(make_result(host, task, **command_result()))
+                stats.increment('ok', host.name)
+            hooks_seconds = time.perf_counter() - start
+
+            callback.v2_playbook_on_stats(stats)
+            total_seconds = time.perf_counter() - start
+
+        dropped = callback.x_writer.dropped if callback.x_writer is not None else {}
+        return hooks_seconds, total_seconds, counts['lines'], dropped
+    finally:
+        # the reader only ends once the fifo is closed, a failing hook must not leave it waiting forever
+        if callback is not None:
+            os.close(callback.x_sink._fd)
+        else:
+            os.close(os.open(fifo_path, os.O_WRONLY))
+        reader.join()
+        shutil.rmtree(workdir)
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+
+    rows = []
+    for label, env in (('synchronous', {}),
+                       ('writer thread, block', {'X_ANSIBLE_RUNNER_ASYNC': '1'}),
+                       ('writer thread, drop', {'X_ANSIBLE_RUNNER_ASYNC': '1', 'X_ANSIBLE_RUNNER_OVERFLOW': 'drop',
+                                                'X_ANSIBLE_RUNNER_QUEUE_SIZE': '500'})):
+        hooks_seconds, total_seconds, lines, dropped = run(host_count, **env)
+        rows.append((label, 'hooks %.0f ms, until drained %.0f ms, %d lines written, dropped %s' % (
+            hooks_seconds * 1e3, total_seconds * 1e3, lines, dropped)))
+
+    report('v2_runner_on_ok for %d hosts into a slow reader' % host_count, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures how the captured human readable output is emitted (X_ANSIBLE_RUNNER_CAPTURED) on verbose
+# (-vvv) failures, whose indented result dump spans hundreds of lines, by driving the same hooks with one
+# event per line, one event per hook invocation with a lines array, and one with the captured text, and
+# checks the output printed by a hook which raised is not carried over to the next captured hook
+#
+#   python bench/bench_captured.py [host count] [stdout lines per result]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+
+def run(path, host_count, stdout, **env):
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=path, **env)
+
+    play = FakePlay()
+    hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+    tasks = [FakeTask(play, 'run the migrations %d' % index) for index in range(5)]
+    stats = FakeStats()
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+        callback._display.verbosity = 3
+
+        start = time.perf_counter()
+        callback.v2_playbook_on_start(FakePlaybook())
+        callback.v2_playbook_on_play_start(play)
+        for task in tasks:
+            callback.v2_playbook_on_task_start(task, False)
+            for host in hosts:
+                result = command_result(stdout=stdout, rc=1)
+                callback.v2_runner_on_failed(make_result(host, task, failed=True, msg='non-zero return code',
+                                                         **result))
+                stats.increment('failures', host.name)
+        callback.v2_playbook_on_stats(stats)
+        return time.perf_counter() - start, callback.x_index
+
+
+def raising_hook_output_dropped():
+    plugin = load_plugin()
+    captured = plugin.CapturedOutput()
+
+    def fail():
+        print('partial output of a failing hook')
+        raise RuntimeError('hook failed')
+
+    try:
+        captured.run(fail)
+    except RuntimeError:
+        pass
+    return captured.run(print, 'output of the next hook') == ('output of the next hook\n', '')
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    stdout = '\n'.join('migration %04d applied' % line for line in range(lines))
+
+    rows = []
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'out')
+        for label, mode in (('one event per line', 'line'), ('lines per hook', 'lines'), ('text per hook', 'text')):
+            elapsed, events = run(path, host_count, stdout, X_ANSIBLE_RUNNER_CAPTURED=mode)
+            rows.append((label, '%.2f s, %d events, %.1f MB' % (elapsed, events, os.path.getsize(path) / 1e6)))
+            os.remove(path)
+    finally:
+        shutil.rmtree(workdir)
+    rows.append(('output of a raising hook dropped', str(raising_hook_output_dropped())))
+
+    report('verbose failures on %d hosts x 5 tasks (%d stdout lines)' % (host_count, lines), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures output size and hook time with and without compact (interned) events, and checks
+# x_stdout_json_lines_reader.expand_compact_events rebuilds exactly the full events (with the default table
+# size and with a small one, reset many times along the run), compact mode trades
+# CPU for size, the encode+write time is expected to go up while the output shrinks
+#
+#   python bench/bench_compact.py [host count] [task count] [items per task]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import BENCH_RUNNER_UUID, RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+import x_stdout_json_lines_reader as reader
+
+
+def run(path, play, hosts, tasks, items, result, **env):
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=path,
+                         X_ANSIBLE_RUNNER_STRUCTURED_ONLY='1', **env)
+    stats = FakeStats()
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+        start = time.perf_counter()
+        callback.v2_playbook_on_start(FakePlaybook())
+        callback.v2_playbook_on_play_start(play)
+        for task in tasks:
+            callback.v2_playbook_on_task_start(task, False)
+            for host in hosts:
+                for item in range(items):
+                    callback.v2_runner_item_on_ok(make_result(host, task, item='package-%d' % item, **result()))
+                callback.v2_runner_on_ok(make_result(host, task, **result()))
+                stats.increment('ok', host.name)
+        callback.v2_playbook_on_stats(stats)
+        callback.x_sink.flush()
+        return time.perf_counter() - start
+
+
+def time_emit(events, **env):
+    """Times only interning, encoding and writing of already built events"""
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=os.devnull, **env)
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+        start = time.perf_counter()
+        for event in events:
+            callback.emit(event)
+        callback.x_sink.flush()
+        return time.perf_counter() - start
+
+
+def ping_result():
+    return {'changed': False, 'ping': 'pong'}
+
+
+def load_events(path, compact):
+    with open(path, 'rb') as stream:
+        events = list(reader.iter_json_line_events(stream, BENCH_RUNNER_UUID))
+    if compact:
+        events = list(reader.expand_compact_events(events))
+    for event in events:
+        del event['epoch']
+    return events
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    task_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    items = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+
+    play = FakePlay()
+    hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+    tasks = [FakeTask(play, 'install the application packages %d' % index) for index in range(task_count)]
+
+    rows = []
+    workdir = tempfile.mkdtemp()
+    try:
+        for label, result in (('command results', command_result), ('ping results', ping_result)):
+            full_path = os.path.join(workdir, 'full')
+            compact_path = os.path.join(workdir, 'compact')
+            full_seconds = run(full_path, play, hosts, tasks, items, result)
+            compact_seconds = run(compact_path, play, hosts, tasks, items, result, X_ANSIBLE_RUNNER_COMPACT='1')
+
+            if load_events(full_path, False) != load_events(compact_path, True):
+                print('MISMATCH: expanded compact events differ from the full events (%s)' % label)
+                sys.exit(1)
+
+            reset_path = os.path.join(workdir, 'reset')
+            run(reset_path, play, hosts, tasks, items, result, X_ANSIBLE_RUNNER_COMPACT='1',
+                X_ANSIBLE_RUNNER_COMPACT_MAX='50')
+            if load_events(full_path, False) != load_events(reset_path, True):
+                print('MISMATCH: expanded compact events differ from the full events with a small table (%s)' % label)
+                sys.exit(1)
+            os.remove(reset_path)
+
+            full_encode_seconds = time_emit(load_events(full_path, False))
+            compact_encode_seconds = time_emit(load_events(full_path, False), X_ANSIBLE_RUNNER_COMPACT='1')
+
+            full_size = os.path.getsize(full_path)
+            compact_size = os.path.getsize(compact_path)
+            rows.append(('%s, full' % label, '%.1f MB, hooks %.0f ms, encode+write %.0f ms' % (
+                full_size / 1e6, full_seconds * 1e3, full_encode_seconds * 1e3)))
+            rows.append(('%s, compact' % label, '%.1f MB (%.0f%%), hooks %.0f ms, encode+write %.0f ms' % (
+                compact_size / 1e6, compact_size * 100.0 / full_size, compact_seconds * 1e3,
+                compact_encode_seconds * 1e3)))
+            os.remove(full_path)
+            os.remove(compact_path)
+
+        report('%d hosts x %d tasks x %d items, expanded compact events identical' % (host_count, task_count, items),
+               rows)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures the compression ratio and the CPU cost of the compressed output (X_ANSIBLE_RUNNER_COMPRESSION)
+# against the uncompressed direct sink, by driving the same hooks into a file with each setting, and the
+# cost of reading it back (whole file, and from the last flush point) through the reference reader
+#
+#   python bench/bench_compression.py [host count] [task count]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import BENCH_RUNNER_UUID, RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+import x_stdout_json_lines_reader as reader
+
+
+def run(path, host_count, task_count, **env):
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=path, **env)
+
+    play = FakePlay()
+    hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+    tasks = [FakeTask(play, 'configure the service %d' % index) for index in range(task_count)]
+    stats = FakeStats()
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+
+        start = time.process_time()
+        callback.v2_playbook_on_start(FakePlaybook())
+        callback.v2_playbook_on_play_start(play)
+        for task in tasks:
+            callback.v2_playbook_on_task_start(task, False)
+            for host in hosts:
+                callback.v2_runner_on_start(host, task)
+                callback.v2_runner_on_ok(make_result(host, task, **command_result(stdout='service configured')))
+                stats.increment('ok', host.name)
+        callback.v2_playbook_on_stats(stats)
+        return time.process_time() - start, callback.x_index
+
+
+def read_back(path, compression):
+    start = time.process_time()
+    if compression:
+        stream = reader.open_compressed(path, compression)
+    else:
+        stream = open(path, 'rb', buffering=1024 * 1024)
+    with stream:
+        count = sum(1 for _ in reader.iter_json_line_events(stream, BENCH_RUNNER_UUID))
+    return time.process_time() - start, count
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    task_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    settings = [('uncompressed', None, {})]
+    settings.append(('gzip', 'gzip', {'X_ANSIBLE_RUNNER_COMPRESSION': 'gzip'}))
+    settings.append(('gzip, play points', 'gzip', {'X_ANSIBLE_RUNNER_COMPRESSION': 'gzip',
+                                                    'X_ANSIBLE_RUNNER_COMPRESSION_POINTS': 'play'}))
+    settings.append(('gzip level 1', 'gzip', {'X_ANSIBLE_RUNNER_COMPRESSION': 'gzip',
+                                               'X_ANSIBLE_RUNNER_COMPRESSION_LEVEL': '1'}))
+    try:
+        __import__('zstandard')
+        settings.append(('zstd', 'zstd', {'X_ANSIBLE_RUNNER_COMPRESSION': 'zstd'}))
+        settings.append(('zstd, play points', 'zstd', {'X_ANSIBLE_RUNNER_COMPRESSION': 'zstd',
+                                                        'X_ANSIBLE_RUNNER_COMPRESSION_POINTS': 'play'}))
+    except ImportError:
+        print('zstandard is not installed, skipping zstd')
+
+    rows = []
+    baseline = None
+    workdir = tempfile.mkdtemp()
+    try:
+        for label, compression, env in settings:
+            path = os.path.join(workdir, 'out')
+            cpu_seconds, events = run(path, host_count, task_count, **env)
+            size = os.path.getsize(path)
+            read_seconds, count = read_back(path, compression)
+            if baseline is None:
+                baseline = (cpu_seconds, size)
+
+            row = '%.2f s cpu (%+.0f%%), %.2f MB, ratio %.1fx, %.0f bytes/event, read %.2f s (%d events)' % (
+                cpu_seconds, (cpu_seconds / baseline[0] - 1) * 100, size / 1e6, baseline[1] / float(size),
+                size / float(events), read_seconds, count)
+            if compression:
+                points = reader.read_flush_points(path)
+                row += ', %d flush points' % len(points)
+                os.remove(path + '.points')
+            rows.append((label, row))
+            os.remove(path)
+    finally:
+        shutil.rmtree(workdir)
+
+    report('compressed output (%d hosts x %d tasks)' % (host_count, task_count), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures result deduplication (X_ANSIBLE_RUNNER_DEDUP) on fleet wide tasks, every host returning the
+# same module output (but its own start/end/delta), by driving the same hooks with and without it, and
+# checks the reference reader rebuilds the very same events (results and their changed/rc included)
+#
+#   python bench/bench_dedup.py [host count] [stdout lines per result]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import BENCH_RUNNER_UUID, RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+import x_stdout_json_lines_reader as reader
+
+
+def run(path, play, hosts, tasks, stdout, **env):
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=path,
+                         X_ANSIBLE_RUNNER_STRUCTURED_ONLY='1', **env)
+
+    stats = FakeStats()
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+
+        start = time.perf_counter()
+        callback.v2_playbook_on_start(FakePlaybook())
+        callback.v2_playbook_on_play_start(play)
+        for task in tasks:
+            callback.v2_playbook_on_task_start(task, False)
+            for (index, host) in enumerate(hosts):
+                result = command_result(stdout=stdout)
+                result['start'] = '2020-01-01 00:00:%02d.%06d' % (index % 60, index)
+                callback.v2_runner_on_ok(make_result(host, task, **result))
+                stats.increment('ok', host.name)
+        callback.v2_playbook_on_stats(stats)
+        return time.perf_counter() - start
+
+
+def read_events(path):
+    """Returns the resolved events, without the epoch and durationMs which differ from one run to the next"""
+    with open(path, 'rb') as stream:
+        events = list(reader.resolve_result_refs(reader.iter_json_line_events(stream, BENCH_RUNNER_UUID)))
+    for event in events:
+        event.pop('epoch', None)
+        event.pop('durationMs', None)
+        if event.get('type') == 'playbook' and event.get('event') == 'stats':
+            del event['data']['timing']
+    return events
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    stdout = '\n'.join('package-%d 1.2.%d-1 installed' % (line, line) for line in range(lines))
+
+    # shared by both runs, so their events carry the same ids
+    play = FakePlay()
+    hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+    tasks = [FakeTask(play, 'check the package versions %d' % index) for index in range(5)]
+
+    rows = []
+    events = []
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'out')
+        for label, env in (('full results', {}), ('deduplicated', {'X_ANSIBLE_RUNNER_DEDUP': '1'})):
+            elapsed = run(path, play, hosts, tasks, stdout, **env)
+            rows.append((label, '%.2f s, %.1f MB' % (elapsed, os.path.getsize(path) / 1e6)))
+            events.append(read_events(path))
+            os.remove(path)
+    finally:
+        shutil.rmtree(workdir)
+
+    rows.append(('resolved events identical', str(events[0] == events[1])))
+    report('same result on %d hosts x 5 tasks (%d stdout lines)' % (host_count, lines), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# compares encode and decode cost of the json lines format against msgpack/cbor binary frames
+# on large result payloads, decoding goes through the reference reader (x_stdout_json_lines_reader)
+#
+#   python bench/bench_encoding.py [events] [stdout lines per result]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import BENCH_RUNNER_UUID, RedirectedStdout, load_plugin, make_callback, report
+from standins import command_result
+
+import x_stdout_json_lines_reader as reader
+
+
+def sample_event(index, lines):
+    return {
+        'type': 'task',
+        'event': 'success',
+        'fn': 'v2_runner_on_ok',
+        'epoch': 1600000000000 + index,
+        'playId': '0242ac11-0002-1c7e-b1e1-000000000006',
+        'taskId': '0242ac11-0002-1c7e-b1e1-000000000008',
+        'data': {
+            'name': 'dump logs',
+            'host': 'host-%05d' % index,
+            'changed': True,
+            'rc': 0,
+            'result': command_result(stdout='\n'.join('%d log line with "quotes" and\ttabs' % line
+                                                      for line in range(lines))),
+        },
+    }
+
+
+def encode(encoding, path, events):
+    env = {'X_ANSIBLE_RUNNER_SINK': 'direct', 'X_ANSIBLE_RUNNER_OUTPUT_PATH': path}
+    if encoding != 'jsonl':
+        env['X_ANSIBLE_RUNNER_ENCODING'] = encoding
+    plugin = load_plugin(**env)
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+        start = time.perf_counter()
+        for event in events:
+            callback.print_json(event)
+        callback.x_sink.flush()
+        return time.perf_counter() - start
+
+
+def decode(encoding, path, runner_uuid):
+    start = time.perf_counter()
+    with open(path, 'rb', buffering=1024 * 1024) as stream:
+        if encoding == 'jsonl':
+            count = sum(1 for _ in reader.iter_json_line_events(stream, runner_uuid))
+        else:
+            count = sum(1 for _ in reader.iter_frame_events(stream, runner_uuid))
+    return time.perf_counter() - start, count
+
+
+def main():
+    event_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    events = [sample_event(index, lines) for index in range(event_count)]
+
+    encodings = ['jsonl']
+    for encoding, module in (('msgpack', 'msgpack'), ('cbor', 'cbor2')):
+        try:
+            __import__(module)
+            encodings.append(encoding)
+        except ImportError:
+            print('%s is not installed, skipping %s' % (module, encoding))
+
+    rows = []
+    workdir = tempfile.mkdtemp()
+    try:
+        for encoding in encodings:
+            path = os.path.join(workdir, 'out.' + encoding)
+            encode_seconds = encode(encoding, path, [dict(event) for event in events])
+            size = os.path.getsize(path)
+            decode_seconds, count = decode(encoding, path, BENCH_RUNNER_UUID)
+            skip_seconds, _ = decode(encoding, path, 'some-other-runner')
+            rows.append((encoding, 'encode %.1f ms, decode %.1f ms, skip foreign %.1f ms, %.1f MB (%d events)' % (
+                encode_seconds * 1e3, decode_seconds * 1e3, skip_seconds * 1e3, size / 1e6, count)))
+            os.remove(path)
+    finally:
+        shutil.rmtree(workdir)
+
+    report('%d events with %d stdout lines each' % (event_count, lines), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures the event filter and result projection (X_ANSIBLE_RUNNER_FILTER) on a skip heavy playbook,
+# most tasks are skipped on most hosts and loops skip most of their items, by driving the same hooks
+# without a filter, with skipped events dropped, and with only changed/rc or stdout kept for successful
+# tasks, and checks the projections leave the changed/rc of the events as they are without a filter
+#
+#   python bench/bench_filter.py [host count]
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import BENCH_RUNNER_UUID, RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+import x_stdout_json_lines_reader as reader
+
+TASK_COUNT = 20
+ITEM_COUNT = 10
+
+DROP_SKIPPED = {'drop': ['skipped', 'item_skipped']}
+PROJECTED = {'drop': ['skipped', 'item_skipped'], 'resultKeys': {'*': ['changed', 'rc']}}
+PROJECTED_STDOUT = {'drop': ['skipped', 'item_skipped'], 'resultKeys': {'*': ['stdout']}}
+
+
+def skipped_result(host, task, **result):
+    return make_result(host, task, skip_reason='Conditional result was False', skipped=True, changed=False, **result)
+
+
+def run(path, host_count, **env):
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=path,
+                         X_ANSIBLE_RUNNER_STRUCTURED_ONLY='1', **env)
+
+    play = FakePlay()
+    hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+    stats = FakeStats()
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+
+        hook_calls = 3
+        start = time.perf_counter()
+        callback.v2_playbook_on_start(FakePlaybook())
+        callback.v2_playbook_on_play_start(play)
+        for index in range(TASK_COUNT):
+            looped = index % 4 == 0
+            task = FakeTask(play, 'role step %d' % index, loop='{{ packages }}' if looped else None)
+            callback.v2_playbook_on_task_start(task, False)
+            hook_calls += 1
+            for (host_index, host) in enumerate(hosts):
+                # every task runs on one host in ten, loops run a single item in ten on the others
+                runs = host_index % 10 == index % 10
+                callback.v2_runner_on_start(host, task)
+                hook_calls += 1
+                if looped:
+                    for item in range(ITEM_COUNT):
+                        if item == 0 or runs:
+                            callback.v2_runner_item_on_ok(make_result(host, task, item='package-%d' % item,
+                                                                      **command_result()))
+                        else:
+                            callback.v2_runner_item_on_skipped(skipped_result(host, task, item='package-%d' % item))
+                        hook_calls += 1
+                    callback.v2_runner_on_ok(make_result(host, task, changed=True, results=[], msg='All items completed'))
+                    stats.increment('ok', host.name)
+                elif runs:
+                    callback.v2_runner_on_ok(make_result(host, task, **command_result()))
+                    stats.increment('ok', host.name)
+                else:
+                    callback.v2_runner_on_skipped(skipped_result(host, task))
+                    stats.increment('skipped', host.name)
+                hook_calls += 1
+        callback.v2_playbook_on_stats(stats)
+        elapsed = time.perf_counter() - start
+
+    return elapsed, hook_calls, callback.x_index
+
+
+def statuses(path):
+    """Returns the changed/rc of the successful task and item events, which no projection may change"""
+    with open(path, 'rb') as stream:
+        return [(event['data']['host'], event['data']['changed'], event['data']['rc'])
+                for event in reader.iter_json_line_events(stream, BENCH_RUNNER_UUID)
+                if event.get('event') in ('success', 'item_success')]
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    rows = []
+    baseline = None
+    expected = None
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'out')
+        for label, config in (('no filter', None), ('skipped dropped', DROP_SKIPPED),
+                              ('skipped dropped, changed/rc kept', PROJECTED),
+                              ('skipped dropped, stdout kept', PROJECTED_STDOUT)):
+            env = {'X_ANSIBLE_RUNNER_FILTER': json.dumps(config)} if config is not None else {}
+            elapsed, hook_calls, events = run(path, host_count, **env)
+            if baseline is None:
+                baseline = elapsed
+            rows.append((label, '%.1f us/hook (%.0f%%), %d hooks, %d events' % (
+                elapsed * 1e6 / hook_calls, elapsed * 100 / baseline, hook_calls, events)))
+
+            found = statuses(path)
+            if expected is None:
+                expected = found
+            else:
+                rows.append(('  changed/rc as without a filter', str(found == expected)))
+            os.remove(path)
+    finally:
+        shutil.rmtree(workdir)
+
+    report('skip heavy playbook (%d hosts x %d tasks)' % (host_count, TASK_COUNT), rows)
+
+
+if __name__ == '__main__':
+    main()
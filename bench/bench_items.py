@@ -0,0 +1,107 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures loop item coalescing (X_ANSIBLE_RUNNER_COALESCE_ITEMS) on a with_items task over many items
+# and hosts, with a few failed items, by driving the same hooks with one event per item and coalesced, and
+# checks the batch of a host waiting on a slow item is emitted once the time bound is hit on another host
+#
+#   python bench/bench_items.py [host count] [item count]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import BENCH_RUNNER_UUID, RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+import x_stdout_json_lines_reader as reader
+
+
+def run(path, host_count, item_count, **env):
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=path,
+                         X_ANSIBLE_RUNNER_STRUCTURED_ONLY='1', **env)
+
+    play = FakePlay()
+    hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+    task = FakeTask(play, 'install packages', action='package', loop='{{ packages }}')
+    stats = FakeStats()
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+
+        start = time.perf_counter()
+        callback.v2_playbook_on_start(FakePlaybook())
+        callback.v2_playbook_on_play_start(play)
+        callback.v2_playbook_on_task_start(task, False)
+        for (host_index, host) in enumerate(hosts):
+            callback.v2_runner_on_start(host, task)
+            for item in range(item_count):
+                if (host_index * item_count + item) % 997 == 0:
+                    callback.v2_runner_item_on_failed(make_result(host, task, item='package-%d' % item, failed=True,
+                                                                  msg='No package matching found', rc=1))
+                else:
+                    callback.v2_runner_item_on_ok(make_result(host, task, item='package-%d' % item,
+                                                              **command_result(changed=item % 3 == 0)))
+            callback.v2_runner_on_ok(make_result(host, task, changed=True, results=[], msg='All items completed'))
+            stats.increment('ok', host.name)
+        callback.v2_playbook_on_stats(stats)
+        return time.perf_counter() - start, callback.x_index
+
+
+def slow_item(path, bound_ms):
+    """Returns whether the batch of a host stuck on a slow item is emitted when the time bound is hit while
+    another host reports, ahead of its own final result"""
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=path,
+                         X_ANSIBLE_RUNNER_STRUCTURED_ONLY='1', X_ANSIBLE_RUNNER_COALESCE_ITEMS='1',
+                         X_ANSIBLE_RUNNER_COALESCE_MS=str(bound_ms))
+
+    play = FakePlay()
+    slow, fast = FakeHost('host-00000.example.com'), FakeHost('host-00001.example.com')
+    task = FakeTask(play, 'install packages', action='package', loop='{{ packages }}')
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+        callback.v2_playbook_on_play_start(play)
+        callback.v2_playbook_on_task_start(task, False)
+        callback.v2_runner_on_start(slow, task)
+        callback.v2_runner_on_start(fast, task)
+        callback.v2_runner_item_on_ok(make_result(slow, task, item='package-0', **command_result()))
+        time.sleep(bound_ms * 2 / 1000.0)
+        callback.v2_runner_on_ok(make_result(fast, task, changed=False, results=[], msg='All items completed'))
+        callback.v2_runner_on_ok(make_result(slow, task, changed=False, results=[], msg='All items completed'))
+        callback.v2_playbook_on_stats(FakeStats())
+
+    with open(path, 'rb') as stream:
+        events = [(event['event'], event['data'].get('host'), event['data'].get('final'))
+                  for event in reader.iter_json_line_events(stream, BENCH_RUNNER_UUID) if event['type'] == 'task']
+    return events.index(('items', slow.name, False)) < events.index(('success', fast.name, None)) \
+        if ('items', slow.name, False) in events else False
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    item_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    rows = []
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'out')
+        for label, env in (('one event per item', {}),
+                           ('coalesced', {'X_ANSIBLE_RUNNER_COALESCE_ITEMS': '1'}),
+                           ('coalesced, failures batched', {'X_ANSIBLE_RUNNER_COALESCE_ITEMS': '1',
+                                                            'X_ANSIBLE_RUNNER_COALESCE_FAILED': '0'})):
+            elapsed, events = run(path, host_count, item_count, **env)
+            rows.append((label, '%.2f s, %d events, %.1f MB' % (elapsed, events, os.path.getsize(path) / 1e6)))
+            os.remove(path)
+        rows.append(('slow item', 'batch emitted at the time bound %s' % slow_item(path, 50)))
+        os.remove(path)
+    finally:
+        shutil.rmtree(workdir)
+
+    report('with_items over %d items on %d hosts' % (item_count, host_count), rows)
+
+
+if __name__ == '__main__':
+    main()
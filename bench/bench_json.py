@@ -0,0 +1,178 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# checks every available json backend against the output of the original AnsibleJSONEncoder over a corpus
+# of ansible result objects, the "ansible" backend byte for byte, the opt-in compact ones byte for byte once
+# the original output is rewritten with compact separators (orjson only differs where documented), then
+# times each backend
+#
+#   python bench/bench_json.py [repeat]
+
+import datetime
+import json
+import sys
+import time
+
+from common import load_plugin, report
+
+from ansible.parsing.ajson import AnsibleJSONEncoder
+from ansible.parsing.yaml.objects import AnsibleVaultEncryptedUnicode
+from ansible.playbook.task import Task
+from ansible.utils.unsafe_proxy import wrap_var
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+class HostVarsLike(Mapping):
+    """A non dict mapping, as ansible's HostVars"""
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+
+def command_result(lines):
+    stdout = '\n'.join('line %d: ünïcödé \t "quoted" \\ back\\slash' % index for index in range(lines))
+    return {
+        'cmd': ['bash', '-c', 'echo'],
+        'stdout': stdout,
+        'stderr': '',
+        'rc': 0,
+        'start': '2020-12-01 10:00:00.123456',
+        'end': '2020-12-01 10:00:01.123456',
+        'delta': '0:00:01.000000',
+        'changed': True,
+        'invocation': {'module_args': {'_raw_params': 'echo', '_uses_shell': True, 'warn': True, 'chdir': None}},
+        'stdout_lines': stdout.splitlines(),
+        'stderr_lines': [],
+    }
+
+
+def corpus():
+    vault = AnsibleVaultEncryptedUnicode(b'$ANSIBLE_VAULT;1.1;AES256\n3361626364656667')
+    task = Task.load({'name': 'install', 'apt': {'name': ['nginx', 'curl'], 'state': 'present'}, 'loop': '{{ pkgs }}'})
+
+    return [
+        ('command result', command_result(20)),
+        ('large command result', command_result(5000)),
+        ('failed result', {'changed': False, 'failed': True, 'msg': 'non-zero return code', 'rc': 2,
+                           'stderr': 'E: Unable to locate package nginx-extras\n', 'stdout': ''}),
+        ('loop results', {'changed': True, 'msg': 'All items completed',
+                          'results': [dict(command_result(2), item=index, ansible_loop_var='item') for index in range(50)]}),
+        ('stat result', {'changed': False, 'stat': {'exists': True, 'mode': '0644', 'size': 1024, 'uid': 0,
+                                                    'mtime': 1606816800.123, 'atime': 1606816800.5, 'isdir': False,
+                                                    'checksum': 'da39a3ee5e6b4b0d3255bfef95601890afd80709'}}),
+        ('facts', {'ansible_facts': {'ansible_hostname': 'web-01', 'ansible_processor_vcpus': 8,
+                                     'ansible_loadavg': {'1m': 0.25, '5m': 0.5, '15m': 0.75},
+                                     'ansible_all_ipv4_addresses': ['10.0.0.1', '172.17.0.1'],
+                                     'ansible_env': {'HOME': '/root', 'PATH': '/usr/bin:/bin'}}}),
+        ('unsafe values', {'msg': wrap_var('{{ not templated }}'), 'items': wrap_var(['a', 'b']),
+                           'raw': wrap_var(b'unsafe bytes')}),
+        ('vaulted value', {'password': vault, 'nested': [vault]}),
+        ('dates', {'date': datetime.date(2020, 12, 1), 'datetime': datetime.datetime(2020, 12, 1, 10, 0, 0, 123456)}),
+        ('hostvars mapping', {'hostvars': HostVarsLike({'web-01': {'ansible_host': '10.0.0.1'}})}),
+        ('non string keys', {1: 'one', None: 'none', False: 'false', 2.5: 'float'}),
+        ('control characters', {'line': '\x00\x01\x1f\x7f\b\f\n\r\t  / \U0001f600'}),
+        ('task serialization', task.serialize()),
+        ('stdout line event', {'type': 'stdout', 'epoch': 1606816800123, 'fn': 'v2_runner_on_ok',
+                               'line': 'changed: [web-01] => (item=nginx)', 'i': 42,
+                               'playId': '0242ac11-0002-1c7e-b1e1-000000000006'}),
+    ]
+
+
+# values whose json is semantically the same, but not byte for byte (see OrjsonBackend)
+KNOWN_DIVERGENT = [
+    ('exponent floats', {'big': 1e16, 'small': 1e-07}),
+    ('integer over 64 bits (falls back to stdlib)', {'big': 2 ** 70}),
+]
+
+# written as NaN/Infinity by the original encoder, and as null by orjson
+NON_FINITE = ('non finite floats', {'nan': float('nan'), 'inf': float('inf'), '-inf': float('-inf')})
+
+
+def original(obj):
+    """The output of the original plugin"""
+    return json.dumps(obj, cls=AnsibleJSONEncoder, indent=None, ensure_ascii=False, sort_keys=False)
+
+
+def compacted(encoded):
+    """The original output with compact separators, the values (and key order) as the original encoder wrote them"""
+    return json.dumps(json.loads(encoded), ensure_ascii=False, separators=(',', ':'))
+
+
+def mismatch(backend, label, expected, actual):
+    print('MISMATCH %s / %s\n  expected: %s\n  actual:   %s' % (backend, label, expected[:300], actual[:300]))
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    plugin = load_plugin()
+    backends = [plugin.AnsibleJsonBackend(), plugin.StdlibJsonBackend()]
+    for name in ('orjson', 'ujson'):
+        backend = plugin.selectJsonBackend(name)
+        if backend.name == name:
+            backends.append(backend)
+        else:
+            print('%s is not installed, skipping' % name)
+
+    samples = corpus()
+    failed = False
+    for label, obj in samples + [NON_FINITE]:
+        if backends[0].dumps(obj) != original(obj):
+            mismatch(backends[0].name, label, original(obj), backends[0].dumps(obj))
+            failed = True
+
+    for backend in backends[1:]:
+        for label, obj in samples:
+            if backend.dumps(obj) != compacted(original(obj)):
+                mismatch(backend.name, label, compacted(original(obj)), backend.dumps(obj))
+                failed = True
+        for label, obj in KNOWN_DIVERGENT:
+            if json.loads(backend.dumps(obj)) != json.loads(original(obj)):
+                print('MISMATCH %s / %s (semantic)' % (backend.name, label))
+                failed = True
+
+        label, obj = NON_FINITE
+        expected = '{"nan":null,"inf":null,"-inf":null}' if backend.name == 'orjson' else compacted(original(obj))
+        if backend.dumps(obj) != expected:
+            mismatch(backend.name, label, expected, backend.dumps(obj))
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+    small = samples[-1][1]
+    rows = []
+    for backend in backends:
+        encoded = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for label, obj in samples:
+                encoded += len(backend.dumps(obj))
+        elapsed = time.perf_counter() - start
+
+        small_start = time.perf_counter()
+        for _ in range(repeat * 100):
+            backend.dumps(small)
+        small_elapsed = time.perf_counter() - small_start
+
+        rows.append((backend.name, 'corpus %.1f MB/sec, stdout line events %.0f/sec' % (
+            encoded / elapsed / 1e6, repeat * 100 / small_elapsed)))
+
+    report('all backends conform to AnsibleJSONEncoder over %d corpus objects, throughput:' % len(samples), rows)
+
+
+if __name__ == '__main__':
+    main()
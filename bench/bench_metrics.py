@@ -0,0 +1,66 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures the cost of the self instrumentation, by driving the same hooks with metrics disabled
+# and enabled, and prints the phase breakdown the metrics event reports for the enabled run
+#
+#   python bench/bench_metrics.py [host count]
+
+import os
+import sys
+import time
+
+from common import RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+
+def run(host_count, **env):
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=os.devnull, **env)
+
+    play = FakePlay()
+    hosts = [FakeHost('host-%05d' % index) for index in range(host_count)]
+    tasks = [FakeTask(play, 'task %d' % index) for index in range(5)]
+    stats = FakeStats()
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+
+        start = time.perf_counter()
+        callback.v2_playbook_on_start(FakePlaybook())
+        callback.v2_playbook_on_play_start(play)
+        for task in tasks:
+            callback.v2_playbook_on_task_start(task, False)
+            for host in hosts:
+                callback.v2_runner_on_start(host, task)
+                callback.v2_runner_on_ok(make_result(host, task, **command_result()))
+                stats.increment('ok', host.name)
+        callback.v2_playbook_on_stats(stats)
+        elapsed = time.perf_counter() - start
+
+    hook_calls = 3 + len(tasks) * (1 + 2 * len(hosts))
+    metrics = callback.x_metrics.event('stats') if callback.x_metrics is not None else None
+    return elapsed, hook_calls, metrics
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    rows = []
+    for label, env in (('metrics disabled', {}), ('metrics enabled', {'X_ANSIBLE_RUNNER_METRICS': '1'})):
+        elapsed, hook_calls, metrics = run(host_count, **env)
+        rows.append((label, '%.1f us/hook, %d hooks' % (elapsed * 1e6 / hook_calls, hook_calls)))
+
+    for phase in ('total', 'super', 'build', 'emit'):
+        histogram = metrics['data']['hooks']['v2_runner_on_ok'][phase]
+        rows.append(('  v2_runner_on_ok %s' % phase, 'p50 %.3f ms, p99 %.3f ms, total %.0f ms' % (
+            histogram['p50Ms'], histogram['p99Ms'], histogram['totalMs'])))
+
+    for kind, entry in sorted(metrics['data']['events'].items()):
+        rows.append(('  %s' % kind, '%d events, %.0f bytes/event, encode p50 %.3f ms, write p50 %.3f ms' % (
+            entry['count'], entry['bytes'] / float(entry['count']), entry['encode']['p50Ms'], entry['write']['p50Ms'])))
+
+    report('self instrumentation overhead (%d hosts x 5 tasks)' % host_count, rows)
+
+
+if __name__ == '__main__':
+    main()
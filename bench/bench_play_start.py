@@ -0,0 +1,98 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# checks that extractPlayHeaderForJson emits exactly what cleansePlayForJson(play.serialize())
+# emitted for a set of real (role heavy) plays, then times both paths
+#
+#   python bench/bench_play_start.py [roles] [tasks per role]
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import load_plugin, report
+
+from ansible.parsing.ajson import AnsibleJSONEncoder
+from ansible.parsing.dataloader import DataLoader
+from ansible.playbook.play import Play
+from ansible.vars.manager import VariableManager
+
+
+def write_roles(roles_path, role_count, tasks_per_role):
+    for role_index in range(role_count):
+        tasks_dir = os.path.join(roles_path, 'role%d' % role_index, 'tasks')
+        handlers_dir = os.path.join(roles_path, 'role%d' % role_index, 'handlers')
+        os.makedirs(tasks_dir)
+        os.makedirs(handlers_dir)
+        with open(os.path.join(tasks_dir, 'main.yml'), 'w') as tasks_file:
+            for task_index in range(tasks_per_role):
+                tasks_file.write('- name: role%d task %d\n  command: echo %d\n  notify: restart%d\n'
+                                 % (role_index, task_index, task_index, role_index))
+        with open(os.path.join(handlers_dir, 'main.yml'), 'w') as handlers_file:
+            handlers_file.write('- name: restart%d\n  command: echo restart\n' % role_index)
+
+
+def play_sources(role_count):
+    roles = ['role%d' % index for index in range(role_count)]
+    return [
+        ('empty play', {'hosts': 'all', 'gather_facts': False}),
+        ('tasks only', {'hosts': 'all', 'tasks': [{'command': 'echo %d' % index} for index in range(50)]}),
+        ('pre/post tasks and handlers', {
+            'hosts': 'web', 'serial': 10, 'vars': {'a': 1},
+            'pre_tasks': [{'debug': 'msg=pre'}],
+            'tasks': [{'command': 'echo', 'notify': 'h'}],
+            'post_tasks': [{'debug': 'msg=post'}],
+            'handlers': [{'name': 'h', 'command': 'echo h'}],
+        }),
+        ('role heavy', {'hosts': 'all', 'become': True, 'roles': roles, 'tasks': [{'command': 'echo'}]}),
+    ]
+
+
+def encode(document):
+    return json.dumps(document, cls=AnsibleJSONEncoder, indent=None, ensure_ascii=False, sort_keys=False)
+
+
+def time_per_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1e3 / repeat
+
+
+def main():
+    role_count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    tasks_per_role = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    plugin = load_plugin()
+    workdir = tempfile.mkdtemp()
+    try:
+        write_roles(os.path.join(workdir, 'roles'), role_count, tasks_per_role)
+        loader = DataLoader()
+        loader.set_basedir(workdir)
+        variable_manager = VariableManager(loader=loader)
+
+        rows = []
+        for label, source in play_sources(role_count):
+            play = Play.load(source, variable_manager=variable_manager, loader=loader)
+
+            serialized = encode(plugin.cleansePlayForJson(play.serialize()))
+            extracted = encode(plugin.extractPlayHeaderForJson(play))
+            if serialized != extracted:
+                print('MISMATCH for %s\n  serialize: %s\n  extract:   %s' % (label, serialized, extracted))
+                sys.exit(1)
+
+            repeat = 20
+            rows.append((label, 'identical, serialize %.3f ms, extract %.3f ms' % (
+                time_per_call(lambda: plugin.cleansePlayForJson(play.serialize()), repeat),
+                time_per_call(lambda: plugin.extractPlayHeaderForJson(play), repeat))))
+
+        report('play start header (%d roles x %d tasks)' % (role_count, tasks_per_role), rows)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
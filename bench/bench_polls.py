@@ -0,0 +1,117 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures async poll and until retry coalescing (X_ANSIBLE_RUNNER_POLL_MS) on an async task polled in
+# rounds over every host (as with poll: 5) and an until loop retrying on every host, by driving the same
+# hooks with every poll emitted and coalesced (all polls of a round arrive well within the interval), and
+# checks the polls sent as ansible-core 2.11 sends them (with its async_status task, which has no play) are
+# reported and coalesced under the polled task
+#
+#   python bench/bench_polls.py [host count] [poll count]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import BENCH_RUNNER_UUID, RedirectedStdout, load_plugin, make_callback, report
+from standins import (FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_async_poll_result,
+                      make_result)
+
+import x_stdout_json_lines_reader as reader
+
+
+def run(path, host_count, poll_count, **env):
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=path,
+                         X_ANSIBLE_RUNNER_STRUCTURED_ONLY='1', **env)
+
+    play = FakePlay()
+    hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+    backup = FakeTask(play, 'back up the database', action='command')
+    wait = FakeTask(play, 'wait for the service', action='uri')
+    stats = FakeStats()
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+
+        start = time.perf_counter()
+        callback.v2_playbook_on_start(FakePlaybook())
+        callback.v2_playbook_on_play_start(play)
+
+        callback.v2_playbook_on_task_start(backup, False)
+        for host in hosts:
+            callback.v2_runner_on_start(host, backup)
+        for poll in range(poll_count):
+            for (index, host) in enumerate(hosts):
+                callback.v2_runner_on_async_poll(make_result(host, backup, ansible_job_id='%d.%d' % (index, index),
+                                                             started=1, finished=0))
+        for (index, host) in enumerate(hosts):
+            result = dict(command_result(stdout='backup written'), ansible_job_id='%d.%d' % (index, index), finished=1)
+            callback.v2_runner_on_async_ok(make_result(host, backup, **result))
+            callback.v2_runner_on_ok(make_result(host, backup, **result))
+            stats.increment('ok', host.name)
+
+        callback.v2_playbook_on_task_start(wait, False)
+        for host in hosts:
+            callback.v2_runner_on_start(host, wait)
+        for attempt in range(1, poll_count):
+            for host in hosts:
+                callback.v2_runner_retry(make_result(host, wait, failed=True, msg='Status code was -1',
+                                                    attempts=attempt, retries=poll_count))
+        for host in hosts:
+            callback.v2_runner_on_ok(make_result(host, wait, status=200, attempts=poll_count, changed=False))
+            stats.increment('ok', host.name)
+
+        callback.v2_playbook_on_stats(stats)
+        return time.perf_counter() - start, callback.x_index
+
+
+def parentless_polls(path, poll_count):
+    """Returns whether the polls carrying the async_status task are reported (once, then coalesced) under the
+    play and task they poll"""
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=path)
+
+    play = FakePlay()
+    host = FakeHost('host-00000.example.com')
+    backup = FakeTask(play, 'back up the database', action='command')
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+        callback.v2_playbook_on_play_start(play)
+        callback.v2_playbook_on_task_start(backup, False)
+        callback.v2_runner_on_start(host, backup)
+        for poll in range(poll_count):
+            callback.v2_runner_on_async_poll(make_async_poll_result(host, backup, '1.1', started=1, finished=0))
+        callback.v2_playbook_on_stats(FakeStats())
+
+    with open(path, 'rb') as stream:
+        events = list(reader.iter_json_line_events(stream, BENCH_RUNNER_UUID))
+    polls = [event for event in events if event.get('event') == 'async_poll']
+    errors = [event for event in events if event['type'] == 'stderr']
+    return (not errors and len(polls) == 1 and polls[0]['playId'] == play._uuid and
+            polls[0]['taskId'] == backup._uuid and polls[0]['data']['name'] == backup.name)
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    poll_count = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+
+    rows = []
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'out')
+        for label, env in (('every poll', {'X_ANSIBLE_RUNNER_POLL_MS': '0'}), ('coalesced', {})):
+            elapsed, events = run(path, host_count, poll_count, **env)
+            rows.append((label, '%.2f s, %d events, %.1f MB' % (elapsed, events, os.path.getsize(path) / 1e6)))
+            os.remove(path)
+        rows.append(('async_status polls of 2.11', 'reported under the polled task %s' % parentless_polls(path, 5)))
+        os.remove(path)
+    finally:
+        shutil.rmtree(workdir)
+
+    report('%d async polls and %d retries on %d hosts' % (poll_count, poll_count - 1, host_count), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures what a dashboard has to consume to follow a large run, every host event against the progress
+# events (X_ANSIBLE_RUNNER_PROGRESS_RESULTS) with and without X_ANSIBLE_RUNNER_SUMMARY_ONLY, by driving
+# the same hooks with each setting, and checks the last progress event of the play adds up to the stats
+#
+#   python bench/bench_progress.py [host count]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import BENCH_RUNNER_UUID, RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+import x_stdout_json_lines_reader as reader
+
+
+def run(path, host_count, **env):
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=path, **env)
+
+    play = FakePlay()
+    hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+    tasks = [FakeTask(play, 'roll out the release %d' % index) for index in range(5)]
+    stats = FakeStats()
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+
+        start = time.perf_counter()
+        callback.v2_playbook_on_start(FakePlaybook())
+        callback.v2_playbook_on_play_start(play)
+        for task in tasks:
+            callback.v2_playbook_on_task_start(task, False)
+            for (index, host) in enumerate(hosts):
+                callback.v2_runner_on_start(host, task)
+                if index % 100 == 0:
+                    callback.v2_runner_on_failed(make_result(host, task, failed=True, msg='non-zero return code',
+                                                             **command_result(rc=1)))
+                    stats.increment('failures', host.name)
+                elif index % 10 == 0:
+                    callback.v2_runner_on_skipped(make_result(host, task, skipped=True, changed=False,
+                                                              skip_reason='Conditional result was False'))
+                    stats.increment('skipped', host.name)
+                else:
+                    callback.v2_runner_on_ok(make_result(host, task, **command_result(changed=index % 2 == 0)))
+                    stats.increment('ok', host.name)
+        callback.v2_playbook_on_stats(stats)
+        return time.perf_counter() - start, callback.x_index
+
+
+def last_play_counts(path):
+    with open(path, 'rb') as stream:
+        progress = [event for event in reader.iter_json_line_events(stream, BENCH_RUNNER_UUID)
+                    if event.get('type') == 'progress']
+    return progress[-1]['data']['play'] if progress else None
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    rows = []
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'out')
+        for label, env in (('every host event', {}),
+                           ('progress every 1000 results', {'X_ANSIBLE_RUNNER_PROGRESS_RESULTS': '1000'}),
+                           ('summary only', {'X_ANSIBLE_RUNNER_SUMMARY_ONLY': '1',
+                                             'X_ANSIBLE_RUNNER_PROGRESS_RESULTS': '1000'})):
+            elapsed, events = run(path, host_count, **env)
+            rows.append((label, '%.2f s, %d events, %.1f MB' % (elapsed, events, os.path.getsize(path) / 1e6)))
+            counts = last_play_counts(path)
+            if counts is not None:
+                rows.append(('  last play counts', ', '.join('%s %s' % (key, counts[key]) for key in (
+                    'ok', 'changed', 'failed', 'skipped', 'inFlight'))))
+            os.remove(path)
+    finally:
+        shutil.rmtree(workdir)
+
+    report('following %d hosts x 5 tasks' % host_count, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures the consumer side on a synthetic json lines output (events of the runner interleaved with
+# lines of another runner and plain output), a readline + startswith + json.loads loop against the
+# mmap scan of the reference reader, building the on-disk event index, and finding the failures of a
+# single task through the index, and checks an index instance finds the events another instance indexed
+# after it was opened, this does not need ansible
+#
+#   python bench/bench_reader.py [host count] [task count]
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import BENCH_RUNNER_UUID, report
+
+import x_stdout_json_lines_reader as reader
+
+OTHER_RUNNER_UUID = '11111111-1111-4111-8111-111111111111'
+
+
+def write_output(path, host_count, task_count):
+    prefix = BENCH_RUNNER_UUID + ' '
+    index = 0
+    task_ids = []
+    with open(path, 'w') as stream:
+        for task in range(task_count):
+            task_id = '0242ac11-0002-1c7e-b1e1-%012d' % task
+            task_ids.append(task_id)
+            for host in range(host_count):
+                failed = (host + task) % 50 == 0
+                event = {
+                    'type': 'task',
+                    'event': 'failed' if failed else 'success',
+                    'fn': 'v2_runner_on_failed' if failed else 'v2_runner_on_ok',
+                    'epoch': 1600000000000 + index,
+                    'playId': '0242ac11-0002-1c7e-b1e1-000000000001',
+                    'taskId': task_id,
+                    'data': {
+                        'name': 'task %d' % task,
+                        'host': 'host-%05d.example.com' % host,
+                        'changed': True,
+                        'rc': 1 if failed else 0,
+                        'result': {'stdout': 'service configured\n' * 5, 'rc': 1 if failed else 0, 'changed': True},
+                    },
+                    'i': index,
+                }
+                index += 1
+                stream.write(prefix + json.dumps(event, separators=(',', ':')) + '\n')
+                stream.write('ok: [host-%05d.example.com]\n' % host)
+                stream.write(OTHER_RUNNER_UUID + ' {"type":"stdout","line":"ok","i":%d}\n' % index)
+    return index, task_ids
+
+
+def append_host(path, index, host):
+    """Appends an event of a host not seen so far, as a live run would"""
+    event = {'type': 'task', 'event': 'success', 'i': index, 'data': {'host': host}}
+    with open(path, 'a') as stream:
+        stream.write(BENCH_RUNNER_UUID + ' ' + json.dumps(event, separators=(',', ':')) + '\n')
+
+
+def readline_loop(path):
+    prefix = BENCH_RUNNER_UUID + ' '
+    count = 0
+    with open(path) as stream:
+        for line in stream:
+            if line.startswith(prefix):
+                json.loads(line[len(prefix):])
+                count += 1
+    return count
+
+
+def scan_only(path):
+    return sum(1 for _ in reader.iter_lazy_events(path, BENCH_RUNNER_UUID))
+
+
+def scan_and_parse(path):
+    return sum(1 for event in reader.iter_lazy_events(path, BENCH_RUNNER_UUID) if event.event)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    task_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'out.jsonl')
+    index_path = os.path.join(workdir, 'out.index')
+    try:
+        events, task_ids = write_output(path, host_count, task_count)
+        rows = [('output', '%.1f MB, %d events of the runner' % (os.path.getsize(path) / 1e6, events))]
+
+        for label, fn in (('readline + startswith + json.loads', readline_loop),
+                          ('mmap scan, not decoded', scan_only),
+                          ('mmap scan, decoded', scan_and_parse)):
+            seconds, count = timed(fn, path)
+            rows.append((label, '%.2f s (%d events)' % (seconds, count)))
+
+        with reader.EventIndex(index_path, path, BENCH_RUNNER_UUID) as index:
+            seconds, count = timed(index.update)
+            rows.append(('index build', '%.2f s (%d events), %.1f MB index' % (
+                seconds, count, os.path.getsize(index_path) / 1e6)))
+
+            seconds, count = timed(index.update)
+            rows.append(('index update, nothing appended', '%.4f s (%d events)' % (seconds, count)))
+
+            task_id = task_ids[len(task_ids) // 2]
+            seconds, failures = timed(lambda: list(index.events(task_id=task_id, event='failed')))
+            rows.append(('failures of one task', '%.4f s (%d events)' % (seconds, len(failures))))
+
+            with reader.EventIndex(index_path, path, BENCH_RUNNER_UUID) as other:
+                append_host(path, events, 'host-added.example.com')
+                index.update()
+                found = other.find(host='host-added.example.com')
+                rows.append(('shared index', 'host indexed by another instance found %s, reindexed %d events' % (
+                    [i for (i, _) in found] == [events], other.update())))
+    finally:
+        shutil.rmtree(workdir)
+
+    report('json lines reader (%d hosts x %d tasks)' % (host_count, task_count), rows)
+
+
+if __name__ == '__main__':
+    main()
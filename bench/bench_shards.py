@@ -0,0 +1,142 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures sharded output (X_ANSIBLE_RUNNER_SHARDS) for parallel consumers, by driving the same hooks into
+# a single output and into shards routed by host, with the control events written to every shard or to a
+# control shard, timing the parse of each shard (parallel consumers take as long as the largest one), and
+# checks the merged shards give back the events of the single output, then does the same with the captured
+# output of the default callback (on a tenth of the hosts), which goes to the shard of its host, and with
+# compact events (X_ANSIBLE_RUNNER_COMPACT, with a small table so it is reset along the way), checking
+# the shards expanded one by one and merged give back the full events and every host stays in one shard
+#
+#   python bench/bench_shards.py [host count] [shard count]
+
+import gc
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import BENCH_RUNNER_UUID, RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+import x_stdout_json_lines_reader as reader
+
+
+def run(path, host_count, structured_only='1', **env):
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=path,
+                         X_ANSIBLE_RUNNER_STRUCTURED_ONLY=structured_only, **env)
+
+    play = FakePlay()
+    hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+    tasks = [FakeTask(play, 'configure the service %d' % index) for index in range(10)]
+    stats = FakeStats()
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+
+        start = time.perf_counter()
+        callback.v2_playbook_on_start(FakePlaybook())
+        callback.v2_playbook_on_play_start(play)
+        for task in tasks:
+            callback.v2_playbook_on_task_start(task, False)
+            for host in hosts:
+                callback.v2_runner_on_start(host, task)
+                callback.v2_runner_on_ok(make_result(host, task, **command_result(stdout='service configured')))
+                stats.increment('ok', host.name)
+        callback.v2_playbook_on_stats(stats)
+        return time.perf_counter() - start
+
+
+def parse(path):
+    # the events of the other shards are kept for the merge, keep the collector from walking them
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        with open(path, 'rb') as stream:
+            events = list(reader.iter_json_line_events(stream, BENCH_RUNNER_UUID))
+        return time.perf_counter() - start, events
+    finally:
+        gc.enable()
+
+
+def summary(events):
+    return [(event['i'], event['type'], event.get('event'), event.get('data', {}).get('host'), event.get('line'))
+            for event in events]
+
+
+def split_hosts(shards):
+    """Returns the number of hosts whose events were written to more than one shard"""
+    shards_of_host = {}
+    for (shard, events) in enumerate(shards):
+        for event in events:
+            data = event.get('data')
+            host = data.get('host') if isinstance(data, dict) else event.get('host')
+            if host is not None:
+                shards_of_host.setdefault(host, set()).add(shard)
+    return sum(1 for shards in shards_of_host.values() if len(shards) > 1)
+
+
+def compact_round_trip(path, host_count, shard_count):
+    rows = []
+    run(path, host_count)
+    _, expected = parse(path)
+    os.remove(path)
+
+    for label, control in (('%d compact shards, control events in all' % shard_count, 'all'),
+                           ('%d compact shards and a control shard' % shard_count, 'control')):
+        run(path, host_count, X_ANSIBLE_RUNNER_SHARDS=str(shard_count), X_ANSIBLE_RUNNER_SHARD_CONTROL=control,
+            X_ANSIBLE_RUNNER_COMPACT='1', X_ANSIBLE_RUNNER_COMPACT_MAX='50')
+        paths = sorted(glob.glob(path + '.*'))
+        shards = [list(reader.expand_compact_events(parse(shard)[1])) for shard in paths]
+        merged = list(reader.iter_merged_shards(shards))
+        rows.append((label, 'merged identical %s, %d hosts in more than one shard' % (
+            summary(merged) == summary(expected), split_hosts(shards))))
+        for shard in paths:
+            os.remove(shard)
+    return rows
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    shard_count = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'out')
+        for title, hosts, structured_only in (('sharded output (%d hosts x 10 tasks)', host_count, '1'),
+                                              ('sharded output with captured output (%d hosts x 10 tasks)',
+                                               max(host_count // 10, 1), '0')):
+            rows = []
+            elapsed = run(path, hosts, structured_only)
+            seconds, expected = parse(path)
+            rows.append(('single output', '%.2f s, %.1f MB, parsed in %.2f s' % (
+                elapsed, os.path.getsize(path) / 1e6, seconds)))
+            os.remove(path)
+
+            for label, control in (('%d shards, control events in all' % shard_count, 'all'),
+                                   ('%d shards and a control shard' % shard_count, 'control')):
+                elapsed = run(path, hosts, structured_only, X_ANSIBLE_RUNNER_SHARDS=str(shard_count),
+                              X_ANSIBLE_RUNNER_SHARD_CONTROL=control)
+                paths = sorted(glob.glob(path + '.*'))
+                parsed = [parse(shard) for shard in paths]
+                sizes = [os.path.getsize(shard) / 1e6 for shard in paths]
+                merged = list(reader.iter_merged_shards([events for (_, events) in parsed]))
+                rows.append((label, '%.2f s, %s MB, slowest shard parsed in %.2f s, merged identical %s' % (
+                    elapsed, '/'.join('%.1f' % size for size in sizes), max(seconds for (seconds, _) in parsed),
+                    summary(merged) == summary(expected))))
+                for shard in paths:
+                    os.remove(shard)
+
+            report(title % hosts, rows)
+
+        hosts = max(host_count // 10, 1)
+        report('compact sharded output (%d hosts x 10 tasks)' % hosts, compact_round_trip(path, hosts, shard_count))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# compares events/sec of the Display path against the direct buffered sink
+#
+#   python bench/bench_sink.py [event count]
+
+import os
+import sys
+
+from common import RedirectedStdout, load_plugin, make_callback, report, timed
+
+
+def sample_event(index):
+    return {
+        'type': 'task',
+        'event': 'success',
+        'fn': 'v2_runner_on_ok',
+        'epoch': 1600000000000 + index,
+        'playId': '0242ac11-0002-1c7e-b1e1-000000000006',
+        'taskId': '0242ac11-0002-1c7e-b1e1-000000000008',
+        'data': {
+            'name': 'install packages',
+            'host': 'host-%05d' % (index % 3000),
+            'changed': True,
+            'rc': 0,
+            'result': {'changed': True, 'rc': 0, 'stdout': 'ok', 'stdout_lines': ['ok']},
+        },
+    }
+
+
+def run(count, **env):
+    plugin = load_plugin(**env)
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+        rate = timed(lambda index: callback.print_json(sample_event(index)), count)
+        callback.x_sink.flush()
+    return rate
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    rows = [
+        ('display', run(count)),
+        ('direct, boundary flush', run(count, X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=os.devnull)),
+        ('direct, flush every 100 events', run(count, X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=os.devnull,
+                                               X_ANSIBLE_RUNNER_FLUSH_EVENTS='100')),
+        ('direct, flush every 50ms', run(count, X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=os.devnull,
+                                         X_ANSIBLE_RUNNER_FLUSH_MS='50')),
+        ('direct, flush every event', run(count, X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=os.devnull,
+                                          X_ANSIBLE_RUNNER_FLUSH_EVENTS='1')),
+    ]
+
+    report('print_json events/sec (%d events)' % count, [(label, '%.0f' % rate) for label, rate in rows])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# measures the per-event overhead of rendering, capturing and re-emitting the wrapped
+# default callback output, by driving the same hooks with and without structured only mode
+#
+#   python bench/bench_structured_only.py [host count]
+
+import os
+import sys
+import time
+
+from common import RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+
+def run(host_count, **env):
+    plugin = load_plugin(X_ANSIBLE_RUNNER_SINK='direct', X_ANSIBLE_RUNNER_OUTPUT_PATH=os.devnull, **env)
+
+    play = FakePlay()
+    hosts = [FakeHost('host-%05d' % index) for index in range(host_count)]
+    tasks = [FakeTask(play, 'task %d' % index) for index in range(5)]
+    stats = FakeStats()
+
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+
+        start = time.perf_counter()
+        callback.v2_playbook_on_start(FakePlaybook())
+        callback.v2_playbook_on_play_start(play)
+        for task in tasks:
+            callback.v2_playbook_on_task_start(task, False)
+            for host in hosts:
+                callback.v2_runner_on_ok(make_result(host, task, **command_result()))
+                stats.increment('ok', host.name)
+        callback.v2_playbook_on_stats(stats)
+        elapsed = time.perf_counter() - start
+
+    hook_calls = 3 + len(tasks) * (1 + len(hosts))
+    return elapsed, hook_calls, callback.x_index
+
+
+def main():
+    host_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    rows = []
+    for label, env in (('wrapped default callback', {}), ('structured only', {'X_ANSIBLE_RUNNER_STRUCTURED_ONLY': '1'})):
+        elapsed, hook_calls, events = run(host_count, **env)
+        rows.append((label, '%.1f us/hook, %d hooks, %d events' % (elapsed * 1e6 / hook_calls, hook_calls, events)))
+
+    report('per hook overhead (%d hosts x 5 tasks)' % host_count, rows)
+
+
+if __name__ == '__main__':
+    main()
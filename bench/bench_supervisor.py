@@ -0,0 +1,142 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# runs a batch of small connection: local playbooks (one of them failing) through the multi playbook
+# supervisor (x_ansible_runner_supervisor.py) one at a time and concurrently, with the callback plugin of
+# this tree as the stdout callback, and checks every run has its own runner uuid, its playbook events, the
+# expected exit status and the warning ansible writes to stderr (about a missing inventory) as an output
+# event of that stream, this needs ansible-playbook next to the python running it
+#
+#   python bench/bench_supervisor.py [run count] [concurrency]
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import BENCH_RUNNER_UUID, report
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLAYBOOK = '''
+- hosts: localhost
+  connection: local
+  gather_facts: false
+  tasks:
+    - name: wait a little
+      command: sleep 1
+    - name: report
+      debug:
+        msg: "run {{ run }}"
+    - name: fail when asked to
+      fail:
+        msg: "run {{ run }} failed"
+      when: fail
+'''
+
+
+def write_batch(workdir, run_count):
+    playbook = os.path.join(workdir, 'playbook.yml')
+    with open(playbook, 'w') as stream:
+        stream.write(PLAYBOOK)
+
+    # the callback plugin directory holds the plugin only, ansible would try to load any other module as well
+    plugins = os.path.join(workdir, 'callback_plugins')
+    os.mkdir(plugins)
+    shutil.copy(os.path.join(REPO_DIR, 'x_stdout_json_lines.py'), plugins)
+
+    batch = os.path.join(workdir, 'batch.jsonl')
+    with open(batch, 'w') as stream:
+        for run in range(run_count):
+            extra_vars = {'run': run, 'fail': run == run_count - 1, 'ansible_python_interpreter': sys.executable}
+            args = [playbook, '-i', 'localhost,', '-i', os.path.join(workdir, 'missing'), '-e', json.dumps(extra_vars)]
+            stream.write(json.dumps({'id': 'job-%d' % run, 'args': args}) + '\n')
+    return batch
+
+
+def supervise(workdir, batch, concurrency):
+    env = dict(os.environ)
+    env.update({
+        'X_ANSIBLE_RUNNER_UUID': BENCH_RUNNER_UUID,
+        'ANSIBLE_CONFIG': os.path.join(REPO_DIR, 'ansible.cfg'),
+        'ANSIBLE_CALLBACK_PLUGINS': os.path.join(workdir, 'callback_plugins'),
+        'ANSIBLE_STDOUT_CALLBACK': 'x_stdout_json_lines',
+        'ANSIBLE_DEPRECATION_WARNINGS': 'False',
+        'PATH': os.path.dirname(sys.executable) + os.pathsep + env.get('PATH', ''),
+    })
+
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, os.path.join(REPO_DIR, 'x_ansible_runner_supervisor.py'),
+                              '--concurrency', str(concurrency), batch], env=env, stdout=subprocess.PIPE)
+    return time.perf_counter() - start, process.returncode, process.stdout.decode('utf-8').splitlines()
+
+
+def check(lines, run_count):
+    """Returns a description of what is wrong with the demultiplexed stream, None when it is as expected"""
+    supervisor_prefix = BENCH_RUNNER_UUID + ' '
+    runs = {}
+    exits = {}
+    events = {}
+    outputs = {}
+    for line in lines:
+        if line.startswith(supervisor_prefix):
+            event = json.loads(line[len(supervisor_prefix):])
+            if event['type'] == 'run' and event['event'] == 'start':
+                runs[event['data']['runnerUuid'] + ' '] = event['runId']
+            elif event['type'] == 'run' and event['event'] == 'exit':
+                exits[event['runId']] = event['data']['rc']
+            elif event['type'] == 'run' and event['event'] == 'output':
+                outputs.setdefault(event['runId'], []).append((event.get('stream'), event['line']))
+            continue
+
+        for prefix, run_id in runs.items():
+            if line.startswith(prefix):
+                event = json.loads(line[len(prefix):])
+                events.setdefault(run_id, []).append((event.get('type'), event.get('event')))
+                break
+        else:
+            return 'line of no known run: %s' % line[:80]
+
+    for run in range(run_count):
+        run_id = 'job-%d' % run
+        expected_rc = 2 if run == run_count - 1 else 0
+        if exits.get(run_id) != expected_rc:
+            return '%s exited with %r' % (run_id, exits.get(run_id))
+        if ('playbook', 'stats') not in events.get(run_id, ()):
+            return '%s has no stats event' % run_id
+        for stream, line in outputs.get(run_id, ()):
+            if stream != 'stderr':
+                return '%s wrote to stdout: %s' % (run_id, line[:80])
+        if not any('missing' in line for _, line in outputs.get(run_id, ())):
+            return '%s has no stderr output event of the inventory warning' % run_id
+    return None
+
+
+def main():
+    run_count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    if not os.path.exists(os.path.join(os.path.dirname(sys.executable), 'ansible-playbook')):
+        print('ansible-playbook is not installed next to %s' % sys.executable)
+        sys.exit(1)
+
+    rows = []
+    workdir = tempfile.mkdtemp()
+    try:
+        batch = write_batch(workdir, run_count)
+        for label, limit in (('one at a time', 1), ('%d at a time' % concurrency, concurrency)):
+            elapsed, rc, lines = supervise(workdir, batch, limit)
+            problem = check(lines, run_count)
+            rows.append((label, '%.2f s, %d lines, exit status %d, %s' % (
+                elapsed, len(lines), rc, problem or 'every run demultiplexed')))
+    finally:
+        shutil.rmtree(workdir)
+
+    report('%d connection: local playbooks, the last one failing' % run_count, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# shared helpers for the x_stdout_json_lines benchmarks, these run offline against
+# the plugin module directly (ansible must be importable, no SSH or inventory needed)
+
+import importlib
+import os
+import sys
+import time
+
+from ansible import context
+from ansible.module_utils.common.collections import ImmutableDict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+BENCH_RUNNER_UUID = '00000000-0000-4000-8000-000000000000'
+
+
+def load_plugin(**env):
+    """(Re)imports the plugin module with the given X_ANSIBLE_RUNNER_* environment applied"""
+    for key in list(os.environ):
+        if key.startswith('X_ANSIBLE_RUNNER_'):
+            del os.environ[key]
+
+    os.environ['X_ANSIBLE_RUNNER_UUID'] = BENCH_RUNNER_UUID
+    os.environ.update(env)
+
+    if 'x_stdout_json_lines' in sys.modules:
+        return importlib.reload(sys.modules['x_stdout_json_lines'])
+    return importlib.import_module('x_stdout_json_lines')
+
+
+def make_callback(plugin):
+    """Instantiates the plugin's CallbackModule the way the ansible plugin loader would"""
+    # the wrapped default callback reads a few command line arguments
+    context.CLIARGS = ImmutableDict(check=False, args=(), verbosity=0)
+
+    callback = plugin.CallbackModule()
+    # the plugin has no documented options of its own, it inherits the default callback's
+    callback._load_name = 'default'
+    callback.set_options()
+    return callback
+
+
+class RedirectedStdout:
+    """Points sys.stdout at /dev/null so the Display path can be timed without a terminal"""
+
+    def __enter__(self):
+        self._stdout = sys.stdout
+        sys.stdout = self._devnull = open(os.devnull, 'w')
+        return self
+
+    def __exit__(self, *args):
+        sys.stdout = self._stdout
+        self._devnull.close()
+
+
+def timed(fn, count):
+    """Runs fn(index) count times and returns the events per second"""
+    start = time.perf_counter()
+    for index in range(count):
+        fn(index)
+    elapsed = time.perf_counter() - start
+    return count / elapsed if elapsed else float('inf')
+
+
+def report(title, rows):
+    """Prints a small aligned table of (label, value) rows"""
+    print(title)
+    width = max(len(label) for label, _ in rows)
+    for label, value in rows:
+        print('  %s  %s' % (label.ljust(width), value))
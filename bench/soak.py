@@ -0,0 +1,110 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# soak test for long running playbooks, replays plays of new tasks (with looped items) over the same
+# hosts until the requested number of events is written, and checks with tracemalloc that the memory
+# in use after the first plays stays flat, exits with 1 when it grew by more than the allowed bytes, or
+# when the trend fitted over the second half of the samples (once the allocator settled) adds up to more
+# than half of them over the run, a steady leak of a few bytes per task which would only go past the
+# allowed bytes in a much longer run
+#
+#   python bench/soak.py [event count] [allowed growth bytes] [KEY=VALUE ...]
+
+import gc
+import os
+import sys
+import tracemalloc
+
+from common import RedirectedStdout, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+HOST_COUNT = 50
+TASKS_PER_PLAY = 20
+ITEMS_PER_TASK = 3
+WARMUP_PLAYS = 3
+
+
+def run_play(callback, hosts, stats):
+    play = FakePlay()
+    callback.v2_playbook_on_play_start(play)
+    for index in range(TASKS_PER_PLAY):
+        task = FakeTask(play, 'rolling deploy step %d' % index)
+        callback.v2_playbook_on_task_start(task, False)
+        for host in hosts:
+            callback.v2_runner_on_start(host, task)
+            for item in range(ITEMS_PER_TASK):
+                callback.v2_runner_item_on_ok(make_result(host, task, item='artifact-%d' % item, **command_result()))
+            callback.v2_runner_on_ok(make_result(host, task, **command_result()))
+            stats.increment('ok', host.name)
+
+
+def traced_memory():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def trend(samples):
+    """Returns the least squares slope of the memory samples, in bytes per event"""
+    count = len(samples)
+    mean_events = sum(events for events, _ in samples) / float(count)
+    mean_memory = sum(memory for _, memory in samples) / float(count)
+    spread = sum((events - mean_events) ** 2 for events, _ in samples)
+    if not spread:
+        return 0.0
+    return sum((events - mean_events) * (memory - mean_memory) for events, memory in samples) / spread
+
+
+def main():
+    event_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    allowed_growth = int(sys.argv[2]) if len(sys.argv) > 2 else 64 * 1024
+    env = dict(setting.split('=', 1) for setting in sys.argv[3:])
+    env.setdefault('X_ANSIBLE_RUNNER_SINK', 'direct')
+    env.setdefault('X_ANSIBLE_RUNNER_OUTPUT_PATH', os.devnull)
+
+    plugin = load_plugin(**env)
+    hosts = [FakeHost('host-%05d.example.com' % index) for index in range(HOST_COUNT)]
+    stats = FakeStats()
+
+    tracemalloc.start()
+    with RedirectedStdout():
+        callback = make_callback(plugin)
+        callback.v2_playbook_on_start(FakePlaybook())
+
+        plays = 0
+        baseline = None
+        samples = []
+        while callback.x_index < event_count:
+            run_play(callback, hosts, stats)
+            plays += 1
+            if plays == WARMUP_PLAYS:
+                baseline = traced_memory()
+                samples.append((callback.x_index, baseline))
+            elif baseline is not None and plays % 5 == 0:
+                samples.append((callback.x_index, traced_memory()))
+
+        final = traced_memory()
+        callback.v2_playbook_on_stats(stats)
+    tracemalloc.stop()
+
+    growth = final - baseline
+    samples.append((callback.x_index, final))
+    slope = trend(samples[len(samples) // 2:])
+    trend_growth = slope * (samples[-1][0] - samples[0][0])
+    rows = [('events', '%d in %d plays' % (callback.x_index, plays)),
+            ('after warmup', '%.1f KB' % (baseline / 1024.0))]
+    rows.extend(('after %d events' % events, '%.1f KB' % (memory / 1024.0)) for events, memory in samples[-5:])
+    rows.append(('growth', '%.1f KB (allowed %.1f KB)' % (growth / 1024.0, allowed_growth / 1024.0)))
+    rows.append(('trend', '%.3f bytes/event, %.1f KB over the run (allowed %.1f KB)' % (
+        slope, trend_growth / 1024.0, allowed_growth / 2048.0)))
+    report('soak (%s)' % ' '.join('%s=%s' % item for item in sorted(env.items())), rows)
+
+    if growth > allowed_growth:
+        print('FAILED: traced memory grew by %d bytes over %d events' % (growth, callback.x_index))
+        sys.exit(1)
+    if len(samples) >= 6 and trend_growth > allowed_growth / 2.0:
+        print('FAILED: traced memory grows steadily, %.3f bytes per event' % slope)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# lightweight stand-ins for the ansible objects handed to the callback hooks, they carry
+# only the attributes the plugin and the wrapped default callback actually read, results
+# are real ansible TaskResult objects so clean_copy() costs what it costs in production
+
+import uuid
+
+from ansible.executor.task_result import TaskResult
+from ansible.playbook.task import Task
+
+
+def make_uuid():
+    return str(uuid.uuid4())
+
+
+class FakeHost:
+    def __init__(self, name):
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+    def __str__(self):
+        return self.name
+
+
+class FakePlaybook:
+    def __init__(self, file_name='/bench/playbook.yml'):
+        self._file_name = file_name
+
+
+class FakePlay:
+    def __init__(self, name='bench play', hosts=('all',), strategy='linear'):
+        self._uuid = make_uuid()
+        self.name = name
+        self.hosts = list(hosts)
+        self.strategy = strategy
+        self.check_mode = False
+
+    def get_name(self):
+        return self.name
+
+    def serialize(self):
+        return {
+            'name': self.name,
+            'hosts': self.hosts,
+            'strategy': self.strategy,
+            'gather_facts': False,
+            'pre_tasks': [],
+            'tasks': [],
+            'post_tasks': [],
+            'handlers': [],
+            'roles': [],
+            'uuid': self._uuid,
+        }
+
+
+class FakeBlock:
+    def __init__(self, play):
+        self._play = play
+
+
+class FakeTask:
+    def __init__(self, play, name, action='command', args=None, loop=None, path='/bench/playbook.yml:1'):
+        self._uuid = make_uuid()
+        self._parent = FakeBlock(play)
+        self._role = None
+        self.name = name
+        self.action = action
+        self.args = args if args is not None else {'_raw_params': 'echo bench'}
+        self.loop = loop
+        self.no_log = False
+        self.check_mode = False
+        self.ignore_errors = None
+        self.delegate_to = None
+        self._path = path
+        self._attributes = {'action': action, 'name': name}
+
+    def get_name(self, include_role_fqcn=True):
+        return self.name
+
+    def get_path(self):
+        return self._path
+
+    def serialize(self):
+        return {
+            'name': self.name,
+            'action': self.action,
+            'args': self.args,
+            'loop': self.loop,
+            'when': [],
+            'tags': [],
+            'uuid': self._uuid,
+            'parent': {'uuid': self._parent._play._uuid},
+            'parent_type': 'Block',
+        }
+
+    def __str__(self):
+        return 'TASK: %s' % self.name
+
+
+class FakeStats:
+    def __init__(self):
+        self.processed = {}
+        self.failures = {}
+        self.ok = {}
+        self.dark = {}
+        self.changed = {}
+        self.skipped = {}
+        self.rescued = {}
+        self.ignored = {}
+        self.custom = {}
+
+    def increment(self, what, host):
+        self.processed[host] = 1
+        counts = getattr(self, what)
+        counts[host] = counts.get(host, 0) + 1
+
+    def summarize(self, host):
+        return dict(
+            ok=self.ok.get(host, 0),
+            failures=self.failures.get(host, 0),
+            unreachable=self.dark.get(host, 0),
+            changed=self.changed.get(host, 0),
+            skipped=self.skipped.get(host, 0),
+            rescued=self.rescued.get(host, 0),
+            ignored=self.ignored.get(host, 0),
+        )
+
+
+def make_result(host, task, **result):
+    """Builds a real TaskResult for a stand-in host/task with the given module return data"""
+    result.setdefault('_ansible_no_log', False)
+    return TaskResult(host, task, result, {'name': task.name})
+
+
+def make_async_poll_result(host, task, jid, **result):
+    """Builds an async poll TaskResult the way ansible-core 2.11 and later send it, carrying the async_status
+    task created by the task executor (which has no play) and the fields of the polled task"""
+    async_task = Task().load(dict(action='async_status jid=%s' % jid, environment=None))
+    result.setdefault('_ansible_no_log', False)
+    return TaskResult(host, async_task, dict(result, ansible_job_id=jid), task_fields={'name': task.name})
+
+
+def command_result(stdout='ok', rc=0, changed=True):
+    """Module return data shaped like the command module's"""
+    return {
+        'cmd': ['echo', 'bench'],
+        'stdout': stdout,
+        'stderr': '',
+        'rc': rc,
+        'start': '2020-01-01 00:00:00.000000',
+        'end': '2020-01-01 00:00:00.010000',
+        'delta': '0:00:00.010000',
+        'changed': changed,
+        'invocation': {'module_args': {'_raw_params': 'echo bench', 'warn': True, '_uses_shell': False}},
+        'stdout_lines': stdout.splitlines(),
+        'stderr_lines': [],
+    }
@@ -0,0 +1,312 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# replays synthetic event streams (10 to 10,000 hosts, loops with many items, large stdout results and
+# many handlers) through CallbackModule with stand-in tasks/plays/stats, each scenario in its own
+# python process so peak RSS is per scenario, and reports events/sec, bytes/event, peak RSS and the
+# tracemalloc peak/retained bytes per hook call (and per print_str_lines call), the results are saved
+# as json so runs of different commits can be compared
+#
+#   python bench/suite.py [--scenarios name,...] [--env KEY=VALUE ...] [--output results.json]
+#   python bench/suite.py --compare base.json head.json
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from common import REPO_ROOT, load_plugin, make_callback, report
+from standins import FakeHost, FakePlay, FakePlaybook, FakeStats, FakeTask, command_result, make_result
+
+
+def hosts_scenario(host_count, task_count=5):
+    def drive(call, play, stats):
+        hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+        for index in range(task_count):
+            task = FakeTask(play, 'configure the service %d' % index)
+            call('v2_playbook_on_task_start', task, False)
+            for host in hosts:
+                call('v2_runner_on_start', host, task)
+                call('v2_runner_on_ok', make_result(host, task, **command_result()))
+                stats.increment('ok', host.name)
+    return drive
+
+
+def loop_scenario(host_count, task_count, item_count):
+    def drive(call, play, stats):
+        hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+        for index in range(task_count):
+            task = FakeTask(play, 'install packages %d' % index, loop='{{ packages }}')
+            call('v2_playbook_on_task_start', task, False)
+            for host in hosts:
+                call('v2_runner_on_start', host, task)
+                for item in range(item_count):
+                    call('v2_runner_item_on_ok', make_result(host, task, item='package-%d' % item, **command_result()))
+                call('v2_runner_on_ok', make_result(host, task, changed=True, results=[], msg='All items completed'))
+                stats.increment('ok', host.name)
+    return drive
+
+
+def large_stdout_scenario(host_count, task_count, stdout_bytes):
+    line = 'lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor %d\n'
+    stdout = ''.join(line % index for index in range(stdout_bytes // len(line)))
+
+    def drive(call, play, stats):
+        hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+        for index in range(task_count):
+            task = FakeTask(play, 'dump the logs %d' % index)
+            call('v2_playbook_on_task_start', task, False)
+            for host in hosts:
+                call('v2_runner_on_start', host, task)
+                call('v2_runner_on_ok', make_result(host, task, **command_result(stdout=stdout)))
+                stats.increment('ok', host.name)
+    return drive
+
+
+def handlers_scenario(host_count, handler_count):
+    def drive(call, play, stats):
+        hosts = [FakeHost('host-%05d.example.com' % index) for index in range(host_count)]
+        task = FakeTask(play, 'template the configuration')
+        call('v2_playbook_on_task_start', task, False)
+        for host in hosts:
+            call('v2_runner_on_start', host, task)
+            call('v2_runner_on_ok', make_result(host, task, **command_result()))
+            stats.increment('ok', host.name)
+        for index in range(handler_count):
+            handler = FakeTask(play, 'restart service %d' % index, action='service')
+            call('v2_playbook_on_handler_task_start', handler)
+            for host in hosts:
+                call('v2_runner_on_start', host, handler)
+                call('v2_runner_on_ok', make_result(host, handler, changed=True, name='service-%d' % index,
+                                                    state='started'))
+                stats.increment('changed', host.name)
+    return drive
+
+
+SCENARIOS = {
+    'hosts-10': hosts_scenario(10),
+    'hosts-100': hosts_scenario(100),
+    'hosts-1000': hosts_scenario(1000),
+    'hosts-10000': hosts_scenario(10000),
+    'loop-items': loop_scenario(100, 2, 200),
+    'large-stdout': large_stdout_scenario(200, 3, 64 * 1024),
+    'handlers': handlers_scenario(500, 20),
+}
+
+
+class TimedCalls:
+    """Calls the callback hooks, accumulating the time spent inside them"""
+
+    def __init__(self, callback):
+        self._callback = callback
+        self.seconds = 0.0
+        self.calls = 0
+
+    def __call__(self, name, *args):
+        hook = getattr(self._callback, name)
+        start = time.perf_counter()
+        hook(*args)
+        self.seconds += time.perf_counter() - start
+        self.calls += 1
+
+
+class TracedCalls:
+    """Wraps the hooks and print_str_lines of a callback, recording the tracemalloc peak above the
+    memory in use at entry (transient allocations) and the memory still in use at exit (retained)"""
+
+    def __init__(self, callback):
+        self.allocations = {}  # name -> [calls, peak bytes, retained bytes]
+        self._stack = []
+        for name in list(vars(type(callback))):
+            if name.startswith('v2_') or name == 'print_str_lines':
+                setattr(callback, name, self.wrap(name, getattr(callback, name)))
+        self._callback = callback
+
+    def wrap(self, name, fn):
+        stack = self._stack
+
+        def traced(*args, **kwargs):
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            frame = [current, current]
+            stack.append(frame)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stack.pop()
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(frame[1], peak)
+                if stack:
+                    stack[-1][1] = max(stack[-1][1], peak)
+                entry = self.allocations.setdefault(name, [0, 0, 0])
+                entry[0] += 1
+                entry[1] += peak - frame[0]
+                entry[2] += current - frame[0]
+        return traced
+
+    def __call__(self, name, *args):
+        getattr(self._callback, name)(*args)
+
+
+def replay(drive, calls_for, output_path, env):
+    """Drives a scenario through a freshly loaded plugin, writing its events to output_path"""
+    plugin = load_plugin(X_ANSIBLE_RUNNER_OUTPUT_PATH=output_path, **env)
+    play = FakePlay()
+    stats = FakeStats()
+
+    stdout = sys.stdout
+    sys.stdout = open(output_path, 'a')
+    try:
+        callback = make_callback(plugin)
+        calls = calls_for(callback)
+        calls('v2_playbook_on_start', FakePlaybook())
+        calls('v2_playbook_on_play_start', play)
+        drive(calls, play, stats)
+        calls('v2_playbook_on_stats', stats)
+        if hasattr(callback.x_sink, 'flush'):
+            callback.x_sink.flush()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    return callback, calls
+
+
+def run_scenario(name, env):
+    """Runs a single scenario in this process (see main), returning its measurements"""
+    drive = SCENARIOS[name]
+    workdir = tempfile.mkdtemp()
+    output_path = os.path.join(workdir, 'events')
+    try:
+        callback, calls = replay(drive, TimedCalls, output_path, env)
+        output_bytes = os.path.getsize(output_path)
+        events = callback.x_index
+        # ru_maxrss is in kilobytes on linux and in bytes on macos
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        os.remove(output_path)
+
+        allocations = None
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.start()
+            _, traced = replay(drive, TracedCalls, output_path, env)
+            tracemalloc.stop()
+            allocations = dict((hook, {
+                'calls': count,
+                'peakBytesPerCall': round(peak / float(count)),
+                'retainedBytesPerCall': round(retained / float(count)),
+            }) for hook, (count, peak, retained) in traced.allocations.items())
+    finally:
+        for entry in os.listdir(workdir):
+            os.remove(os.path.join(workdir, entry))
+        shutil.rmtree(workdir)
+
+    return {
+        'scenario': name,
+        'hookCalls': calls.calls,
+        'hookSeconds': round(calls.seconds, 6),
+        'events': events,
+        'eventsPerSecond': round(events / calls.seconds, 1) if calls.seconds else None,
+        'bytes': output_bytes,
+        'bytesPerEvent': round(output_bytes / float(events), 1) if events else None,
+        'peakRssBytes': peak_rss,
+        'allocations': allocations,
+    }
+
+
+def describe_environment(env):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT,
+                                         stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    from ansible import __version__ as ansible_version
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'ansible': ansible_version,
+        'env': env,
+        'epoch': int(time.time() * 1000),
+    }
+
+
+def compare(base_path, head_path):
+    with open(base_path) as stream:
+        base = json.load(stream)
+    with open(head_path) as stream:
+        head = json.load(stream)
+
+    base_results = dict((result['scenario'], result) for result in base['results'])
+    rows = []
+    for result in head['results']:
+        previous = base_results.get(result['scenario'])
+        if previous is None:
+            continue
+        rows.append((result['scenario'], 'events/sec x%.2f, bytes/event x%.2f, peak rss x%.2f' % (
+            result['eventsPerSecond'] / previous['eventsPerSecond'],
+            result['bytesPerEvent'] / previous['bytesPerEvent'],
+            result['peakRssBytes'] / float(previous['peakRssBytes']))))
+        for hook, allocation in sorted((result['allocations'] or {}).items()):
+            previous_allocation = (previous['allocations'] or {}).get(hook)
+            if previous_allocation and previous_allocation['peakBytesPerCall']:
+                rows.append(('  %s' % hook, 'peak bytes/call %d -> %d' % (
+                    previous_allocation['peakBytesPerCall'], allocation['peakBytesPerCall'])))
+
+    report('%s (%s) -> %s (%s)' % (base_path, base['environment']['commit'], head_path,
+                                   head['environment']['commit']), rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='synthetic event replay benchmarks for x_stdout_json_lines')
+    parser.add_argument('--scenarios', default=','.join(sorted(SCENARIOS)),
+                        help='comma separated scenarios out of %s' % ', '.join(sorted(SCENARIOS)))
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='X_ANSIBLE_RUNNER_* setting applied to the plugin, may be repeated')
+    parser.add_argument('--output', help='path to save the json results to')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help='compares two saved results')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    env = dict(setting.split('=', 1) for setting in args.env)
+
+    if args.child:
+        json.dump(run_scenario(args.child, env), sys.stdout)
+        return
+
+    results = []
+    for name in args.scenarios.split(','):
+        command = [sys.executable, os.path.abspath(__file__), '--child', name]
+        for setting in args.env:
+            command.extend(['--env', setting])
+        results.append(json.loads(subprocess.check_output(command).decode('utf-8')))
+
+    rows = [(result['scenario'], '%.0f events/sec, %.0f bytes/event, %d events, peak rss %.1f MB' % (
+        result['eventsPerSecond'], result['bytesPerEvent'], result['events'], result['peakRssBytes'] / 1e6))
+        for result in results]
+    for result in results:
+        for hook, allocation in sorted((result['allocations'] or {}).items()):
+            rows.append(('  %s %s' % (result['scenario'], hook), '%d calls, peak %d bytes/call, retained %d bytes/call' % (
+                allocation['calls'], allocation['peakBytesPerCall'], allocation['retainedBytesPerCall'])))
+    report('event replay (%s)' % (' '.join(args.env) or 'default settings'), rows)
+
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump({'environment': describe_environment(env), 'results': results}, stream, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,5 +7,6 @@ set -e
 
 ANSIBLE_VERSION="$1"
 DOCKERFILE="$2"
+TAG_SUFFIX="$3"
 
-docker build --build-arg ANSIBLE_PIP_VERSION=${ANSIBLE_VERSION} -t capecodes/ansible:${ANSIBLE_VERSION} --file ${DOCKERFILE} .
+docker build --build-arg ANSIBLE_PIP_VERSION=${ANSIBLE_VERSION} -t capecodes/ansible:${ANSIBLE_VERSION}${TAG_SUFFIX} --file ${DOCKERFILE} .
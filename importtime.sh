@@ -0,0 +1,60 @@
+#!/bin/bash
+
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# reports the python -X importtime results of "ansible-playbook --version" and of a trivial local playbook
+# (through the x_stdout_json_lines callback) in fresh containers of each given image, e.g. to compare an
+# image before and after a change:
+#
+#   ./importtime.sh capecodes/ansible:2.10.5 capecodes/ansible:2.10.5-precompiled
+
+set -e
+
+RUNS=${RUNS:-3}
+
+PLAYBOOK='- hosts: localhost
+  connection: local
+  gather_facts: false
+  tasks:
+    - command: "true"'
+
+# sums the self times of every import and lists the slowest top level imports (cumulative)
+summarize() {
+    awk -F '|' '
+        /^import time:/ && $1 !~ /self/ {
+            self_us = $1; sub(/.*: */, "", self_us)
+            name = $3; level = match(name, /[^ ]/) - 2; gsub(/^ +| +$/, "", name)
+            total += self_us; count++
+            if (level == 0) { top[name] = $2 + 0 }
+        }
+        END {
+            printf "    %d modules imported in %.1f ms\n", count, total / 1000
+            n = 0
+            for (name in top) { names[++n] = name }
+            for (i = 1; i <= n; i++) for (j = i + 1; j <= n; j++) if (top[names[j]] > top[names[i]]) { t = names[i]; names[i] = names[j]; names[j] = t }
+            for (i = 1; i <= n && i <= 8; i++) printf "      %8.1f ms  %s\n", top[names[i]] / 1000, names[i]
+        }'
+}
+
+for IMAGE in "$@"; do
+    echo "${IMAGE}"
+    for COMMAND in "--version" "playbook"; do
+        for RUN in $(seq 1 ${RUNS}); do
+            if [ "${COMMAND}" = "--version" ]; then
+                SCRIPT='python3 -X importtime $(command -v ansible-playbook) --version'
+            else
+                SCRIPT='printf "%s\n" "${PLAYBOOK}" > /tmp/playbook.yml && python3 -X importtime $(command -v ansible-playbook) -i localhost, /tmp/playbook.yml'
+            fi
+
+            START=$(date +%s%N)
+            OUTPUT=$(docker run --rm -e X_ANSIBLE_RUNNER_UUID=importtime -e PLAYBOOK="${PLAYBOOK}" "${IMAGE}" \
+                sh -c "${SCRIPT}" 2>&1 >/dev/null)
+            END=$(date +%s%N)
+
+            # the first run of each image also pays for the container start, the summary of the last run is kept
+            echo "  ${COMMAND} run ${RUN}: $(( (END - START) / 1000000 )) ms wall (container included)"
+        done
+        echo "${OUTPUT}" | summarize
+    done
+done
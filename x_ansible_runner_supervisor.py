@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# runs a batch of ansible-playbook invocations as concurrent child processes in a single container, so
+# many small jobs share its startup cost, every child gets a runner uuid of its own (X_ANSIBLE_RUNNER_UUID)
+# and its output is demultiplexed line by line, either into a single stream on stdout, where the lines of
+# the x_stdout_json_lines callback plugin are passed through as is (still prefixed by the uuid of their
+# run) next to the supervisor's own events, prefixed by its X_ANSIBLE_RUNNER_UUID, or into a file per run
+#
+#   x_ansible_runner_supervisor.py [--concurrency N] [--output-dir DIR] BATCH
+#
+# BATCH ("-" for stdin) holds one run per line, a json object
+#   {"id": "...", "args": ["site.yml", "-i", "..."], "env": {...}, "cwd": "...", "command": ["ansible-playbook"]}
+# where only "args" is required, or a json array of the ansible-playbook arguments, the supervisor events
+# are {"type": "supervisor", "event": "start"/"stats"} and {"type": "run", "event": "start"/"output"/"exit"}
+# (with "runId", the "runnerUuid" of the run at start, the lines of the run not prefixed by it as output,
+# with the "stream" ("stdout" or "stderr") they were written to, "rc" and "durationMs" at exit), stderr is
+# read from a pipe of its own so the warnings and tracebacks of ansible never split the lines of the plugin, the exit status is 0 when every run exited with 0, 1 otherwise
+
+import argparse
+import json
+import math
+import os
+import selectors
+import subprocess
+import sys
+import time
+import uuid
+
+DEFAULT_COMMAND = ['ansible-playbook']
+
+# size of the reads from the pipes of the children
+READ_BYTES = 64 * 1024
+
+# settings of the supervisor's environment which point the plugin output away from stdout (or make it
+# binary), not passed on to the children so each writes its lines to its own pipe, the "env" of a run
+# can still set them for that run
+CHILD_OUTPUT_VARIABLES = ('X_ANSIBLE_RUNNER_OUTPUT_PATH', 'X_ANSIBLE_RUNNER_SHARDS', 'X_ANSIBLE_RUNNER_SHARD_BY',
+                          'X_ANSIBLE_RUNNER_SHARD_CONTROL', 'X_ANSIBLE_RUNNER_COMPRESSION',
+                          'X_ANSIBLE_RUNNER_COMPRESSION_LEVEL', 'X_ANSIBLE_RUNNER_COMPRESSION_POINTS',
+                          'X_ANSIBLE_RUNNER_PROGRESS', 'X_ANSIBLE_RUNNER_ENCODING')
+
+
+# reads a batch, one run per line (blank lines and lines starting with # are skipped)
+def loadBatch(stream):
+    runs = []
+    ids = set()
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        run = json.loads(line)
+        if isinstance(run, list):
+            run = {'args': run}
+        if not isinstance(run.get('args'), list):
+            raise ValueError('run %d of the batch has no "args" list' % (len(runs) + 1))
+
+        run['id'] = str(run.get('id', 'run-%d' % len(runs)))
+        if run['id'] in ids or os.sep in run['id'] or run['id'] in ('', '.', '..'):
+            raise ValueError('run %d of the batch has a duplicate or invalid "id" %r' % (len(runs) + 1, run['id']))
+
+        ids.add(run['id'])
+        runs.append(run)
+    return runs
+
+
+# a single child ansible-playbook process, its output is split in lines as it is read
+class Run:
+    def __init__(self, spec, output_dir):
+        self.spec = spec
+        self.id = spec['id']
+        self.runner_uuid = str(uuid.uuid4())
+        self.prefix = (self.runner_uuid + ' ').encode('utf-8')
+        self.output_dir = output_dir
+        self.output = None
+        self.process = None
+        self.started = None
+        self.pending = {}
+        self.open_streams = 0
+
+    def start(self):
+        env = dict((key, value) for (key, value) in os.environ.items() if key not in CHILD_OUTPUT_VARIABLES)
+        env.update(dict((str(key), str(value)) for key, value in self.spec.get('env', {}).items()))
+        env['X_ANSIBLE_RUNNER_UUID'] = self.runner_uuid
+
+        command = list(self.spec.get('command', DEFAULT_COMMAND)) + [str(arg) for arg in self.spec['args']]
+        if self.output_dir:
+            self.output = open(os.path.join(self.output_dir, self.id + '.out'), 'ab')
+
+        self.started = time.monotonic()
+        self.process = subprocess.Popen(command, env=env, cwd=self.spec.get('cwd'), stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.pending = {'stdout': b'', 'stderr': b''}
+        self.open_streams = len(self.pending)
+        return command
+
+    def pipes(self):
+        return (('stdout', self.process.stdout), ('stderr', self.process.stderr))
+
+    def read(self, name, pipe):
+        """Returns the complete lines read so far from a pipe, None once that output of the child ended"""
+        data = os.read(pipe.fileno(), READ_BYTES)
+        if not data:
+            lines = [self.pending[name]] if self.pending[name] else []
+            self.pending[name] = b''
+            return lines if lines else None
+
+        lines = (self.pending[name] + data).split(b'\n')
+        self.pending[name] = lines.pop()
+        return lines
+
+    def finish(self):
+        """Waits for the child, returns its exit status (negative for a signal) and duration"""
+        self.process.stdout.close()
+        self.process.stderr.close()
+        rc = self.process.wait()
+        if self.output is not None:
+            self.output.close()
+        return rc, round((time.monotonic() - self.started) * 1000, 3)
+
+
+class Supervisor:
+    def __init__(self, runs, concurrency, output_dir, runner_uuid, stream):
+        self._queue = [Run(spec, output_dir) for spec in runs]
+        self._queue.reverse()
+        self._concurrency = max(1, concurrency)
+        self._prefix = (runner_uuid + ' ').encode('utf-8')
+        self._stream = stream
+        self._buffer = bytearray()
+        self._selector = selectors.DefaultSelector()
+        self._running = 0
+        self._index = 0
+        self._exits = {}
+
+    def event(self, obj):
+        obj['epoch'] = int(math.floor(time.time() * 1000))
+        obj['i'] = self._index
+        self._index += 1
+
+        buffer = self._buffer
+        buffer += self._prefix
+        buffer += json.dumps(obj, separators=(',', ':')).encode('utf-8')
+        buffer += b'\n'
+
+    def flush(self):
+        if self._buffer:
+            self._stream.write(self._buffer)
+            self._stream.flush()
+            del self._buffer[:]
+
+    def start_runs(self):
+        while self._queue and self._running < self._concurrency:
+            run = self._queue.pop()
+            try:
+                command = run.start()
+            except OSError as e:
+                if run.output is not None:
+                    run.output.close()
+                self.event({'type': 'run', 'event': 'exit', 'runId': run.id,
+                            'data': {'runnerUuid': run.runner_uuid, 'rc': 127, 'errorMessage': str(e)}})
+                self._exits[run.id] = 127
+                continue
+
+            self.event({'type': 'run', 'event': 'start', 'runId': run.id,
+                        'data': {'runnerUuid': run.runner_uuid, 'command': command, 'pid': run.process.pid}})
+            for name, pipe in run.pipes():
+                self._selector.register(pipe, selectors.EVENT_READ, (run, name))
+            self._running += 1
+
+    def handle_lines(self, run, name, lines):
+        if run.output is not None:
+            if lines:
+                run.output.write(b'\n'.join(lines) + b'\n')
+            return
+
+        buffer = self._buffer
+        for line in lines:
+            if name == 'stdout' and line.startswith(run.prefix):
+                buffer += line
+                buffer += b'\n'
+            elif line.strip():
+                self.event({'type': 'run', 'event': 'output', 'runId': run.id, 'stream': name,
+                            'line': line.decode('utf-8', 'replace').rstrip('\r')})
+
+    def finish_run(self, run):
+        registered = self._selector.get_map()
+        for _, pipe in run.pipes():
+            if pipe in registered:
+                self._selector.unregister(pipe)
+        self._running -= 1
+        rc, duration = run.finish()
+        self._exits[run.id] = rc
+        self.event({'type': 'run', 'event': 'exit', 'runId': run.id,
+                    'data': {'runnerUuid': run.runner_uuid, 'rc': rc, 'durationMs': duration}})
+
+    def run(self):
+        started = time.monotonic()
+        self.event({'type': 'supervisor', 'event': 'start',
+                    'data': {'runs': len(self._queue), 'concurrency': self._concurrency}})
+
+        try:
+            self.start_runs()
+            self.flush()
+            while self._running:
+                for key, _ in self._selector.select():
+                    run, name = key.data
+                    lines = run.read(name, key.fileobj)
+                    if lines is not None:
+                        self.handle_lines(run, name, lines)
+                        continue
+
+                    # the run is over once both its stdout and its stderr ended
+                    self._selector.unregister(key.fileobj)
+                    run.open_streams -= 1
+                    if not run.open_streams:
+                        self.finish_run(run)
+                self.start_runs()
+                self.flush()
+        finally:
+            # an interrupted supervisor takes its children down with it
+            runs = []
+            for key in list(self._selector.get_map().values()):
+                if key.data[0] not in runs:
+                    runs.append(key.data[0])
+            for run in runs:
+                run.process.terminate()
+                self.finish_run(run)
+            self.flush()
+
+        failed = sorted(run_id for run_id, rc in self._exits.items() if rc != 0)
+        self.event({'type': 'supervisor', 'event': 'stats',
+                    'data': {'runs': len(self._exits), 'failed': failed,
+                             'durationMs': round((time.monotonic() - started) * 1000, 3)}})
+        self.flush()
+        return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='runs a batch of ansible-playbook invocations concurrently')
+    parser.add_argument('batch', help='json lines file with one run per line, "-" for stdin')
+    parser.add_argument('--concurrency', type=int, default=os.cpu_count() or 1,
+                        help='number of runs at the same time (default: the number of cpus)')
+    parser.add_argument('--output-dir', help='write the output of every run to <dir>/<run id>.out instead of stdout')
+    parser.add_argument('--uuid', default=os.environ.get('X_ANSIBLE_RUNNER_UUID'),
+                        help='prefix of the supervisor events (default: X_ANSIBLE_RUNNER_UUID)')
+    args = parser.parse_args(argv)
+
+    if not args.uuid:
+        parser.error('--uuid or X_ANSIBLE_RUNNER_UUID is required')
+
+    if args.batch == '-':
+        runs = loadBatch(sys.stdin)
+    else:
+        with open(args.batch) as stream:
+            runs = loadBatch(stream)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    supervisor = Supervisor(runs, args.concurrency, args.output_dir, args.uuid, sys.stdout.buffer)
+    return supervisor.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
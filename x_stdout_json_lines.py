@@ -11,9 +11,32 @@ from ansible.parsing.ajson import AnsibleJSONEncoder
 # Sentinel is an Ansible-specific class that sometimes denotes "None" (see https://github.com/ansible/ansible/blob/v2.10.4/lib/ansible/utils/sentinel.py)
 import sys
 import os
+import copy
 import json
 import time
 import math
+import atexit
+import hashlib
+import datetime
+import struct
+import threading
+import heapq
+import zlib
+import difflib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from collections import OrderedDict
+
+from ansible.module_utils._text import to_text
 
 # extract a provided UUID used to prefix all outputed lines from this plugin
 # this exists so that the external driver knows the key for which to extract
@@ -22,6 +45,164 @@ import math
 runner_uuid = os.environ['X_ANSIBLE_RUNNER_UUID']
 
 
+# reads an optional integer setting from the environment, falling back to a default
+def env_int(name, default):
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    return int(value)
+
+
+# selects where the UUID prefixed lines are written to, "display" (the default) routes
+# every line through the ansible Display, "direct" writes them straight to a file
+# descriptor through a reusable byte buffer (skipping Display locking, color, unicode
+# handling and the write/flush per line)
+sink_mode = os.environ.get('X_ANSIBLE_RUNNER_SINK', 'display')
+
+# selects the json encoder used for every event, "ansible" (the default) keeps the original AnsibleJSONEncoder
+# output, the faster encoders are opt-in as they change it: "stdlib" (the C accelerated stdlib encoder with a
+# reused instance), "orjson" and "ujson" produce compact json (and orjson writes NaN/Infinity as null), "auto"
+# picks the fastest installed of them
+json_backend_name = os.environ.get('X_ANSIBLE_RUNNER_JSON', 'ansible')
+
+# when enabled the hooks only enqueue their events, a dedicated writer thread encodes and writes them,
+# the queue holds at most X_ANSIBLE_RUNNER_QUEUE_SIZE events and when full X_ANSIBLE_RUNNER_OVERFLOW
+# either blocks the hook ("block", the default) or drops low priority events ("drop", see
+# isLowPriorityEvent), the queue is always drained at stats and at exit
+async_writer = os.environ.get('X_ANSIBLE_RUNNER_ASYNC', '') not in ('', '0', 'false', 'False')
+async_queue_size = env_int('X_ANSIBLE_RUNNER_QUEUE_SIZE', 10000)
+async_overflow = os.environ.get('X_ANSIBLE_RUNNER_OVERFLOW', 'block')
+
+# when enabled the repeated playId/taskId/item fields of every event, and the host/name/item fields of
+# its data, are replaced by small integer ids, the first time a value is seen a {"type": "def", "id",
+# "value"} event (without an "i") is written ahead of the event using it, once an event could take the table
+# past X_ANSIBLE_RUNNER_COMPACT_MAX values a {"type": "def", "reset": true} event starts it over ahead of it,
+# x_stdout_json_lines_reader.expand_compact_events rebuilds the full events, this only makes the output
+# smaller, the interning costs more than the encoding it saves
+compact_events = os.environ.get('X_ANSIBLE_RUNNER_COMPACT', '') not in ('', '0', 'false', 'False')
+compact_max_values = env_int('X_ANSIBLE_RUNNER_COMPACT_MAX', 100000)
+
+# selects the event encoding, "jsonl" (the default) writes "UUID { json doc }" lines, "msgpack" and
+# "cbor" write length prefixed binary frames tagged with the runner uuid (see FRAME_MAGIC), binary
+# encodings always use the "direct" sink, so are best combined with X_ANSIBLE_RUNNER_OUTPUT_PATH
+event_encoding = os.environ.get('X_ANSIBLE_RUNNER_ENCODING', 'jsonl')
+
+# for the "direct" sink, an optional path to write the lines to instead of stdout
+sink_output_path = os.environ.get('X_ANSIBLE_RUNNER_OUTPUT_PATH')
+
+# when set ("gzip" or "zstd", the latter requires the zstandard python package), the events are written
+# to X_ANSIBLE_RUNNER_OUTPUT_PATH as a compressed stream, made of independent gzip members / zstd frames
+# started at every play start ("play") or at every play and task start ("task", the default), the byte
+# offset of each one is appended to "<path>.points" so a reader can start decompressing from there,
+# X_ANSIBLE_RUNNER_PROGRESS then selects what is still written to stdout, "none" (the default),
+# "progress" (playbook/play events, task starts and failures) or "all"
+compression = os.environ.get('X_ANSIBLE_RUNNER_COMPRESSION', '')
+compression_level = env_int('X_ANSIBLE_RUNNER_COMPRESSION_LEVEL', None)
+compression_points = os.environ.get('X_ANSIBLE_RUNNER_COMPRESSION_POINTS', 'task')
+progress_mode = os.environ.get('X_ANSIBLE_RUNNER_PROGRESS', 'none')
+
+# when above 1, the events are written to this many shards of X_ANSIBLE_RUNNER_OUTPUT_PATH (files, or fifos
+# created beforehand), "<path>.<shard>" or the path formatted with {shard}, each event is routed by the
+# crc32 of its data.host ("host", the default) or of its playId ("play") X_ANSIBLE_RUNNER_SHARD_BY,
+# events without one (playbook, play and task start, progress, stats, ...) are written to every shard
+# ("all", the default) or only to an extra "control" shard, X_ANSIBLE_RUNNER_SHARD_CONTROL, every event
+# keeps its global "i" (see x_stdout_json_lines_reader.iter_merged_shards)
+shard_count = env_int('X_ANSIBLE_RUNNER_SHARDS', 0)
+shard_by = os.environ.get('X_ANSIBLE_RUNNER_SHARD_BY', 'host')
+shard_control = os.environ.get('X_ANSIBLE_RUNNER_SHARD_CONTROL', 'all')
+
+# for the "direct" sink, flush after every N events and/or every N milliseconds (a timer thread then
+# flushes the lines written during a quiet period as well), when both are 0 the buffer is only flushed
+# at play and stats boundaries (or when full)
+sink_flush_events = env_int('X_ANSIBLE_RUNNER_FLUSH_EVENTS', 0)
+sink_flush_ms = env_int('X_ANSIBLE_RUNNER_FLUSH_MS', 0)
+
+# for the "direct" sink, the buffer size in bytes at which a flush is always forced
+sink_buffer_bytes = env_int('X_ANSIBLE_RUNNER_BUFFER_BYTES', 64 * 1024)
+
+# when enabled the wrapped default callback hooks are never invoked (other than __init__),
+# so no human readable output is rendered, captured and re-emitted as stdout/stderr lines,
+# only the structured playbook/play/task events are printed
+structured_only = os.environ.get('X_ANSIBLE_RUNNER_STRUCTURED_ONLY', '') not in ('', '0', 'false', 'False')
+
+# how the captured stdout/stderr of a wrapped hook is emitted, "line" (the default) emits one event per
+# line, "lines" a single event per hook invocation and stream with all of them as a "lines" array, and
+# "text" a single event with the captured text as printed
+captured_mode = os.environ.get('X_ANSIBLE_RUNNER_CAPTURED', 'line')
+
+# optional per event byte budget for task results (0 disables), when enabled the redundant
+# stdout_lines/stderr_lines are dropped and results still over budget get their long
+# strings truncated, the full result is then spilled to a content addressed sidecar file
+# under the spill directory (when one is set) and referenced from the event
+max_result_bytes = env_int('X_ANSIBLE_RUNNER_MAX_RESULT_BYTES', 0)
+spill_dir = os.environ.get('X_ANSIBLE_RUNNER_SPILL_DIR')
+
+# number of slowest tasks and hosts listed in the timing rollups of the stats event
+timing_top = env_int('X_ANSIBLE_RUNNER_TIMING_TOP', 10)
+
+# when enabled the plugin times its own hooks (and their super/build/emit phases), the encoding and
+# writing of every event type and counts the bytes written per event type, a {"type": "metrics"}
+# event with the histograms is emitted every X_ANSIBLE_RUNNER_METRICS_MS milliseconds (0 only emits
+# it at stats), when disabled nothing is wrapped so the hooks run exactly as without it
+metrics_enabled = os.environ.get('X_ANSIBLE_RUNNER_METRICS', '') not in ('', '0', 'false', 'False')
+metrics_interval_ms = env_int('X_ANSIBLE_RUNNER_METRICS_MS', 10000)
+
+# when enabled the loop item hooks no longer emit one event per item, the item outcomes of every (task, host)
+# are buffered as compact records and emitted as a single {"event": "items"} event, when the host's final
+# result arrives, once X_ANSIBLE_RUNNER_COALESCE_MAX_ITEMS items are buffered or X_ANSIBLE_RUNNER_COALESCE_MS
+# milliseconds after its first item (0 disables either bound, the time bound is checked with every host start,
+# result, item, poll and retry, so a batch is not held back by a slow item of another host), failed items are
+# still emitted right away
+# as full item_failed events unless X_ANSIBLE_RUNNER_COALESCE_FAILED is 0
+coalesce_items = os.environ.get('X_ANSIBLE_RUNNER_COALESCE_ITEMS', '') not in ('', '0', 'false', 'False')
+coalesce_max_items = env_int('X_ANSIBLE_RUNNER_COALESCE_MAX_ITEMS', 1000)
+coalesce_ms = env_int('X_ANSIBLE_RUNNER_COALESCE_MS', 10000)
+coalesce_emit_failed = os.environ.get('X_ANSIBLE_RUNNER_COALESCE_FAILED', '1') not in ('', '0', 'false', 'False')
+
+# async polls (v2_runner_on_async_poll) and until retries (v2_runner_retry) of every (task, host) emit an
+# event for the first one, whenever their state changes, and otherwise at most once every
+# X_ANSIBLE_RUNNER_POLL_MS milliseconds (0 emits every one of them), the final result then carries the
+# total count and the elapsed time since the first one, super still runs for every one of them so the
+# human readable output is left as it is
+poll_interval_ms = env_int('X_ANSIBLE_RUNNER_POLL_MS', 10000)
+
+# when enabled the result of a task event is only sent in full the first time its content (ignoring the
+# host specific DEDUP_HOST_KEYS) is seen for the current task, with a "resultHash", later events carry
+# the same hash as "resultRef" and only the host specific keys as "result", the hashes are kept in a
+# LRU of X_ANSIBLE_RUNNER_DEDUP_CACHE entries cleared at every task start,
+# x_stdout_json_lines_reader.resolve_result_refs rebuilds the full results
+dedup_results = os.environ.get('X_ANSIBLE_RUNNER_DEDUP', '') not in ('', '0', 'false', 'False')
+dedup_cache_size = env_int('X_ANSIBLE_RUNNER_DEDUP_CACHE', 64)
+
+# when set, the ansible_facts of successful results (otherwise dropped from the events) are merged into a
+# per host snapshot written to this directory with the layout of the jsonfile fact cache plugin (one
+# "<prefix><host>" json file per host, see FactStore), so fact_caching = jsonfile pointed at the same
+# directory picks them up, and only a {"type": "facts", "event": "diff"} event with the changed facts is
+# emitted, X_ANSIBLE_RUNNER_FACTS_PREFIX matches the fact_caching_prefix setting
+facts_dir = os.environ.get('X_ANSIBLE_RUNNER_FACTS_DIR')
+facts_prefix = os.environ.get('X_ANSIBLE_RUNNER_FACTS_PREFIX', '')
+
+# file diffs (with --diff) are emitted as a {"type": "diff", "event": "start"} event with the headers and
+# line counts of each diff, followed by its unified diff lines in {"event": "chunk"} events of at most
+# X_ANSIBLE_RUNNER_DIFF_CHUNK_BYTES, once X_ANSIBLE_RUNNER_DIFF_BUDGET_BYTES of diff lines were emitted
+# in the run (0 is unlimited), only the start events are emitted, marked "omitted": "budget"
+diff_chunk_bytes = env_int('X_ANSIBLE_RUNNER_DIFF_CHUNK_BYTES', 16 * 1024) or 16 * 1024
+diff_budget_bytes = env_int('X_ANSIBLE_RUNNER_DIFF_BUDGET_BYTES', 10 * 1024 * 1024)
+
+# optional event filter and result projection (see EventFilter), either a path to a json file or an
+# inline json object, loaded once when the callback is created
+event_filter_config = os.environ.get('X_ANSIBLE_RUNNER_FILTER', '')
+
+# host counts of the current play and of its tasks (ok, changed, failed, unreachable, skipped and in flight)
+# are kept up to date with every host result and emitted as a compact {"type": "progress"} event every
+# X_ANSIBLE_RUNNER_PROGRESS_MS milliseconds and/or X_ANSIBLE_RUNNER_PROGRESS_RESULTS host results (both 0,
+# the default, disables them), X_ANSIBLE_RUNNER_SUMMARY_ONLY drops the per host events and the captured
+# stdout/stderr lines altogether, leaving the playbook/play/task start, progress and stats events
+summary_only = os.environ.get('X_ANSIBLE_RUNNER_SUMMARY_ONLY', '') not in ('', '0', 'false', 'False')
+progress_interval_ms = env_int('X_ANSIBLE_RUNNER_PROGRESS_MS', 1000 if summary_only else 0)
+progress_interval_results = env_int('X_ANSIBLE_RUNNER_PROGRESS_RESULTS', 0)
+
+
 # captures stdout to a list of strings
 class CapturingStdout(list):
     def __enter__(self):
@@ -38,7 +219,7 @@ class CapturingStdout(list):
 # captures stderr to a list of strings
 class CapturingStderr(list):
     def __enter__(self):
-        self._stderr = sys.stdout
+        self._stderr = sys.stderr
         sys.stderr = self._stringio = StringIO()
         return self
 
@@ -48,6 +229,1221 @@ class CapturingStderr(list):
         sys.stderr = self._stderr
 
 
+# captures the stdout and stderr of a call into two buffers which are reused from one call to the next,
+# a call made while already capturing gets buffers of its own
+class CapturedOutput(object):
+    # buffers which grew past this size are replaced rather than reused, to give the memory back
+    MAX_REUSED_CHARS = 1024 * 1024
+
+    def __init__(self):
+        self._stdout = StringIO()
+        self._stderr = StringIO()
+        self._saved = None
+
+    def run(self, fn, *args, **kwargs):
+        """Calls fn, returning the (stdout, stderr) text it printed, what it printed before raising is dropped"""
+        if self._saved is not None:
+            return CapturedOutput().run(fn, *args, **kwargs)
+
+        self._saved = (sys.stdout, sys.stderr)
+        sys.stdout = self._stdout
+        sys.stderr = self._stderr
+        try:
+            fn(*args, **kwargs)
+        finally:
+            sys.stdout, sys.stderr = self._saved
+            self._saved = None
+            # reset on the way out even when fn raised, so its partial output never leaks into the next call
+            stdout = self._reset('_stdout')
+            stderr = self._reset('_stderr')
+        return stdout, stderr
+
+    def _reset(self, name):
+        buffer = getattr(self, name)
+        text = buffer.getvalue()
+        if len(text) > self.MAX_REUSED_CHARS:
+            setattr(self, name, StringIO())
+        elif text:
+            buffer.seek(0)
+            buffer.truncate()
+        return text
+
+
+# default hook for the fast json backends, handles the ansible types exactly as AnsibleJSONEncoder.default
+# (AnsibleUnsafeText is a str subclass and is already encoded as a plain string by every backend)
+def encodeAnsibleTypeForJson(o):
+    if getattr(o, '__ENCRYPTED__', False):
+        return {'__ansible_vault': to_text(o._ciphertext, errors='surrogate_or_strict', nonstring='strict')}
+    if getattr(o, '__UNSAFE__', False):
+        return {'__ansible_unsafe': to_text(o, errors='surrogate_or_strict', nonstring='strict')}
+    if isinstance(o, Mapping):
+        return dict(o)
+    if isinstance(o, (datetime.date, datetime.datetime)):
+        return o.isoformat()
+    raise TypeError('Object of type %s is not JSON serializable' % type(o).__name__)
+
+
+# the original encoding, a new AnsibleJSONEncoder per event with the default separators
+class AnsibleJsonBackend:
+    name = 'ansible'
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=AnsibleJSONEncoder, indent=None, ensure_ascii=False, sort_keys=False)
+
+
+# a single reused stdlib JSONEncoder, which runs the C encoder calling back into the default hook
+class StdlibJsonBackend:
+    name = 'stdlib'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=encodeAnsibleTypeForJson)
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj)
+
+
+# orjson, falling back to the stdlib backend for what it rejects (integers over 64 bits, lone surrogates),
+# its output only differs from the stdlib one for NaN/Infinity (null) and floats in exponent notation (1e16)
+class OrjsonBackend:
+    name = 'orjson'
+
+    def __init__(self, orjson, fallback):
+        self._dumps = orjson.dumps
+        self._option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        self._fallback = fallback
+
+    def dumps(self, obj):
+        try:
+            return self._dumps(obj, default=encodeAnsibleTypeForJson, option=self._option).decode('utf-8')
+        except TypeError:
+            return self._fallback.dumps(obj)
+
+
+# ujson (5.0 and later, which support a default hook), falling back to the stdlib backend for what it rejects
+class UjsonBackend:
+    name = 'ujson'
+
+    def __init__(self, ujson, fallback):
+        self._dumps = ujson.dumps
+        self._fallback = fallback
+
+    def dumps(self, obj):
+        try:
+            return self._dumps(obj, ensure_ascii=False, escape_forward_slashes=False, default=encodeAnsibleTypeForJson)
+        except (TypeError, ValueError, OverflowError):
+            return self._fallback.dumps(obj)
+
+
+# picks the json backend for a X_ANSIBLE_RUNNER_JSON value, unavailable backends fall back to "stdlib"
+def selectJsonBackend(name):
+    if name == 'ansible':
+        return AnsibleJsonBackend()
+
+    stdlib = StdlibJsonBackend()
+
+    if name in ('auto', 'orjson'):
+        try:
+            import orjson
+            return OrjsonBackend(orjson, stdlib)
+        except ImportError:
+            pass
+
+    if name in ('auto', 'ujson'):
+        try:
+            import ujson
+            ujson.dumps(None, default=encodeAnsibleTypeForJson)
+            return UjsonBackend(ujson, stdlib)
+        except (ImportError, TypeError):
+            pass
+
+    return stdlib
+
+
+json_backend = selectJsonBackend(json_backend_name)
+
+
+# every binary frame starts with this magic, then a single byte encoding tag (b'm' msgpack, b'c' cbor),
+# a single byte runner uuid length, the runner uuid, a 4 byte big endian payload length and the payload,
+# so a consumer can skip the frames of other runners (or all frames) without decoding their payload
+FRAME_MAGIC = b'XAF'
+
+
+# encodes events as binary frames, pack turns an event into the frame payload, raises ValueError for a
+# runner uuid which does not fit the single byte length of the frame header
+class FrameEncoder:
+    def __init__(self, tag, pack):
+        uuid_bytes = runner_uuid.encode('utf-8')
+        if len(uuid_bytes) > 255:
+            raise ValueError('runner uuid is %d bytes long, frames allow at most 255' % len(uuid_bytes))
+        self._header = FRAME_MAGIC + tag + struct.pack('>B', len(uuid_bytes)) + uuid_bytes
+        self._pack = pack
+
+    def write(self, sink, obj):
+        payload = self._pack(obj)
+        sink.write_bytes(self._header, struct.pack('>I', len(payload)), payload)
+
+
+# picks the frame encoder for a X_ANSIBLE_RUNNER_ENCODING value, None for json lines, raises ImportError
+# when the library for the requested encoding is not installed, ValueError when the runner uuid is too long
+def selectFrameEncoder(name):
+    if name == 'msgpack':
+        import msgpack
+        packer = msgpack.Packer(default=encodeAnsibleTypeForJson, use_bin_type=True)
+        return FrameEncoder(b'm', packer.pack)
+
+    if name == 'cbor':
+        import cbor2
+
+        def encodeAnsibleTypeForCbor(encoder, o):
+            encoder.encode(encodeAnsibleTypeForJson(o))
+
+        # cbor2 encodes dates natively (as tagged values), naive datetimes are taken as utc
+        return FrameEncoder(b'c', lambda obj: cbor2.dumps(obj, default=encodeAnsibleTypeForCbor,
+                                                          timezone=datetime.timezone.utc))
+
+    return None
+
+
+# writes UUID prefixed lines through the ansible Display (the original behaviour)
+class DisplayEventSink:
+    def __init__(self, display):
+        self._display = display
+
+    def write_line(self, line):
+        self._display.display("%s %s" % (runner_uuid, line), color=C.COLOR_OK)
+
+    def boundary(self):
+        pass
+
+    def task_boundary(self):
+        pass
+
+    def flush(self):
+        pass
+
+
+# writes UUID prefixed lines straight to a file descriptor, lines are appended to a
+# reusable byte buffer which is flushed according to the configured flush policy, with flush_ms
+# a timer thread also flushes it when nothing was written for that long (e.g. during a long task)
+class BufferedEventSink:
+    def __init__(self, path=None, flush_events=0, flush_ms=0, buffer_bytes=64 * 1024):
+        if path:
+            self._stream = None
+            self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        else:
+            # anything ansible itself has buffered on stdout is flushed before each write
+            self._stream = sys.__stdout__
+            self._fd = self._stream.fileno()
+
+        self._prefix = (runner_uuid + ' ').encode('utf-8')
+        self._buffer = bytearray()
+        self._pending = 0
+        self._flush_events = flush_events
+        self._flush_ns = flush_ms * 1000000
+        self._buffer_bytes = buffer_bytes
+        self._last_flush_ns = time.monotonic_ns()
+
+        # held while the buffer is appended to or flushed, as the flush timer runs on a thread of its own
+        self._lock = threading.RLock()
+
+        # never lose buffered lines, even when the run is aborted before the stats hook
+        atexit.register(self.flush)
+
+        if self._flush_ns:
+            timer = threading.Thread(target=self.run_flush_timer, name='x_stdout_json_lines flush timer')
+            timer.daemon = True
+            timer.start()
+
+    def write_line(self, line):
+        with self._lock:
+            buffer = self._buffer
+            buffer += self._prefix
+            buffer += line.encode('utf-8', 'replace')
+            buffer += b'\n'
+            self.written()
+
+    def write_bytes(self, *chunks):
+        """Writes a single event made of already encoded chunks (e.g. a binary frame)"""
+        with self._lock:
+            buffer = self._buffer
+            for chunk in chunks:
+                buffer += chunk
+            self.written()
+
+    def run_flush_timer(self):
+        """Flushes the buffer once flush_ms elapsed since the previous flush, so no line waits longer"""
+        while True:
+            with self._lock:
+                wait_ns = self._flush_ns - (time.monotonic_ns() - self._last_flush_ns)
+                if wait_ns <= 0:
+                    self.flush()
+                    wait_ns = self._flush_ns
+            time.sleep(wait_ns / 1e9)
+
+    def written(self):
+        """Applies the flush policy once an event has been appended to the buffer"""
+        buffer = self._buffer
+        self._pending += 1
+
+        if len(buffer) >= self._buffer_bytes:
+            self.flush()
+        elif self._flush_events and self._pending >= self._flush_events:
+            self.flush()
+        elif self._flush_ns and time.monotonic_ns() - self._last_flush_ns >= self._flush_ns:
+            self.flush()
+
+    def boundary(self):
+        """Flushes at play and stats boundaries"""
+        self.flush()
+
+    def task_boundary(self):
+        pass
+
+    def flush(self):
+        """Writes out everything buffered so far"""
+        with self._lock:
+            buffer = self._buffer
+            if buffer:
+                if self._stream is not None:
+                    self._stream.flush()
+
+                self.write_out(buffer)
+                del buffer[:]
+
+            self._pending = 0
+            self._last_flush_ns = time.monotonic_ns()
+
+    def write_out(self, data):
+        """Writes data to the file descriptor, retrying partial writes"""
+        with memoryview(data) as view:
+            written = 0
+            while written < len(view):
+                written += os.write(self._fd, view[written:])
+
+
+# gzip compressor, each instance writes a single gzip member (concatenated members are a valid gzip file)
+class GzipCompressor:
+    def __init__(self, level):
+        self._compressobj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressobj.compress(data)
+
+    def flush(self):
+        """Ends the pending deflate block, so a reader tailing the file can decompress everything so far"""
+        return self._compressobj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressobj.flush(zlib.Z_FINISH)
+
+
+# zstd compressor, each instance writes a single zstd frame (concatenated frames are a valid zstd file)
+class ZstdCompressor:
+    def __init__(self, zstandard, level):
+        self._zstandard = zstandard
+        self._compressobj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressobj.compress(bytes(data))
+
+    def flush(self):
+        """Ends the pending zstd block, so a reader tailing the file can decompress everything so far"""
+        return self._compressobj.flush(self._zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressobj.flush(self._zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# returns a factory of compressors for a X_ANSIBLE_RUNNER_COMPRESSION value (None when disabled),
+# raises ImportError when the library for the requested compression is not installed
+def selectCompressor(name, level=None):
+    if name == 'gzip':
+        level = 6 if level is None else level
+        return lambda: GzipCompressor(level)
+
+    if name == 'zstd':
+        import zstandard
+        level = 3 if level is None else level
+        return lambda: ZstdCompressor(zstandard, level)
+
+    return None
+
+
+# writes the UUID prefixed lines (or binary frames) to a compressed file, every flush ends the pending
+# compressed block, every boundary ends the gzip member / zstd frame, the next one starting an independent
+# flush point whose byte offset and epoch are appended to the "<path>.points" file
+class CompressedEventSink(BufferedEventSink):
+    def __init__(self, path, new_compressor, task_points=True, flush_events=0, flush_ms=0, buffer_bytes=64 * 1024):
+        BufferedEventSink.__init__(self, path, flush_events, flush_ms, buffer_bytes)
+        self._new_compressor = new_compressor
+        self._compressor = None
+        self._task_points = task_points
+        self._offset = os.lseek(self._fd, 0, os.SEEK_END)
+        self._points = open(path + '.points', 'a')
+
+        # registered after the flush of the buffered sink, so it runs first and ends the last member/frame
+        atexit.register(self.boundary)
+
+    def flush(self):
+        """Compresses everything buffered so far and writes it out up to the end of a compressed block"""
+        with self._lock:
+            buffer = self._buffer
+            if buffer:
+                compressor = self._compressor
+                if compressor is None:
+                    compressor = self.start_point()
+
+                self.write_out(compressor.compress(buffer) + compressor.flush())
+                del buffer[:]
+
+            self._pending = 0
+            self._last_flush_ns = time.monotonic_ns()
+
+    def boundary(self):
+        """Ends the current gzip member / zstd frame at play and stats boundaries"""
+        with self._lock:
+            self.flush()
+            if self._compressor is not None:
+                self.write_out(self._compressor.finish())
+                self._compressor = None
+
+    def task_boundary(self):
+        """Ends the current gzip member / zstd frame at task start, when flush points are per task"""
+        if self._task_points:
+            self.boundary()
+
+    def start_point(self):
+        """Starts a new gzip member / zstd frame, recording where it starts"""
+        self._points.write('%d %d\n' % (self._offset, int(math.floor(time.time() * 1000))))
+        self._points.flush()
+        self._compressor = self._new_compressor()
+        return self._compressor
+
+    def write_out(self, data):
+        BufferedEventSink.write_out(self, data)
+        self._offset += len(data)
+
+
+# returns the paths of the shards of an output path, the control shard (when there is one) last
+def shardPaths(path, count, control):
+    names = [str(shard) for shard in range(count)]
+    if control == 'control':
+        names.append('control')
+    if '{shard}' in path:
+        return [path.format(shard=name) for name in names]
+    return ['%s.%s' % (path, name) for name in names]
+
+
+# field of a compacted event holding its routing key from before the interning, popped when it is routed
+SHARD_KEY_FIELD = '_shardKey'
+
+
+# routes every event to one of several sinks (or to all of them, or to a control sink, when it has no
+# routing key, captured stdout/stderr lines without one only go to the control sink or the first one,
+# compact mode definitions go to every sink so each shard can be expanded on its own), route() selects
+# the sinks of the next event written, write_line()/write_bytes() then write it to each of them
+class ShardedEventSink:
+    def __init__(self, sinks, key, control=None):
+        self._sinks = sinks
+        self._key = key
+        self._broadcast = [control] if control is not None else list(sinks)
+        self._captured = (control if control is not None else sinks[0],)
+        self._all = sinks + [control] if control is not None else sinks
+        self._targets = self._broadcast
+        self._shards = {}  # routing key -> sink, crc32 is stable across runs unlike hash()
+
+    def key(self, obj):
+        """Returns the routing key of an event, None when it has none"""
+        if self._key == 'play':
+            return obj.get('playId')
+
+        # captured lines carry the host of the hook which printed them at the top level
+        data = obj.get('data')
+        return data.get('host') if isinstance(data, dict) else obj.get('host')
+
+    def route(self, obj):
+        value = obj.pop(SHARD_KEY_FIELD) if SHARD_KEY_FIELD in obj else self.key(obj)
+
+        if value is None:
+            type = obj.get('type')
+            if type == 'def':
+                self._targets = self._all
+            else:
+                self._targets = self._captured if type in ('stdout', 'stderr') else self._broadcast
+            return
+
+        sink = self._shards.get(value)
+        if sink is None:
+            sink = self._shards[value] = self._sinks[zlib.crc32(str(value).encode('utf-8')) % len(self._sinks)]
+        self._targets = (sink,)
+
+    def write_line(self, line):
+        targets = self._targets
+        if len(targets) == 1:
+            targets[0].write_line(line)
+            return
+
+        encoded = line.encode('utf-8', 'replace')
+        for sink in targets:
+            sink.write_bytes(sink._prefix, encoded, b'\n')
+
+    def write_bytes(self, *chunks):
+        for sink in self._targets:
+            sink.write_bytes(*chunks)
+
+    def boundary(self):
+        for sink in self._all:
+            sink.boundary()
+
+    def task_boundary(self):
+        for sink in self._all:
+            sink.task_boundary()
+
+    def flush(self):
+        for sink in self._all:
+            sink.flush()
+
+
+# events which may be dropped when the writer queue is full, captured stdout/stderr lines and skipped items
+def isLowPriorityEvent(obj):
+    return obj.get('type') in ('stdout', 'stderr') or obj.get('event') == 'item_skipped'
+
+
+# events copied to the stdout progress channel next to a compressed output file, playbook, play and
+# progress events, task starts and failures (and the compact mode definitions those refer to)
+PROGRESS_TASK_EVENTS = ('start', 'handler_start', 'failed', 'unreachable')
+
+
+def isProgressEvent(obj):
+    type = obj.get('type')
+    if type == 'task':
+        return obj.get('event') in PROGRESS_TASK_EVENTS
+    return type in ('playbook', 'play', 'progress', 'def')
+
+
+# result keys never kept by a projection, as clean_copy() removes them too (the outcome is the event type)
+PROJECTION_IGNORED_KEYS = ('failed', 'skipped')
+
+
+# stands in for the clean copy of a TaskResult when only some result keys are kept
+class ProjectedResult:
+    def __init__(self, raw_result, result):
+        self._host = raw_result._host
+        self._task = raw_result._task
+        self.task_name = raw_result.task_name
+        self._result = result
+
+
+# returns the (changed, rc, msg) of a raw result as its clean copy keeps them (no_log results only keep
+# changed), read ahead of any projection or deduplication, which only ever trim data.result
+def resultStatusForJson(raw_result):
+    result = raw_result._result
+    if raw_result._task.no_log is True or result.get('_ansible_no_log', False):
+        return result.get('changed'), None, None
+    return result.get('changed'), result.get('rc'), result.get('msg')
+
+
+# declarative event filter and result projection, applied before clean_copy() and encoding, configured as
+#   {"drop": [...], "fullResult": [...], "resultKeys": {action: [...]}}
+# "drop" lists event names (e.g. "skipped", "item_skipped") or types ("stdout", "stderr") never emitted,
+# "resultKeys" lists, per task action (full or short name, "*" for any other), the result keys kept in
+# the events with a result, except for the event names in "fullResult" (default "failed", "item_failed"),
+# which keep the full clean copy, as do no_log results
+class EventFilter:
+    def __init__(self, config):
+        self._drop = frozenset(config.get('drop', ()))
+        self._full = frozenset(config.get('fullResult', ('failed', 'item_failed')))
+        self._keys = dict((action, tuple(key for key in keys if key not in PROJECTION_IGNORED_KEYS))
+                          for action, keys in config.get('resultKeys', {}).items())
+        self._action_keys = {}
+
+    def drops(self, name):
+        return name in self._drop
+
+    def drop(self, names):
+        self._drop = self._drop | frozenset(names)
+
+    def result_keys(self, action):
+        """Returns the result keys kept for a task action, None when the full result is kept"""
+        try:
+            return self._action_keys[action]
+        except KeyError:
+            keys = self._keys.get(action)
+            if keys is None and action:
+                keys = self._keys.get(action.rsplit('.', 1)[-1])
+            if keys is None:
+                keys = self._keys.get('*')
+            self._action_keys[action] = keys
+            return keys
+
+    def result_copy(self, raw_result, event):
+        """Returns the clean copy of a result, or only its kept keys when the event is projected"""
+        if self._keys and event not in self._full:
+            task = raw_result._task
+            keys = self.result_keys(task.action)
+            raw = raw_result._result
+            if keys is not None and not (task.no_log is True or raw.get('_ansible_no_log', False)):
+                return ProjectedResult(raw_result, dict((key, copy.deepcopy(raw[key])) for key in keys if key in raw))
+
+        return raw_result.clean_copy()
+
+
+# loads the X_ANSIBLE_RUNNER_FILTER config, a path to a json file or an inline json object
+def loadEventFilter(config):
+    if config.lstrip().startswith('{'):
+        return EventFilter(json.loads(config))
+    with open(config) as config_file:
+        return EventFilter(json.load(config_file))
+
+
+# result keys which differ from host to host for the same outcome, left out of the deduplicated content
+# (see DEDUP_HOST_KEYS in x_stdout_json_lines_reader.py)
+DEDUP_HOST_KEYS = ('start', 'end', 'delta', '_ansible_delegated_vars')
+
+
+# keys of _ansible_delegated_vars kept by clean_copy()
+DELEGATED_VARS_KEYS = ('ansible_host', 'ansible_port', 'ansible_user', 'ansible_connection')
+
+
+# replaces the results already sent for the current task by a reference to their content hash, the raw
+# result is hashed before it is copied, so a repeated result costs neither clean_copy() nor its encoding
+class ResultDeduplicator:
+    def __init__(self, max_entries):
+        self._max_entries = max_entries
+        self._seen = OrderedDict()  # content hash -> True, least recently used first
+        self._digest = None
+        self._repeated = False
+
+    def clear(self):
+        self._seen.clear()
+
+    def lookup(self, raw_result, event):
+        """Hashes the content of a raw result (ignoring its host specific keys), returns whether it was already sent"""
+        raw = raw_result._result
+        body = dict((key, value) for (key, value) in raw.items() if key not in DEDUP_HOST_KEYS)
+        try:
+            encoded = json_backend.dumps([event, body]).encode('utf-8', 'replace')
+        except Exception as e:
+            self._digest = None
+            return False
+
+        digest = self._digest = hashlib.sha1(encoded).hexdigest()
+        seen = self._seen
+        self._repeated = digest in seen
+        if self._repeated:
+            seen.move_to_end(digest)
+        else:
+            seen[digest] = True
+            if len(seen) > self._max_entries:
+                seen.popitem(last=False)
+        return self._repeated
+
+    def host_result(self, raw_result):
+        """Returns only the host specific keys of a raw result, as clean_copy() would keep them"""
+        raw = raw_result._result
+        result = dict((key, raw[key]) for key in DEDUP_HOST_KEYS if key in raw and key != '_ansible_delegated_vars')
+        delegated_vars = raw.get('_ansible_delegated_vars')
+        if delegated_vars:
+            result['_ansible_delegated_vars'] = dict((key, delegated_vars[key]) for key in DELEGATED_VARS_KEYS
+                                                     if key in delegated_vars)
+        return result
+
+    def mark(self, data):
+        """Sets data['resultHash'] (or data['resultRef'] for a repeated result) after the last lookup"""
+        if self._digest is not None:
+            data['resultRef' if self._repeated else 'resultHash'] = self._digest
+            self._digest = None
+
+
+# actions whose ansible_facts never reach the fact cache, include_vars only sets host variables and set_fact is
+# only cached with cacheable, which the strategy pops off the result before any callback sees it
+FACT_CACHE_SKIPPED_ACTIONS = frozenset(tuple(getattr(C, '_ACTION_SET_FACT', ('set_fact',))) +
+                                       tuple(getattr(C, '_ACTION_INCLUDE_VARS', ('include_vars',))))
+
+
+# returns the name of the host whose fact cache the facts of a result go to, the delegated host with
+# delegate_facts (as the strategy picks it), the inventory host otherwise
+def factsHostForJson(raw_result):
+    task = raw_result._task
+    if getattr(task, 'delegate_to', None) is not None and getattr(task, 'delegate_facts', False):
+        delegated_vars = raw_result._result.get('_ansible_delegated_vars') or {}
+        return delegated_vars.get('ansible_delegated_host') or task.delegate_to
+    return raw_result._host.get_name()
+
+
+# per host fact snapshots, "<directory>/<prefix><host>" holds the current facts of the host exactly as the
+# jsonfile fact cache plugin writes them (sorted keys, 4 spaces indent), every distinct snapshot is also
+# kept once under "<directory>/.snapshots/<sha256[:2]>/<sha256>.json" (hidden from the fact cache plugin)
+# so the digests referenced by the facts events can be looked up later, nothing is held in memory
+class FactStore:
+    def __init__(self, directory, prefix=''):
+        self._directory = directory
+        self._prefix = prefix
+        self._snapshots = os.path.join(directory, '.snapshots')
+
+    def host_path(self, host):
+        return os.path.join(self._directory, self._prefix + host)
+
+    def load(self, host):
+        """Returns the (facts, sha256) of the current snapshot of a host, (None, None) when there is none"""
+        try:
+            with open(self.host_path(host), 'rb') as snapshot_file:
+                encoded = snapshot_file.read()
+            return json.loads(encoded.decode('utf-8')), hashlib.sha256(encoded).hexdigest()
+        except (IOError, OSError, ValueError):
+            return None, None
+
+    def update(self, host, facts):
+        """Merges facts into the snapshot of a host (as ansible merges them into its fact cache), returns
+        (previous sha256, sha256, changed facts), or None when no fact changed"""
+        previous, previous_digest = self.load(host)
+        snapshot = dict(previous or {})
+        snapshot.update(facts)
+
+        changed = dict((key, value) for (key, value) in snapshot.items()
+                       if previous is None or key not in previous or previous[key] != value)
+        if previous is not None and not changed:
+            return None
+
+        encoded = json.dumps(snapshot, cls=AnsibleJSONEncoder, sort_keys=True, indent=4).encode('utf-8')
+        digest = hashlib.sha256(encoded).hexdigest()
+
+        directory = os.path.join(self._snapshots, digest[:2])
+        path = os.path.join(directory, digest + '.json')
+        if not os.path.exists(path):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.write(path, encoded)
+        self.write(self.host_path(host), encoded)
+
+        return previous_digest, digest, changed
+
+    def write(self, path, encoded):
+        temporary_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary_path, 'wb') as snapshot_file:
+            snapshot_file.write(encoded)
+        os.replace(temporary_path, path)
+
+
+# fields replaced by interned ids in compact mode, at the top level of an event and within its data
+COMPACT_EVENT_FIELDS = ('playId', 'taskId', 'item', 'host')
+COMPACT_DATA_FIELDS = ('host', 'name', 'item')
+COMPACT_FIELD_COUNT = len(COMPACT_EVENT_FIELDS) + len(COMPACT_DATA_FIELDS)
+
+
+# replaces repeated string fields of events by integer ids, writing a definition event for each new value
+class EventFieldInterner:
+    def __init__(self, max_values):
+        self._ids = {}
+        self._max_values = max_values
+
+    def intern(self, value, write_def):
+        id = len(self._ids)
+        self._ids[value] = id
+        write_def({'type': 'def', 'id': id, 'value': value})
+        return id
+
+    def compact(self, obj, write_def):
+        ids = self._ids
+        # the table is only reset ahead of an event which could take it past its size, never while interning
+        # one, so all the ids of an event refer to the same table
+        if len(ids) > self._max_values - COMPACT_FIELD_COUNT:
+            ids.clear()
+            write_def({'type': 'def', 'reset': True})
+
+        for field in COMPACT_EVENT_FIELDS:
+            value = obj.get(field)
+            if value is not None:
+                id = ids.get(value)
+                obj[field] = id if id is not None else self.intern(value, write_def)
+
+        data = obj.get('data')
+        if data is not None:
+            for field in COMPACT_DATA_FIELDS:
+                value = data.get(field)
+                if value is not None:
+                    id = ids.get(value)
+                    data[field] = id if id is not None else self.intern(value, write_def)
+
+
+# encodes and writes events on a dedicated thread, write_event does the actual encoding and writing,
+# boundary flushes the sinks (anything callable in the queue is a boundary of the sinks to run in order)
+class ThreadedEventWriter:
+    def __init__(self, write_event, boundary, queue_size, overflow):
+        self._write_event = write_event
+        self._boundary = boundary
+        self._queue = queue.Queue(queue_size)
+        self._drop = overflow == 'drop'
+        self.dropped = {}
+
+        self._thread = threading.Thread(target=self.run, name='x_stdout_json_lines writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+        # the sink registered its own flush before this, so it runs after the queue is drained
+        atexit.register(self.drain)
+
+    def submit(self, obj):
+        if self._drop and isLowPriorityEvent(obj):
+            try:
+                self._queue.put_nowait(obj)
+            except queue.Full:
+                key = obj.get('event') or obj.get('type')
+                self.dropped[key] = self.dropped.get(key, 0) + 1
+            return
+
+        self._queue.put(obj)
+
+    def boundary(self, boundary=None):
+        self._queue.put(boundary or self._boundary)
+
+    def drain(self):
+        """Blocks until every event enqueued so far has been written and flushed"""
+        self._queue.put(self._boundary)
+        self._queue.join()
+
+    def run(self):
+        while True:
+            obj = self._queue.get()
+            try:
+                if callable(obj):
+                    obj()
+                else:
+                    self._write_event(obj)
+            except Exception as e:
+                try:
+                    # keeps the failed event's place in the sequence
+                    self._write_event({'type': 'stderr', 'epoch': int(math.floor(time.time() * 1000)),
+                                       'fn': 'print_json', 'line': 'ERROR/print_json', 'i': obj.get('i')})
+                except Exception as e:
+                    pass
+            finally:
+                # the event (and its result) is released once written, rather than when the next one arrives
+                obj = None
+                self._queue.task_done()
+
+
+# monotonic clock in nanoseconds, unaffected by wall clock jumps (falls back to the wall clock on python 2)
+if hasattr(time, 'monotonic_ns'):
+    monotonic_ns = time.monotonic_ns
+elif hasattr(time, 'monotonic'):
+    def monotonic_ns():
+        return int(time.monotonic() * 1e9)
+else:
+    def monotonic_ns():
+        return int(time.time() * 1e9)
+
+
+# high resolution clock in nanoseconds for the self instrumentation (falls back to the wall clock on python 2)
+if hasattr(time, 'perf_counter_ns'):
+    perf_counter_ns = time.perf_counter_ns
+elif hasattr(time, 'perf_counter'):
+    def perf_counter_ns():
+        return int(time.perf_counter() * 1e9)
+else:
+    def perf_counter_ns():
+        return int(time.time() * 1e9)
+
+
+# log bucketed histogram of durations, the buckets grow by DURATION_BUCKET_GROWTH so quantiles are
+# estimated within ~2% relative error, while the number of buckets stays bounded no matter the
+# number of samples (a few hundred at most between a microsecond and a day)
+DURATION_BUCKET_GROWTH = 1.04
+DURATION_BUCKET_LOG = math.log(DURATION_BUCKET_GROWTH)
+DURATION_MIN_MS = 0.001
+
+
+class DurationHistogram:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+        self._buckets = {}
+
+    def add(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        if self.min_ms is None or ms < self.min_ms:
+            self.min_ms = ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        bucket = int(math.ceil(math.log(max(ms, DURATION_MIN_MS)) / DURATION_BUCKET_LOG))
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def quantile(self, q):
+        rank = q * (self.count - 1)
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen > rank:
+                # midpoint of the bucket, kept within the durations actually seen
+                estimate = 2 * DURATION_BUCKET_GROWTH ** bucket / (DURATION_BUCKET_GROWTH + 1)
+                return max(self.min_ms, min(estimate, self.max_ms))
+        return self.max_ms
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'totalMs': round(self.total_ms, 3),
+            'maxMs': round(self.max_ms, 3),
+            'p50Ms': round(self.quantile(0.50), 3),
+            'p95Ms': round(self.quantile(0.95), 3),
+            'p99Ms': round(self.quantile(0.99), 3),
+        }
+
+
+# incremental per task and per host duration rollups, reported in the stats event
+class TimingRollups:
+    def __init__(self, top):
+        self._top = top
+        self._tasks = {}  # task uuid -> (play uuid, task name, DurationHistogram), for the current play
+        self._retired = {}  # task uuid -> summary, the slowest tasks of the earlier plays
+        self._hosts = {}  # host name -> [count, total ms]
+
+    def add(self, task, play_uuid, host, ms):
+        entry = self._tasks.get(task._uuid)
+        if entry is None:
+            entry = self._tasks[task._uuid] = (play_uuid, task.get_name(), DurationHistogram())
+        entry[2].add(ms)
+
+        totals = self._hosts.get(host)
+        if totals is None:
+            totals = self._hosts[host] = [0, 0.0]
+        totals[0] += 1
+        totals[1] += ms
+
+    def retire_play(self):
+        """Reduces the tasks of the play that ended to summaries, keeping only the slowest ones"""
+        retired = self._retired
+        for task_uuid, entry in self._tasks.items():
+            retired[task_uuid] = self.summarize_task(entry)
+        self._tasks = {}
+
+        if len(retired) > self._top:
+            slowest = heapq.nlargest(self._top, retired, key=lambda task_uuid: retired[task_uuid]['maxMs'])
+            self._retired = dict((task_uuid, retired[task_uuid]) for task_uuid in slowest)
+
+    def summarize_task(self, entry):
+        play_uuid, name, histogram = entry
+        summary = histogram.summary()
+        summary['playId'] = play_uuid
+        summary['name'] = name
+        return summary
+
+    def summary(self):
+        tasks = dict(self._retired)
+        for task_uuid, entry in self._tasks.items():
+            tasks[task_uuid] = self.summarize_task(entry)
+
+        slowest_tasks = heapq.nlargest(self._top, tasks, key=lambda task_uuid: tasks[task_uuid]['maxMs'])
+        slowest_hosts = heapq.nlargest(self._top, self._hosts.items(), key=lambda item: item[1][1])
+
+        return {
+            'tasks': tasks,
+            'slowestTasks': slowest_tasks,
+            'slowestHosts': [{'host': host, 'count': count, 'totalMs': round(total_ms, 3)}
+                             for host, (count, total_ms) in slowest_hosts],
+        }
+
+
+# per host event names (and captured line, diff and facts event types) dropped in summary only mode
+SUMMARY_ONLY_DROPS = ('success', 'failed', 'unreachable', 'skipped', 'item_success', 'item_failed', 'item_skipped',
+                      'async_poll', 'async_ok', 'async_failed', 'retry', 'stdout', 'stderr', 'diff', 'facts')
+
+
+# incrementally maintained host counts of the current play and of its tasks, report() hands back the
+# counts of the play and of the tasks which changed since the previous report
+class ProgressCounters:
+    def __init__(self, interval_ms, interval_results):
+        self._interval_ns = interval_ms * 1000000
+        self._interval_results = interval_results
+        self._last_report = monotonic_ns()
+        self._results = 0  # host results since the previous report
+        self._play_uuid = None
+        self._play = None
+        self._tasks = {}  # task uuid -> counts, for the current play
+        self._dirty = set()  # task uuids whose counts changed since the previous report
+
+    @staticmethod
+    def new_counts(name):
+        return {'name': name, 'ok': 0, 'changed': 0, 'failed': 0, 'unreachable': 0, 'skipped': 0, 'inFlight': 0}
+
+    def start_play(self, play_uuid, name):
+        self._play_uuid = play_uuid
+        self._play = self.new_counts(name)
+        self._tasks = {}
+        self._dirty = set()
+
+    def task_counts(self, task):
+        counts = self._tasks.get(task._uuid)
+        if counts is None:
+            counts = self._tasks[task._uuid] = self.new_counts(task.get_name())
+        self._dirty.add(task._uuid)
+        return counts
+
+    def start(self, task):
+        """Counts a host starting a task"""
+        if self._play is None:
+            return
+        self.task_counts(task)['inFlight'] += 1
+        self._play['inFlight'] += 1
+
+    def result(self, task, status, changed, started):
+        """Counts the final result of a host, started tells whether its start was counted as in flight"""
+        if self._play is None:
+            return
+        self._results += 1
+        for counts in (self.task_counts(task), self._play):
+            counts[status] += 1
+            if changed:
+                counts['changed'] += 1
+            if started:
+                counts['inFlight'] -= 1
+
+    def due(self):
+        """Returns whether a report is due, after the configured number of host results, or once the interval
+        elapsed since the previous report when a count changed meanwhile (hosts starting a task included)"""
+        if self._interval_results and self._results >= self._interval_results:
+            return True
+        return bool(self._interval_ns) and bool(self._dirty) and \
+            monotonic_ns() - self._last_report >= self._interval_ns
+
+    def report(self):
+        """Returns (play uuid, play counts, changed task counts), None when nothing changed since the previous report"""
+        if self._play is None or not self._dirty:
+            return None
+
+        tasks = dict((task_uuid, dict(self._tasks[task_uuid])) for task_uuid in self._dirty)
+        self._dirty = set()
+        self._results = 0
+        self._last_report = monotonic_ns()
+        return self._play_uuid, dict(self._play), tasks
+
+
+# buffers the loop item outcomes of every (task uuid, host name) as compact records, add() and pop()
+# hand back the batches to emit as a single "items" event
+class ItemCoalescer:
+    def __init__(self, max_items, max_ms):
+        self._max_items = max_items
+        self._max_ns = max_ms * 1000000
+        self._batches = {}  # (task uuid, host name) -> batch
+
+    def add(self, key, play_uuid, name, record):
+        """Buffers an item record, returns the batch when it reached a bound (None otherwise)"""
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = {
+                'playId': play_uuid,
+                'name': name,
+                'started': monotonic_ns(),
+                'items': [],
+                'counts': {'ok': 0, 'changed': 0, 'failed': 0, 'skipped': 0},
+            }
+
+        batch['items'].append(record)
+        counts = batch['counts']
+        counts[record['status']] += 1
+        if record.get('changed'):
+            counts['changed'] += 1
+
+        if self._max_items and len(batch['items']) >= self._max_items:
+            return self._batches.pop(key)
+        if self._max_ns and monotonic_ns() - batch['started'] >= self._max_ns:
+            return self._batches.pop(key)
+        return None
+
+    def pop(self, key):
+        return self._batches.pop(key, None)
+
+    def pop_expired(self):
+        """Returns the (key, batch) of the batches whose first item is older than the time bound"""
+        if not self._max_ns or not self._batches:
+            return []
+
+        # the batches are kept in the order of their first item, so only the expired ones are looked at
+        now = monotonic_ns()
+        expired = []
+        for key, batch in self._batches.items():
+            if now - batch['started'] < self._max_ns:
+                break
+            expired.append(key)
+        return [(key, self._batches.pop(key)) for key in expired]
+
+    def pop_all(self):
+        batches = list(self._batches.items())
+        self._batches.clear()
+        return batches
+
+
+# coalesces the async polls and until retries of every (task uuid, host name), poll() tells whether one is
+# emitted, pop() hands back the totals for the final result
+class PollCoalescer:
+    def __init__(self, interval_ms):
+        self._interval_ns = interval_ms * 1000000
+        self._polls = {}  # (task uuid, host name) -> [kind, count, suppressed, first ns, last emitted ns, state]
+
+    def poll(self, key, kind, state):
+        """Counts a poll, returns (count, polls coalesced since the previous one emitted) when it is emitted"""
+        now = monotonic_ns()
+        entry = self._polls.get(key)
+        if entry is None:
+            self._polls[key] = [kind, 1, 0, now, now, state]
+            return 1, 0
+
+        entry[1] += 1
+        if state != entry[5] or now - entry[4] >= self._interval_ns:
+            suppressed = entry[2]
+            entry[2] = 0
+            entry[4] = now
+            entry[5] = state
+            return entry[1], suppressed
+
+        entry[2] += 1
+        return None
+
+    def summary(self, key, pop=False):
+        """Returns the totals of the polls of a (task, host) as {kind, count, elapsedMs}, None when it had none"""
+        entry = self._polls.pop(key, None) if pop else self._polls.get(key)
+        if entry is None:
+            return None
+        return {'kind': entry[0], 'count': entry[1], 'elapsedMs': round((monotonic_ns() - entry[3]) / 1e6, 3)}
+
+    def clear(self):
+        self._polls.clear()
+
+
+# times the callback's own work, instrument() replaces the hooks and the emit/write path of a single
+# callback instance with timing wrappers (instance attributes), so nothing changes unless it is enabled
+class CallbackMetrics:
+    def __init__(self, interval_ms):
+        self._interval_ns = interval_ms * 1000000
+        self._started = self._last_report = perf_counter_ns()
+        self._hooks = {}  # hook name -> {phase: DurationHistogram}
+        self._events = {}  # event kind -> [count, bytes, encode DurationHistogram, write DurationHistogram]
+        self._event_kind = None
+        self._write_ns = 0
+        self._super_ns = 0
+        self._emit_ns = 0
+        self._in_super = False
+
+    def hook_phases(self, name):
+        phases = self._hooks.get(name)
+        if phases is None:
+            phases = self._hooks[name] = dict((phase, DurationHistogram()) for phase in ('total', 'super', 'build', 'emit'))
+        return phases
+
+    def event_entry(self, kind):
+        entry = self._events.get(kind)
+        if entry is None:
+            entry = self._events[kind] = [0, 0, DurationHistogram(), DurationHistogram()]
+        return entry
+
+    def instrument(self, callback):
+        metrics = self
+
+        def time_hook(name, fn):
+            def hook(*args, **kwargs):
+                metrics._super_ns = metrics._emit_ns = 0
+                start = perf_counter_ns()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    end = perf_counter_ns()
+                    phases = metrics.hook_phases(name)
+                    phases['total'].add((end - start) / 1e6)
+                    phases['super'].add(metrics._super_ns / 1e6)
+                    phases['emit'].add(metrics._emit_ns / 1e6)
+                    phases['build'].add(max(end - start - metrics._super_ns - metrics._emit_ns, 0) / 1e6)
+                    if metrics._interval_ns and end - metrics._last_report >= metrics._interval_ns:
+                        metrics._last_report = end
+                        callback.print_json(metrics.event('interval'))
+            return hook
+
+        def time_super(fn):
+            def run_super(*args, **kwargs):
+                metrics._in_super = True
+                start = perf_counter_ns()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    metrics._super_ns += perf_counter_ns() - start
+                    metrics._in_super = False
+            return run_super
+
+        def time_emit(fn):
+            def emit(obj):
+                start = perf_counter_ns()
+                try:
+                    return fn(obj)
+                finally:
+                    if not metrics._in_super:
+                        metrics._emit_ns += perf_counter_ns() - start
+            return emit
+
+        # runs on the writer thread when the async writer is enabled
+        def time_write_event(fn):
+            def write_event(obj):
+                kind = obj.get('type')
+                if 'event' in obj:
+                    kind = '%s.%s' % (kind, obj['event'])
+                metrics._event_kind = kind
+                metrics._write_ns = 0
+                start = perf_counter_ns()
+                try:
+                    return fn(obj)
+                finally:
+                    entry = metrics.event_entry(kind)
+                    entry[0] += 1
+                    entry[2].add(max(perf_counter_ns() - start - metrics._write_ns, 0) / 1e6)
+                    entry[3].add(metrics._write_ns / 1e6)
+            return write_event
+
+        def time_write(fn, size):
+            def write(*args):
+                start = perf_counter_ns()
+                try:
+                    return fn(*args)
+                finally:
+                    metrics._write_ns += perf_counter_ns() - start
+                    metrics.event_entry(metrics._event_kind)[1] += size(args)
+            return write
+
+        prefix_size = len(runner_uuid) + 2  # uuid, space and newline
+        sink = callback.x_sink
+        sink.write_line = time_write(sink.write_line, lambda args: prefix_size + len(args[0]))
+        if hasattr(sink, 'write_bytes'):
+            sink.write_bytes = time_write(sink.write_bytes, lambda args: sum(len(chunk) for chunk in args))
+
+        callback.write_event = time_write_event(callback.write_event)
+        callback.emit = time_emit(callback.emit)
+        callback.run_super = time_super(callback.run_super)
+        for name in list(vars(type(callback))):
+            if name.startswith('v2_'):
+                setattr(callback, name, time_hook(name, getattr(callback, name)))
+
+    def event(self, reason):
+        """Builds a metrics event with the cumulative histograms so far"""
+        # snapshots, as the writer thread may add event kinds meanwhile
+        hooks = dict((name, dict((phase, histogram.summary()) for phase, histogram in list(phases.items())))
+                     for name, phases in list(self._hooks.items()))
+        events = dict((kind, {'count': count, 'bytes': size, 'encode': encode.summary(), 'write': write.summary()})
+                      for kind, (count, size, encode, write) in list(self._events.items()))
+
+        return {
+            'type': 'metrics',
+            'event': reason,
+            'fn': 'metrics',
+            'epoch': int(math.floor(time.time() * 1000)),
+            'data': {
+                'elapsedMs': round((perf_counter_ns() - self._started) / 1e6, 3),
+                'hooksMs': round(sum(phases['total']['totalMs'] for phases in hooks.values()), 3),
+                'hooks': hooks,
+                'events': events,
+            }
+        }
+
+
 # extend the default stdout callback module
 from ansible.plugins.callback.default import CallbackModule as DefaultCallbackModule
 
@@ -67,26 +1463,151 @@ class CallbackModule(DefaultCallbackModule):
                 self.super_ref.__init__()
 
         self.x_index = 0
+        self.x_captured = CapturedOutput()
+
+        encoding_error = None
+        try:
+            self.x_frames = selectFrameEncoder(event_encoding)
+        except (ImportError, ValueError) as e:
+            self.x_frames = None
+            encoding_error = 'ERROR/__init__: %s encoding unavailable (%s), using jsonl' % (event_encoding, e)
+
+        compression_error = None
+        try:
+            new_compressor = selectCompressor(compression, compression_level)
+        except ImportError as e:
+            new_compressor = None
+            compression_error = 'ERROR/__init__: %s compression unavailable (%s), not compressing' % (compression, e)
+
+        if new_compressor is not None and not sink_output_path:
+            new_compressor = None
+            compression_error = 'ERROR/__init__: %s compression requires X_ANSIBLE_RUNNER_OUTPUT_PATH' % compression
+
+        shard_error = None
+        sharded = shard_count > 1
+        if sharded and not sink_output_path:
+            sharded = False
+            shard_error = 'ERROR/__init__: X_ANSIBLE_RUNNER_SHARDS requires X_ANSIBLE_RUNNER_OUTPUT_PATH'
+
+        self.x_progress = None
+        if new_compressor is not None:
+            def new_sink(path):
+                return CompressedEventSink(path, new_compressor, compression_points == 'task',
+                                           sink_flush_events, sink_flush_ms, sink_buffer_bytes)
+            if progress_mode in ('progress', 'all'):
+                if sink_mode == 'direct':
+                    self.x_progress = BufferedEventSink(None, sink_flush_events, sink_flush_ms, sink_buffer_bytes)
+                else:
+                    self.x_progress = DisplayEventSink(self._display)
+        elif sink_mode == 'direct' or self.x_frames is not None or sharded:
+            def new_sink(path):
+                return BufferedEventSink(path, sink_flush_events, sink_flush_ms, sink_buffer_bytes)
+        else:
+            new_sink = None
+
+        if sharded:
+            sinks = [new_sink(path) for path in shardPaths(sink_output_path, shard_count, shard_control)]
+            control = sinks.pop() if shard_control == 'control' else None
+            self.x_sink = ShardedEventSink(sinks, shard_by, control)
+            self.x_route = self.x_sink.route
+        else:
+            self.x_sink = new_sink(sink_output_path) if new_sink is not None else DisplayEventSink(self._display)
+            self.x_route = None
+
+        self.x_interner = EventFieldInterner(compact_max_values) if compact_events else None
+
+        filter_error = None
+        self.x_filter = None
+        if event_filter_config:
+            try:
+                self.x_filter = loadEventFilter(event_filter_config)
+            except Exception as e:
+                filter_error = 'ERROR/__init__: invalid X_ANSIBLE_RUNNER_FILTER (%s), not filtering' % e
+
+        if summary_only:
+            if self.x_filter is None:
+                self.x_filter = EventFilter({'drop': SUMMARY_ONLY_DROPS})
+            else:
+                self.x_filter.drop(SUMMARY_ONLY_DROPS)
+
+        if metrics_enabled:
+            self.x_metrics = CallbackMetrics(metrics_interval_ms)
+            self.x_metrics.instrument(self)
+        else:
+            self.x_metrics = None
+
+        if async_writer:
+            self.x_writer = ThreadedEventWriter(self.write_event, self.sink_boundary, async_queue_size, async_overflow)
+        else:
+            self.x_writer = None
 
         # print stdout/stderr as wrapped up single line json documents
         self.print_str_lines(stdout_lines, 'stdout', '__init__')
         self.print_str_lines(stderr_lines, 'stderr', '__init__')
 
+        if encoding_error is not None:
+            self.print_str_lines([encoding_error], 'stderr', '__init__')
+
+        if compression_error is not None:
+            self.print_str_lines([compression_error], 'stderr', '__init__')
+
+        if filter_error is not None:
+            self.print_str_lines([filter_error], 'stderr', '__init__')
+
+        if shard_error is not None:
+            self.print_str_lines([shard_error], 'stderr', '__init__')
+
         self.task_to_play = {}
 
+        # monotonic start times per (task uuid, host name), popped by the final result of the host
+        self.x_task_starts = {}
+
+        # uuid of the task last started per host name, for the results carrying a task of ansible's own instead
+        # (the async_status task of the polls of ansible-core 2.11 and later, which has no play)
+        self.x_host_tasks = {}
+        self.x_timing = TimingRollups(timing_top)
+
+        self.x_items = ItemCoalescer(coalesce_max_items, coalesce_ms) if coalesce_items else None
+
+        self.x_dedup = ResultDeduplicator(dedup_cache_size) if dedup_results else None
+
+        self.x_facts = FactStore(facts_dir, facts_prefix) if facts_dir else None
+
+        self.x_polls = PollCoalescer(poll_interval_ms)
+
+        # size of the diff lines emitted so far in the run, against X_ANSIBLE_RUNNER_DIFF_BUDGET_BYTES
+        self.x_diff_bytes = 0
+
+        if progress_interval_ms or progress_interval_results:
+            self.x_counters = ProgressCounters(progress_interval_ms, progress_interval_results)
+        else:
+            self.x_counters = None
+
     def print_json(self, obj):
         """Prints a single compact JSON line to stdout for a given object"""
         try:
             obj['i'] = self.x_index
             self.x_index += 1
 
-            printable_json = json.dumps(obj, cls=AnsibleJSONEncoder, indent=None, ensure_ascii=False, sort_keys=False)
-            self.print_uuid_prefixed_line(printable_json)
+            self.emit(obj)
         except Exception as e:
             self.print_str_lines(['ERROR/print_json'], 'stderr', 'print_json')
 
-    def print_str_lines(self, lines, type, fn, playId=None, taskId=None, item=None):
+    def print_str_lines(self, lines, type, fn, playId=None, taskId=None, item=None, host=None):
         """Prints a single compact JSON line to stdout for a given stdout/stderr string"""
+        if self.drops(type):
+            return
+
+        if captured_mode == 'text':
+            if lines:
+                self.print_captured(type, fn, playId, taskId, item, 'text', '\n'.join(lines), host)
+            return
+
+        if captured_mode != 'line':
+            if lines:
+                self.print_captured(type, fn, playId, taskId, item, 'lines', lines, host)
+            return
+
         for line in lines:
             obj = {
                 'type': type,
@@ -106,24 +1627,329 @@ class CallbackModule(DefaultCallbackModule):
             if item is not None:
                 obj['item'] = item
 
-            printable_json = json.dumps(obj, cls=AnsibleJSONEncoder, indent=None, ensure_ascii=False, sort_keys=False)
-            self.print_uuid_prefixed_line(printable_json)
+            if host is not None:
+                obj['host'] = host
+
+            self.emit(obj)
+
+    def run_super(self, fn, args, playId=None, taskId=None, item=None, kwargs=None, host=None):
+        """Runs the wrapped default callback hook, printing its captured stdout/stderr as json lines"""
+        if structured_only:
+            return
+
+        # nothing of the wrapped hook would be printed
+        if self.drops('stdout') and self.drops('stderr'):
+            return
+
+        (stdout, stderr) = self.x_captured.run(getattr(self.super_ref, fn), *args, **(kwargs or {}))
+
+        if captured_mode == 'text':
+            for (type, text) in (('stdout', stdout), ('stderr', stderr)):
+                if text and not self.drops(type):
+                    self.print_captured(type, fn, playId, taskId, item, 'text', text, host)
+            return
+
+        if stdout:
+            self.print_str_lines(stdout.splitlines(), 'stdout', fn, playId, taskId, item, host)
+        if stderr:
+            self.print_str_lines(stderr.splitlines(), 'stderr', fn, playId, taskId, item, host)
+
+    def print_captured(self, type, fn, playId, taskId, item, key, value, host=None):
+        """Prints the whole captured stdout/stderr of a hook invocation as a single event"""
+        obj = {
+            'type': type,
+            'epoch': int(math.floor(time.time() * 1000)),
+            'fn': fn,
+            key: value,
+            'i': self.x_index
+        }
+        self.x_index += 1
+
+        if playId is not None:
+            obj['playId'] = playId
+
+        if taskId is not None:
+            obj['taskId'] = taskId
+
+        if item is not None:
+            obj['item'] = item
+
+        if host is not None:
+            obj['host'] = host
+
+        self.emit(obj)
+
+    def emit(self, obj):
+        """Compacts a single event (when enabled) and dispatches it"""
+        if self.x_interner is not None:
+            # shards are picked by the host/play name, not by its id which changes when the table is reset
+            if self.x_route is not None:
+                obj[SHARD_KEY_FIELD] = self.x_sink.key(obj)
+            self.x_interner.compact(obj, self.dispatch)
+        self.dispatch(obj)
+
+    def dispatch(self, obj):
+        """Hands a single event over to the writer thread, or writes it right away"""
+        if self.x_writer is not None:
+            self.x_writer.submit(obj)
+        else:
+            self.write_event(obj)
+
+    def flush_boundary(self):
+        """Flushes the sink at play and stats boundaries, in order with the events written so far"""
+        if self.x_writer is not None:
+            self.x_writer.boundary()
+        else:
+            self.sink_boundary()
+
+    def flush_task_boundary(self):
+        """Lets the sink start a new flush point at task start, in order with the events written so far"""
+        if self.x_writer is not None:
+            self.x_writer.boundary(self.x_sink.task_boundary)
+        else:
+            self.x_sink.task_boundary()
+
+    def sink_boundary(self):
+        """Flushes the sink, and the progress channel when there is one"""
+        self.x_sink.boundary()
+        if self.x_progress is not None:
+            self.x_progress.boundary()
+
+    def write_event(self, obj):
+        """Encodes and writes a single event, as a json line or as a binary frame"""
+        if self.x_route is not None:
+            self.x_route(obj)
+
+        if self.x_frames is not None:
+            self.x_frames.write(self.x_sink, obj)
+            line = None
+        else:
+            line = json_backend.dumps(obj)
+            self.print_uuid_prefixed_line(line)
+
+        # the progress channel is always json lines, whatever the encoding of the compressed output
+        if self.x_progress is not None and (progress_mode == 'all' or isProgressEvent(obj)):
+            self.x_progress.write_line(line if line is not None else json_backend.dumps(obj))
 
     def print_uuid_prefixed_line(self, str):
         """Prints a single line with the runner uuid prefix"""
-        self._display.display("%s %s" % (runner_uuid, str), color=C.COLOR_OK)
+        self.x_sink.write_line(str)
+
+    def drops(self, event):
+        """Returns whether the filter drops an event name, the hook then skips super and the event altogether"""
+        return self.x_filter is not None and self.x_filter.drops(event)
+
+    def result_copy(self, raw_result, event):
+        """Returns the clean copy of a result, projected when the filter keeps only some of its keys, or
+        with only its host specific keys when deduplication finds it was already sent"""
+        if self.x_dedup is not None and self.x_dedup.lookup(raw_result, event):
+            return ProjectedResult(raw_result, self.x_dedup.host_result(raw_result))
+        if self.x_filter is not None:
+            return self.x_filter.result_copy(raw_result, event)
+        return raw_result.clean_copy()
+
+    def coalesce_item(self, raw_result, status, play_uuid, task_uuid, item, fn):
+        """Buffers the outcome of a loop item, printing the items event of its host when a bound is reached"""
+        result = raw_result._result
+        record = {'item': item, 'status': status}
+        if result.get('changed'):
+            record['changed'] = True
+        if result.get('rc') is not None:
+            record['rc'] = result['rc']
+        if status == 'failed' and not (raw_result._task.no_log is True or result.get('_ansible_no_log', False)):
+            record['msg'] = str(result.get('msg'))
+
+        key = (task_uuid, raw_result._host.get_name())
+        batch = self.x_items.add(key, play_uuid, raw_result.task_name, record)
+        if batch is not None:
+            self.print_items(key, batch, fn, False)
+        self.flush_expired_items(fn)
+
+    def flush_items(self, raw_result, fn):
+        """Prints the buffered items of a host once its final result for the task arrived"""
+        if self.x_items is not None:
+            key = (raw_result._task._uuid, raw_result._host.get_name())
+            batch = self.x_items.pop(key)
+            if batch is not None:
+                self.print_items(key, batch, fn, True)
+
+    def print_items(self, key, batch, fn, final):
+        """Prints a single items event for a batch of loop items of a host"""
+        task_uuid, host = key
+        try:
+            output = {
+                'type': 'task',
+                'event': 'items',
+                'fn': fn,
+                'epoch': int(math.floor(time.time() * 1000)),
+                'playId': batch['playId'],
+                'taskId': task_uuid,
+                'data': {
+                    'name': str(batch['name']),
+                    'host': host,
+                    'final': final,
+                    'counts': batch['counts'],
+                    'items': batch['items'],
+                }
+            }
+
+            self.print_json(output)
+
+        except Exception as e:
+            self.print_str_lines(['ERROR/print_items'], 'stderr', fn, batch['playId'], task_uuid)
+
+    def store_facts(self, raw_result, play_uuid, task_uuid, fn):
+        """Merges the facts of a successful result into the snapshot of the host whose fact cache they go to,
+        printing a facts event with the facts which changed (only their names for no_log results)"""
+        facts = raw_result._result.get('ansible_facts')
+        if not facts or raw_result._task.action in FACT_CACHE_SKIPPED_ACTIONS:
+            return
+
+        host = factsHostForJson(raw_result)
+        try:
+            update = self.x_facts.update(host, facts)
+            if update is None:
+                return
+
+            previous_digest, digest, changed = update
+            output = {
+                'type': 'facts',
+                'event': 'diff',
+                'fn': fn,
+                'epoch': int(math.floor(time.time() * 1000)),
+                'playId': play_uuid,
+                'taskId': task_uuid,
+                'data': {
+                    'host': host,
+                    'snapshot': digest,
+                    'previous': previous_digest,
+                }
+            }
+
+            if host != raw_result._host.get_name():
+                output['data']['delegatedFrom'] = raw_result._host.get_name()
+
+            # the snapshot is kept up to date either way
+            if self.drops('facts'):
+                return
+
+            if raw_result._task.no_log is True or raw_result._result.get('_ansible_no_log', False):
+                output['data']['changedKeys'] = sorted(changed)
+            else:
+                output['data']['changed'] = changed
+
+            self.print_json(output)
+
+        except Exception as e:
+            self.print_str_lines(['ERROR/store_facts'], 'stderr', fn, play_uuid, task_uuid)
+
+    def flush_all_items(self, fn):
+        """Prints the buffered items of the hosts that never reported a final result, at play start and stats"""
+        if self.x_items is not None:
+            for key, batch in self.x_items.pop_all():
+                self.print_items(key, batch, fn, False)
+
+    def flush_expired_items(self, fn):
+        """Prints the buffered items of the hosts whose first item is older than the time bound, checked with every
+        host start, result, item, poll and retry, so a batch behind a slow item of another host is not held back"""
+        if self.x_items is not None:
+            for key, batch in self.x_items.pop_expired():
+                self.print_items(key, batch, fn, False)
+
+    def count_result(self, raw_result, status, duration, fn):
+        """Counts the final result of a host, printing a progress event when one is due"""
+        self.flush_expired_items(fn)
+        if self.x_counters is not None:
+            self.x_counters.result(raw_result._task, status, raw_result._result.get('changed'), duration is not None)
+            self.check_progress(fn)
+
+    def check_progress(self, fn):
+        """Prints a progress event when one is due, checked with every host start, result, poll and retry, so
+        a long task whose hosts have yet to report still gets its progress events"""
+        if self.x_counters is not None and self.x_counters.due():
+            self.print_progress(fn, 'interval')
+
+    def print_progress(self, fn, reason):
+        """Prints a progress event with the counts of the play and of the tasks which changed since the previous one"""
+        report = self.x_counters.report()
+        if report is None:
+            return
+
+        play_uuid, play, tasks = report
+        try:
+            output = {
+                'type': 'progress',
+                'event': reason,
+                'fn': fn,
+                'epoch': int(math.floor(time.time() * 1000)),
+                'playId': play_uuid,
+                'data': {
+                    'play': play,
+                    'tasks': tasks,
+                }
+            }
+
+            self.print_json(output)
+
+        except Exception as e:
+            self.print_str_lines(['ERROR/print_progress'], 'stderr', fn, play_uuid)
+
+    def release_play_state(self):
+        """Releases the per play state, at play start (for the previous play) and at stats"""
+        self.task_to_play.clear()
+        self.x_task_starts.clear()
+        self.x_host_tasks.clear()
+        self.x_timing.retire_play()
+        self.x_polls.clear()
+        if self.x_dedup is not None:
+            self.x_dedup.clear()
+
+        # the default callback keeps the banner prefix of every task it printed, never pruned
+        task_type_cache = getattr(self, '_task_type_cache', None)
+        if task_type_cache is not None:
+            task_type_cache.clear()
+        if hasattr(self, '_last_task_banner'):
+            self._last_task_banner = None
+            self._last_task_name = None
+
+    def result_ids(self, raw_result):
+        """Returns the (play uuid, task uuid) of a result, those of the task last started on its host when the
+        result carries a task without a play"""
+        task = raw_result._task
+        play = getattr(getattr(task, '_parent', None), '_play', None)
+        if play is not None:
+            return play._uuid, task._uuid
+
+        task_uuid = self.x_host_tasks.get(raw_result._host.get_name())
+        return self.task_to_play.get(task_uuid), task_uuid
+
+    def host_task_duration(self, raw_result, play_uuid):
+        """Returns the milliseconds since the task started on the result's host (None when unknown), adding it to the rollups"""
+        end = monotonic_ns()
+        task = raw_result._task
+        host = raw_result._host.get_name()
+        start = self.x_task_starts.pop((task._uuid, host), None)
+        if start is None:
+            return None
+
+        ms = (end - start) / 1e6
+        self.x_timing.add(task, play_uuid, host, ms)
+        return round(ms, 3)
 
     # https://github.com/ansible/ansible/blob/v2.10.4/lib/ansible/playbook/play.py
     def v2_playbook_on_play_start(self, play):
+        # kept here as well as in super, as super is not invoked in structured only mode
+        self._play = play
 
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_playbook_on_play_start(play)
+        # release the state of the previous play, hosts that never reported a final result included
+        self.flush_all_items('v2_playbook_on_play_start')
+        if self.x_counters is not None:
+            self.print_progress('v2_playbook_on_play_start', 'play_end')
+            self.x_counters.start_play(play._uuid, play.get_name())
+        self.release_play_state()
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_playbook_on_play_start', play._uuid)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_playbook_on_play_start', play._uuid)
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_playbook_on_play_start', (play,), play._uuid)
 
         try:
 
@@ -136,7 +1962,7 @@ class CallbackModule(DefaultCallbackModule):
                 'playId': play._uuid,
                 'data': {
                     'name': play.name,
-                    'playbook': cleansePlayForJson(play.serialize()),
+                    'playbook': extractPlayHeaderForJson(play),
                 }
             }
 
@@ -145,19 +1971,22 @@ class CallbackModule(DefaultCallbackModule):
         except Exception as e:
             self.print_str_lines(['ERROR/v2_playbook_on_play_start'], 'stderr', 'v2_playbook_on_play_start', play._uuid)
 
-    def v2_playbook_on_task_start(self, task, is_conditional):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_playbook_on_task_start(task, is_conditional)
+        self.flush_boundary()
 
+    def v2_playbook_on_task_start(self, task, is_conditional):
         play_uuid = task._parent._play._uuid
         task_uuid = task._uuid
         self.task_to_play[task_uuid] = play_uuid
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_playbook_on_task_start', play_uuid, task_uuid)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_playbook_on_task_start', play_uuid, task_uuid)
+        # a compressed output may start an independent flush point with each task
+        self.flush_task_boundary()
+
+        # results are only deduplicated within a task, so a reader may start at any task
+        if self.x_dedup is not None:
+            self.x_dedup.clear()
+
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_playbook_on_task_start', (task, is_conditional), play_uuid, task_uuid)
 
         # build up and print custom single line json of hook structured information
         try:
@@ -187,25 +2016,47 @@ class CallbackModule(DefaultCallbackModule):
             self.print_str_lines(['ERROR/v2_playbook_on_task_start'], 'stderr', 'v2_playbook_on_task_start', play_uuid,
                                  task_uuid)
 
-    def v2_runner_on_ok(self, raw_result, **kwargs):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_runner_on_ok(raw_result, **kwargs)
+    def v2_runner_on_start(self, host, task):
+        self.x_task_starts[(task._uuid, host.get_name())] = monotonic_ns()
+        self.x_host_tasks[host.get_name()] = task._uuid
+        self.flush_expired_items('v2_runner_on_start')
+        if self.x_counters is not None:
+            self.x_counters.start(task)
+            self.check_progress('v2_runner_on_start')
+
+        # super reads the show_per_host_start option directly, which this plugin does not document,
+        # so it is only run when the option was resolved (see COMPAT_OPTIONS of the default callback)
+        if getattr(self, 'show_per_host_start', False):
+            # run super and print its captured stdout/stderr as wrapped up single line json documents
+            self.run_super('v2_runner_on_start', (host, task), task._parent._play._uuid, task._uuid,
+                           host=host.get_name())
 
+    def v2_runner_on_ok(self, raw_result, **kwargs):
         task = raw_result._task
         task_uuid = task._uuid
         play_uuid = task._parent._play._uuid
+        duration = self.host_task_duration(raw_result, play_uuid)
+        polls = self.x_polls.summary((task_uuid, raw_result._host.get_name()), pop=True)
+        self.flush_items(raw_result, 'v2_runner_on_ok')
+        self.count_result(raw_result, 'ok', duration, 'v2_runner_on_ok')
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_runner_on_ok', play_uuid, task_uuid)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_runner_on_ok', play_uuid, task_uuid)
+        # the facts are dropped from the result, but kept in the fact snapshots when enabled
+        if self.x_facts is not None:
+            self.store_facts(raw_result, play_uuid, task_uuid, 'v2_runner_on_ok')
+
+        if self.drops('success'):
+            return
+
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_runner_on_ok', (raw_result,), play_uuid, task_uuid, kwargs=kwargs,
+                       host=raw_result._host.get_name())
 
         # build up and print custom single line json of hook structured information
 
         try:
             # TaskResult has no serialize method, it has a custom clean_copy() instead
-            result = raw_result.clean_copy()
+            changed, rc, msg = resultStatusForJson(raw_result)
+            result = self.result_copy(raw_result, 'success')
 
             output = {
                 'type': 'task',
@@ -217,8 +2068,8 @@ class CallbackModule(DefaultCallbackModule):
                 'data': {
                     'name': str(result.task_name),
                     'host': str(result._host),
-                    'changed': result._result.get("changed"),
-                    'rc': result._result.get("rc"),
+                    'changed': changed,
+                    'rc': rc,
                     'result': result._result,
                 }
             }
@@ -226,30 +2077,44 @@ class CallbackModule(DefaultCallbackModule):
             if 'ansible_facts' in output['data']['result']:
                 del output['data']['result']['ansible_facts']
 
+            if self.x_dedup is not None:
+                self.x_dedup.mark(output['data'])
+
+            if max_result_bytes and 'resultRef' not in output['data']:
+                boundResultForJson(output['data'], max_result_bytes, spill_dir)
+
+            if polls is not None:
+                output['data']['polls'] = polls
+
+            if duration is not None:
+                output['durationMs'] = duration
+
             self.print_json(output)
 
         except Exception as e:
             self.print_str_lines(['ERROR/v2_runner_on_ok'], 'stderr', 'v2_runner_on_ok', play_uuid, task_uuid)
 
     def v2_runner_on_failed(self, raw_result, ignore_errors=False):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_runner_on_failed(raw_result, ignore_errors)
-
         task = raw_result._task
         task_uuid = task._uuid
         play_uuid = task._parent._play._uuid
+        duration = self.host_task_duration(raw_result, play_uuid)
+        polls = self.x_polls.summary((task_uuid, raw_result._host.get_name()), pop=True)
+        self.flush_items(raw_result, 'v2_runner_on_failed')
+        self.count_result(raw_result, 'failed', duration, 'v2_runner_on_failed')
+        if self.drops('failed'):
+            return
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_runner_on_failed', play_uuid, task_uuid)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_runner_on_failed', play_uuid, task_uuid)
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_runner_on_failed', (raw_result, ignore_errors), play_uuid, task_uuid,
+                       host=raw_result._host.get_name())
 
         # build up and print custom single line json of hook structured information
 
         try:
             # TaskResult has no serialize method, it has a custom clean_copy() instead
-            result = raw_result.clean_copy()
+            changed, rc, msg = resultStatusForJson(raw_result)
+            result = self.result_copy(raw_result, 'failed')
 
             output = {
                 'type': 'task',
@@ -263,9 +2128,9 @@ class CallbackModule(DefaultCallbackModule):
                     'name': str(result._task),
                     'success': False,
                     'ignoreErrors': ignore_errors,
-                    'errorMessage': str(result._result.get("msg")),
-                    'rc': result._result.get("rc"),
-                    'changed': result._result.get("changed"),
+                    'errorMessage': str(msg),
+                    'rc': rc,
+                    'changed': changed,
                     'result': result._result,
                 }
             }
@@ -273,24 +2138,37 @@ class CallbackModule(DefaultCallbackModule):
             if 'ansible_facts' in output['data']['result']:
                 del output['data']['result']['ansible_facts']
 
+            if self.x_dedup is not None:
+                self.x_dedup.mark(output['data'])
+
+            if max_result_bytes and 'resultRef' not in output['data']:
+                boundResultForJson(output['data'], max_result_bytes, spill_dir)
+
+            if polls is not None:
+                output['data']['polls'] = polls
+
+            if duration is not None:
+                output['durationMs'] = duration
+
             self.print_json(output)
 
         except Exception as e:
             self.print_str_lines(['ERROR/v2_runner_on_failed'], 'stderr', 'v2_runner_on_failed', play_uuid, task_uuid)
 
     def v2_runner_on_unreachable(self, raw_result):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_runner_on_unreachable(raw_result)
-
         task = raw_result._task
         task_uuid = task._uuid
         play_uuid = task._parent._play._uuid
+        duration = self.host_task_duration(raw_result, play_uuid)
+        polls = self.x_polls.summary((task_uuid, raw_result._host.get_name()), pop=True)
+        self.flush_items(raw_result, 'v2_runner_on_unreachable')
+        self.count_result(raw_result, 'unreachable', duration, 'v2_runner_on_unreachable')
+        if self.drops('unreachable'):
+            return
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_runner_on_unreachable', play_uuid, task_uuid)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_runner_on_unreachable', play_uuid, task_uuid)
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_runner_on_unreachable', (raw_result,), play_uuid, task_uuid,
+                       host=raw_result._host.get_name())
 
         # build up and print custom single line json of hook structured information
 
@@ -312,6 +2190,12 @@ class CallbackModule(DefaultCallbackModule):
                 }
             }
 
+            if polls is not None:
+                output['data']['polls'] = polls
+
+            if duration is not None:
+                output['durationMs'] = duration
+
             self.print_json(output)
 
         except Exception as e:
@@ -319,18 +2203,18 @@ class CallbackModule(DefaultCallbackModule):
 
     # hook executed when a task is skipped via conditions unmet on a task definition
     def v2_runner_on_skipped(self, raw_result):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_runner_on_skipped(raw_result)
-
         task = raw_result._task
         task_uuid = task._uuid
         play_uuid = task._parent._play._uuid
+        duration = self.host_task_duration(raw_result, play_uuid)
+        self.flush_items(raw_result, 'v2_runner_on_skipped')
+        self.count_result(raw_result, 'skipped', duration, 'v2_runner_on_skipped')
+        if self.drops('skipped'):
+            return
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_runner_on_skipped', play_uuid, task_uuid)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_runner_on_skipped', play_uuid, task_uuid)
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_runner_on_skipped', (raw_result,), play_uuid, task_uuid,
+                       host=raw_result._host.get_name())
 
         # build up and print custom single line json of hook structured information
 
@@ -352,22 +2236,19 @@ class CallbackModule(DefaultCallbackModule):
                 }
             }
 
+            if duration is not None:
+                output['durationMs'] = duration
+
             self.print_json(output)
 
         except Exception as e:
             self.print_str_lines(['ERROR/v2_runner_on_skipped'], 'stderr', 'v2_runner_on_skipped', play_uuid, task_uuid)
 
     def v2_playbook_on_no_hosts_matched(self):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_playbook_on_no_hosts_matched()
-
         play_uuid = self._play._uuid
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_playbook_on_no_hosts_matched', play_uuid)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_playbook_on_no_hosts_matched', play_uuid)
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_playbook_on_no_hosts_matched', (), play_uuid)
 
         # build up and print custom single line json of hook structured information
 
@@ -388,16 +2269,10 @@ class CallbackModule(DefaultCallbackModule):
                                  play_uuid)
 
     def v2_playbook_on_no_hosts_remaining(self):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_playbook_on_no_hosts_remaining()
-
         play_uuid = self._play._uuid
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_playbook_on_no_hosts_remaining', play_uuid)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_playbook_on_no_hosts_remaining', play_uuid)
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_playbook_on_no_hosts_remaining', (), play_uuid)
 
         # build up and print custom single line json of hook structured information
         try:
@@ -417,14 +2292,12 @@ class CallbackModule(DefaultCallbackModule):
                                  'v2_playbook_on_no_hosts_remaining', play_uuid)
 
     def v2_playbook_on_stats(self, stats):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_playbook_on_stats(stats)
+        self.flush_all_items('v2_playbook_on_stats')
+        if self.x_counters is not None:
+            self.print_progress('v2_playbook_on_stats', 'play_end')
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_playbook_on_stats')
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_playbook_on_stats')
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_playbook_on_stats', (stats,))
 
         # stats = AggregateStats (see https://github.com/ansible/ansible/blob/v2.10.4/lib/ansible/executor/stats.py)
 
@@ -447,23 +2320,39 @@ class CallbackModule(DefaultCallbackModule):
                 },
             }
 
+            output['data']['timing'] = self.x_timing.summary()
+
+            if self.x_metrics is not None:
+                self.print_json(self.x_metrics.event('stats'))
+
+            if self.x_writer is not None:
+                output['data']['dropped'] = dict(self.x_writer.dropped)
+
             self.print_json(output)
 
         except Exception as e:
             self.print_str_lines(['ERROR/v2_playbook_on_stats'], 'stderr', 'v2_playbook_on_play_start')
 
-    def v2_playbook_on_handler_task_start(self, task):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_playbook_on_handler_task_start(task)
+        self.release_play_state()
 
+        if self.x_writer is not None:
+            self.x_writer.drain()
+        else:
+            self.flush_boundary()
+
+    def v2_playbook_on_handler_task_start(self, task):
         task_uuid = task._uuid
         play_uuid = task._parent._play._uuid
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_playbook_on_handler_task_start', play_uuid, task_uuid)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_playbook_on_handler_task_start', play_uuid, task_uuid)
+        # a compressed output may start an independent flush point with each task
+        self.flush_task_boundary()
+
+        # results are only deduplicated within a task, so a reader may start at any task
+        if self.x_dedup is not None:
+            self.x_dedup.clear()
+
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_playbook_on_handler_task_start', (task,), play_uuid, task_uuid)
 
         try:
 
@@ -494,41 +2383,110 @@ class CallbackModule(DefaultCallbackModule):
                                  'v2_playbook_on_handler_task_start', play_uuid, task_uuid)
 
     def v2_on_file_diff(self, result):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_on_file_diff(result)
-
-        # TODO: check how to get this to run
-        play_uuid = self._play._uuid
+        task = result._task
+        task_uuid = task._uuid
+        play_uuid = task._parent._play._uuid
+        if self.drops('diff'):
+            return
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_on_file_diff', play_uuid)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_on_file_diff', play_uuid)
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_on_file_diff', (result,), play_uuid, task_uuid, host=result._host.get_name())
 
         # build up and print custom single line json of hook structured information
-        pass
+        try:
+            host = result._host.get_name()
 
-    def v2_runner_item_on_ok(self, raw_result):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_runner_item_on_ok(raw_result)
+            if task.loop and 'results' in result._result:
+                for item_result in result._result['results']:
+                    if item_result.get('diff') and item_result.get('changed', False):
+                        item = str(item_result.get('item'))
+                        self.print_file_diffs(item_result['diff'], play_uuid, task_uuid, host, item)
+            elif result._result.get('diff') and result._result.get('changed', False):
+                self.print_file_diffs(result._result['diff'], play_uuid, task_uuid, host)
+
+        except Exception as e:
+            self.print_str_lines(['ERROR/v2_on_file_diff'], 'stderr', 'v2_on_file_diff', play_uuid, task_uuid)
+
+    def print_file_diffs(self, diffs, play_uuid, task_uuid, host, item=None):
+        """Prints the start event of every diff of a result, followed by its chunks while within the run's budget"""
+        if not isinstance(diffs, list):
+            diffs = [diffs]
+
+        for (index, diff) in enumerate(diffs):
+            summary, lines = buildDiffForJson(diff, self._serialize_diff)
+
+            if lines is not None and diff_budget_bytes and self.x_diff_bytes + summary['bytes'] > diff_budget_bytes:
+                summary['omitted'] = 'budget'
+                lines = None
+
+            chunks = list(chunkDiffLinesForJson(lines, diff_chunk_bytes)) if lines else []
+            summary['host'] = host
+            summary['index'] = index
+            summary['chunks'] = len(chunks)
+            if item is not None:
+                summary['item'] = item
+
+            self.print_json({
+                'type': 'diff',
+                'event': 'start',
+                'fn': 'v2_on_file_diff',
+                'epoch': int(math.floor(time.time() * 1000)),
+                'playId': play_uuid,
+                'taskId': task_uuid,
+                'data': summary,
+            })
+
+            for (sequence, text) in enumerate(chunks):
+                self.x_diff_bytes += len(text)
+                output = {
+                    'type': 'diff',
+                    'event': 'chunk',
+                    'fn': 'v2_on_file_diff',
+                    'epoch': int(math.floor(time.time() * 1000)),
+                    'playId': play_uuid,
+                    'taskId': task_uuid,
+                    'data': {
+                        'host': host,
+                        'index': index,
+                        'sequence': sequence,
+                        'text': text,
+                    }
+                }
 
+                if item is not None:
+                    output['data']['item'] = item
+
+                self.print_json(output)
+
+    def v2_runner_item_on_ok(self, raw_result):
         task = raw_result._task
         task_uuid = task._uuid
         play_uuid = task._parent._play._uuid
+
+        # the facts are dropped from the result, but kept in the fact snapshots when enabled
+        if self.x_facts is not None:
+            self.store_facts(raw_result, play_uuid, task_uuid, 'v2_runner_item_on_ok')
+
+        if self.drops('item_success'):
+            return
+
         item = str(raw_result._result['item'])
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_runner_item_on_ok', play_uuid, task_uuid, item)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_runner_item_on_ok', play_uuid, task_uuid, item)
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_runner_item_on_ok', (raw_result,), play_uuid, task_uuid, item,
+                       host=raw_result._host.get_name())
+
+        # buffered into the items event of the host instead
+        if self.x_items is not None:
+            self.coalesce_item(raw_result, 'ok', play_uuid, task_uuid, item, 'v2_runner_item_on_ok')
+            return
 
         # build up and print custom single line json of hook structured information
 
         try:
             # TaskResult has no serialize method, it has a custom clean_copy() instead
-            result = raw_result.clean_copy()
+            changed, rc, msg = resultStatusForJson(raw_result)
+            result = self.result_copy(raw_result, 'item_success')
 
             output = {
                 'type': 'task',
@@ -541,8 +2499,8 @@ class CallbackModule(DefaultCallbackModule):
                     'name': str(result.task_name),
                     'host': str(result._host),
                     'item': item,
-                    'changed': result._result.get("changed"),
-                    'rc': result._result.get("rc"),
+                    'changed': changed,
+                    'rc': rc,
                     'result': result._result,
                 }
             }
@@ -550,6 +2508,12 @@ class CallbackModule(DefaultCallbackModule):
             if 'ansible_facts' in output['data']['result']:
                 del output['data']['result']['ansible_facts']
 
+            if self.x_dedup is not None:
+                self.x_dedup.mark(output['data'])
+
+            if max_result_bytes and 'resultRef' not in output['data']:
+                boundResultForJson(output['data'], max_result_bytes, spill_dir)
+
             self.print_json(output)
 
         except Exception as e:
@@ -557,25 +2521,30 @@ class CallbackModule(DefaultCallbackModule):
                                  item)
 
     def v2_runner_item_on_failed(self, raw_result):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_runner_item_on_failed(raw_result)
-
         task = raw_result._task
         task_uuid = task._uuid
         play_uuid = task._parent._play._uuid
+        if self.drops('item_failed'):
+            return
+
         item = str(raw_result._result['item'])
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_runner_item_on_failed', play_uuid, task_uuid, item)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_runner_item_on_failed', play_uuid, task_uuid, item)
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_runner_item_on_failed', (raw_result,), play_uuid, task_uuid, item,
+                       host=raw_result._host.get_name())
+
+        # buffered into the items event of the host, failed items are still printed right away unless disabled
+        if self.x_items is not None:
+            self.coalesce_item(raw_result, 'failed', play_uuid, task_uuid, item, 'v2_runner_item_on_failed')
+            if not coalesce_emit_failed:
+                return
 
         # build up and print custom single line json of hook structured information
 
         try:
             # TaskResult has no serialize method, it has a custom clean_copy() instead
-            result = raw_result.clean_copy()
+            changed, rc, msg = resultStatusForJson(raw_result)
+            result = self.result_copy(raw_result, 'item_failed')
 
             output = {
                 'type': 'task',
@@ -588,8 +2557,8 @@ class CallbackModule(DefaultCallbackModule):
                     'name': str(result.task_name),
                     'host': str(result._host),
                     'item': item,
-                    'changed': result._result.get("changed"),
-                    'rc': result._result.get("rc"),
+                    'changed': changed,
+                    'rc': rc,
                     'result': result._result,
                 }
             }
@@ -597,6 +2566,12 @@ class CallbackModule(DefaultCallbackModule):
             if 'ansible_facts' in output['data']['result']:
                 del output['data']['result']['ansible_facts']
 
+            if self.x_dedup is not None:
+                self.x_dedup.mark(output['data'])
+
+            if max_result_bytes and 'resultRef' not in output['data']:
+                boundResultForJson(output['data'], max_result_bytes, spill_dir)
+
             self.print_json(output)
 
         except Exception as e:
@@ -604,19 +2579,22 @@ class CallbackModule(DefaultCallbackModule):
                                  task_uuid, item)
 
     def v2_runner_item_on_skipped(self, raw_result):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_runner_item_on_skipped(raw_result)
-
         task = raw_result._task
         task_uuid = task._uuid
         play_uuid = task._parent._play._uuid
+        if self.drops('item_skipped'):
+            return
+
         item = str(raw_result._result['item'])
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_runner_item_on_skipped', play_uuid, task_uuid, item)
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_runner_item_on_skipped', play_uuid, task_uuid, item)
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_runner_item_on_skipped', (raw_result,), play_uuid, task_uuid, item,
+                       host=raw_result._host.get_name())
+
+        # buffered into the items event of the host instead
+        if self.x_items is not None:
+            self.coalesce_item(raw_result, 'skipped', play_uuid, task_uuid, item, 'v2_runner_item_on_skipped')
+            return
 
         # build up and print custom single line json of hook structured information
 
@@ -646,27 +2624,15 @@ class CallbackModule(DefaultCallbackModule):
                                  task_uuid, item)
 
     def v2_playbook_on_include(self, included_file):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_playbook_on_include(included_file)
-
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_playbook_on_include')
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_playbook_on_include')
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_playbook_on_include', (included_file,))
 
         # build up and print custom single line json of hook structured information
         pass
 
     def v2_playbook_on_start(self, playbook):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_playbook_on_start(playbook)
-
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_playbook_on_start')
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_playbook_on_start')
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super('v2_playbook_on_start', (playbook,))
 
         # build up and print custom single line json of hook structured information
         try:
@@ -683,18 +2649,179 @@ class CallbackModule(DefaultCallbackModule):
         except Exception as e:
             self.print_str_lines(['ERROR/v2_playbook_on_start'], 'stderr', 'v2_playbook_on_start')
 
-    def v2_runner_retry(self, result):
-        # run super and capture stdout/stderr
-        with CapturingStdout() as stdout_lines:
-            with CapturingStderr() as stderr_lines:
-                self.super_ref.v2_runner_retry(result)
+    def v2_runner_retry(self, raw_result):
+        result = raw_result._result
+        self.print_poll(raw_result, 'retry', 'v2_runner_retry', (result.get('rc'), str(result.get('msg'))), {
+            'attempts': result.get('attempts'),
+            'retries': result.get('retries'),
+            'rc': result.get('rc'),
+            'errorMessage': str(result.get('msg')),
+        })
+
+    # only invoked by ansible-core 2.11 and later
+    def v2_runner_on_async_poll(self, raw_result):
+        result = raw_result._result
+        state = (result.get('started'), result.get('finished'))
+        self.print_poll(raw_result, 'async_poll', 'v2_runner_on_async_poll', state, {
+            'jid': result.get('ansible_job_id'),
+            'started': result.get('started'),
+            'finished': result.get('finished'),
+        })
+
+    def print_poll(self, raw_result, event, fn, state, data):
+        """Runs super, then prints a poll or retry event unless it is coalesced with the previous ones of its host"""
+        play_uuid = None
+        task_uuid = None
+        try:
+            # async polls carry the async_status task of ansible-core, not the task being polled
+            (play_uuid, task_uuid) = self.result_ids(raw_result)
+            host = raw_result._host.get_name()
+            self.flush_expired_items(fn)
+            self.check_progress(fn)
+
+            emitted = self.x_polls.poll((task_uuid, host), event, state)
+            if self.drops(event):
+                return
+
+            # run super and print its captured stdout/stderr as wrapped up single line json documents, for every
+            # poll, only the structured events are coalesced
+            self.run_super(fn, (raw_result,), play_uuid, task_uuid, host=host)
+            if emitted is None:
+                return
 
-        # print stdout/stderr as wrapped up single line json documents
-        self.print_str_lines(stdout_lines, 'stdout', 'v2_runner_retry')
-        self.print_str_lines(stderr_lines, 'stderr', 'v2_runner_retry')
+            # build up and print custom single line json of hook structured information
+            output = {
+                'type': 'task',
+                'event': event,
+                'fn': fn,
+                'epoch': int(math.floor(time.time() * 1000)),
+                'playId': play_uuid,
+                'taskId': task_uuid,
+                'data': {
+                    'name': str(raw_result.task_name),
+                    'host': host,
+                    'count': emitted[0],
+                    'coalesced': emitted[1],
+                }
+            }
+            output['data'].update(data)
+
+            if 'item' in raw_result._result:
+                output['data']['item'] = str(raw_result._result['item'])
+
+            self.print_json(output)
+
+        except Exception as e:
+            self.print_str_lines(['ERROR/' + fn], 'stderr', fn, play_uuid, task_uuid)
+
+    # only invoked by ansible-core 2.11 and later, ahead of the final result of the host
+    def v2_runner_on_async_ok(self, raw_result):
+        self.print_async_result(raw_result, 'async_ok', 'v2_runner_on_async_ok')
+
+    # only invoked by ansible-core 2.11 and later, ahead of the final result of the host
+    def v2_runner_on_async_failed(self, raw_result):
+        self.print_async_result(raw_result, 'async_failed', 'v2_runner_on_async_failed')
+
+    def print_async_result(self, raw_result, event, fn):
+        """Prints the outcome of an async job with the totals of its polls"""
+        (play_uuid, task_uuid) = self.result_ids(raw_result)
+        if self.drops(event):
+            return
+
+        # run super and print its captured stdout/stderr as wrapped up single line json documents
+        self.run_super(fn, (raw_result,), play_uuid, task_uuid, host=raw_result._host.get_name())
 
         # build up and print custom single line json of hook structured information
-        pass
+        try:
+            result = raw_result._result
+            host = raw_result._host.get_name()
+            output = {
+                'type': 'task',
+                'event': event,
+                'fn': fn,
+                'epoch': int(math.floor(time.time() * 1000)),
+                'playId': play_uuid,
+                'taskId': task_uuid,
+                'data': {
+                    'name': str(raw_result.task_name),
+                    'host': host,
+                    'jid': result.get('ansible_job_id'),
+                    'rc': result.get('rc'),
+                    'changed': result.get('changed'),
+                }
+            }
+
+            if event == 'async_failed':
+                output['data']['errorMessage'] = str(result.get('msg'))
+
+            polls = self.x_polls.summary((task_uuid, host))
+            if polls is not None:
+                output['data']['polls'] = polls
+
+            self.print_json(output)
+
+        except Exception as e:
+            self.print_str_lines(['ERROR/' + fn], 'stderr', fn, play_uuid, task_uuid)
+
+
+# builds the unified diff of a single diff of a result (as the default callback renders it, without colors),
+# returns (summary, lines), lines is None when the diff was skipped by the module (binary or larger than
+# max_diff_size), serialize turns the before/after of structured diffs into text
+def buildDiffForJson(diff, serialize):
+    summary = {}
+    skipped = [reason for reason in ('dst_binary', 'src_binary', 'dst_larger', 'src_larger') if reason in diff]
+    if skipped:
+        summary['skipped'] = skipped
+
+    lines = None
+    if 'prepared' in diff:
+        lines = to_text(diff['prepared']).splitlines(True)
+    elif 'before' in diff and 'after' in diff:
+        texts = []
+        for side in ('before', 'after'):
+            value = diff[side]
+            if isinstance(value, Mapping):
+                value = serialize(value)
+            elif value is None:
+                value = ''
+            side_lines = to_text(value).splitlines(True)
+            if side_lines and not side_lines[-1].endswith('\n'):
+                side_lines[-1] += '\n\\ No newline at end of file\n'
+            texts.append(side_lines)
+
+        summary['beforeHeader'] = to_text(diff.get('before_header', 'before'))
+        summary['afterHeader'] = to_text(diff.get('after_header', 'after'))
+        lines = list(difflib.unified_diff(texts[0], texts[1], fromfile='before: %s' % summary['beforeHeader'],
+                                          tofile='after: %s' % summary['afterHeader'], fromfiledate='',
+                                          tofiledate='', n=getattr(C, 'DIFF_CONTEXT', 3)))
+
+    if lines is not None:
+        summary['added'] = sum(1 for line in lines if line.startswith('+') and not line.startswith('+++'))
+        summary['removed'] = sum(1 for line in lines if line.startswith('-') and not line.startswith('---'))
+        summary['bytes'] = sum(len(line) for line in lines)
+    return summary, lines
+
+
+# groups diff lines into chunks of at most max_chars (a longer line is split over several chunks)
+def chunkDiffLinesForJson(lines, max_chars):
+    chunk = []
+    size = 0
+    for line in lines:
+        while len(line) > max_chars:
+            if chunk:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+            yield line[:max_chars]
+            line = line[max_chars:]
+        if size + len(line) > max_chars and chunk:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+        chunk.append(line)
+        size += len(line)
+    if chunk:
+        yield ''.join(chunk)
 
 
 def cleansePlayForJson(play):
@@ -709,3 +2836,143 @@ def cleansePlayForJson(play):
     if play['roles']:
         del play['roles']
     return play
+
+
+# play attributes holding the play's task tree, none of which are kept in the play start event
+PLAY_TREE_ATTRIBUTES = ('pre_tasks', 'post_tasks', 'tasks', 'handlers', 'roles')
+
+
+# builds the same document as cleansePlayForJson(play.serialize()) by reading only the
+# attributes which are kept, so no block, task or role of the play tree is serialized
+def extractPlayHeaderForJson(play):
+    valid_attrs = getattr(play, '_valid_attrs', None)
+    if valid_attrs is None:
+        return cleansePlayForJson(play.serialize())
+
+    header = {}
+    for (name, attribute) in valid_attrs.items():
+        value = getattr(play, name)
+        if name in PLAY_TREE_ATTRIBUTES:
+            # matches cleansePlayForJson, which only removes these when they are non-empty
+            if value:
+                continue
+            if name == 'roles':
+                value = []
+        elif attribute.isa == 'class' and hasattr(value, 'serialize'):
+            value = value.serialize()
+        header[name] = value
+
+    header['uuid'] = play._uuid
+    header['finalized'] = play._finalized
+    header['squashed'] = play._squashed
+    header['included_path'] = play._included_path
+    return header
+
+
+# marker appended to strings cut short to fit a result into the event byte budget
+TRUNCATED_MARKER = '...[truncated %d chars]'
+
+# shortest a string is ever truncated to when fitting a result into the event byte budget
+MIN_TRUNCATED_CHARS = 256
+
+
+# roughly estimates the size of a value once json encoded, giving up as soon as it is over limit
+def estimateJsonSize(value, limit):
+    size = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            size += len(value) + 2
+        elif isinstance(value, dict):
+            size += 2
+            for (key, item) in value.items():
+                size += len(str(key)) + 4
+                stack.append(item)
+        elif isinstance(value, (list, tuple)):
+            size += 2 + len(value)
+            stack.extend(value)
+        else:
+            size += 8
+
+        if size > limit:
+            break
+    return size
+
+
+# drops stdout_lines/stderr_lines wherever the matching stdout/stderr is also present
+# (including the per item results of a loop), the result is modified in place
+def dropRedundantLinesForJson(result):
+    if not isinstance(result, dict):
+        return
+    if 'stdout_lines' in result and 'stdout' in result:
+        del result['stdout_lines']
+    if 'stderr_lines' in result and 'stderr' in result:
+        del result['stderr_lines']
+    if isinstance(result.get('results'), list):
+        for item_result in result['results']:
+            dropRedundantLinesForJson(item_result)
+
+
+# truncates every string longer than max_chars with a marker, returning the (possibly new) value
+def truncateStringsForJson(value, max_chars):
+    if isinstance(value, str):
+        if len(value) > max_chars:
+            return value[:max_chars] + TRUNCATED_MARKER % (len(value) - max_chars)
+        return value
+    if isinstance(value, dict):
+        for (key, item) in value.items():
+            value[key] = truncateStringsForJson(item, max_chars)
+    elif isinstance(value, list):
+        for (index, item) in enumerate(value):
+            value[index] = truncateStringsForJson(item, max_chars)
+    return value
+
+
+# writes the full result to <spill_dir>/<sha256[:2]>/<sha256>.json (once per distinct content)
+# and returns the reference to embed in the event
+def spillResultForJson(result, spill_dir):
+    encoded = json_backend.dumps(result).encode('utf-8', 'replace')
+    digest = hashlib.sha256(encoded).hexdigest()
+
+    directory = os.path.join(spill_dir, digest[:2])
+    path = os.path.join(directory, digest + '.json')
+    if not os.path.exists(path):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary_path, 'wb') as spill_file:
+            spill_file.write(encoded)
+        os.replace(temporary_path, path)
+
+    return {
+        'path': os.path.abspath(path),
+        'sha256': digest,
+        'bytes': len(encoded),
+    }
+
+
+# fits data['result'] of a task event into max_bytes, spilling the full result first when it is over, a result
+# within budget is left as it is
+def boundResultForJson(data, max_bytes, spill_dir=None):
+    result = data['result']
+
+    if estimateJsonSize(result, max_bytes) > max_bytes:
+        if spill_dir:
+            data['resultSpill'] = spillResultForJson(result, spill_dir)
+
+        dropRedundantLinesForJson(result)
+
+        max_chars = max_bytes // 2
+        while estimateJsonSize(result, max_bytes) > max_bytes and max_chars >= MIN_TRUNCATED_CHARS:
+            result = truncateStringsForJson(result, max_chars)
+            data['resultTruncated'] = True
+            max_chars = max_chars // 2
+
+        # too many small values to ever fit, keep only the outcome of the task
+        if estimateJsonSize(result, max_bytes) > max_bytes:
+            result = truncateStringsForJson(dict((key, result[key]) for key in ('changed', 'failed', 'rc', 'msg')
+                                                 if key in result), MIN_TRUNCATED_CHARS)
+            data['resultTruncated'] = True
+
+        data['result'] = result
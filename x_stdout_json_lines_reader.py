@@ -0,0 +1,440 @@
+# (C) 2017, Cape Codes, <info@cape.codes>
+# Dual licensed with MIT and GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# reference reader for the output of the x_stdout_json_lines callback plugin, for the external
+# driver side, this has no dependency on ansible (msgpack/cbor2 are only needed for binary frames)
+
+import heapq
+import io
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import zlib
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# see FRAME_MAGIC in x_stdout_json_lines.py
+FRAME_MAGIC = b'XAF'
+
+# encoding tags, b'm' msgpack and b'c' cbor
+FRAME_TAGS = (b'm', b'c')
+
+# magic + encoding tag + runner uuid length
+FRAME_PREAMBLE_SIZE = len(FRAME_MAGIC) + 2
+
+
+def read_exactly(stream, size):
+    """Reads exactly size bytes, returns None at the end of the stream"""
+    data = stream.read(size)
+    while data is not None and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            return None
+        data += more
+    return data if data else None
+
+
+def skip_bytes(stream, size):
+    """Skips size bytes without reading them when the stream is seekable"""
+    if stream.seekable():
+        stream.seek(size, 1)
+    else:
+        while size > 0:
+            chunk = stream.read(min(size, 1024 * 1024))
+            if not chunk:
+                return
+            size -= len(chunk)
+
+
+def resync(stream, data):
+    """Scans forward from a corrupt or foreign preamble to the next frame magic, returning the next preamble"""
+    window = data[1:]
+    while True:
+        index = window.find(FRAME_MAGIC)
+        if index >= 0:
+            window = window[index:]
+            rest = read_exactly(stream, FRAME_PREAMBLE_SIZE - len(window))
+            if rest is None:
+                return None
+            return window + rest
+
+        byte = stream.read(1)
+        if not byte:
+            return None
+        window = window[-(len(FRAME_MAGIC) - 1):] + byte
+
+
+def iter_frames(stream, runner_uuid=None):
+    """Yields (runner uuid, encoding tag, payload bytes) for each frame of a binary stream, frames of
+    other runners are skipped without reading their payload, as is anything between frames"""
+    wanted = runner_uuid.encode('utf-8') if runner_uuid is not None else None
+
+    while True:
+        preamble = read_exactly(stream, FRAME_PREAMBLE_SIZE)
+        if preamble is None:
+            return
+
+        while not preamble.startswith(FRAME_MAGIC) or preamble[3:4] not in FRAME_TAGS:
+            preamble = resync(stream, preamble)
+            if preamble is None:
+                return
+
+        tag = preamble[3:4]
+        frame_uuid = read_exactly(stream, preamble[4])
+        length_bytes = read_exactly(stream, 4)
+        if frame_uuid is None or length_bytes is None:
+            return
+        (length,) = struct.unpack('>I', length_bytes)
+
+        if wanted is not None and frame_uuid != wanted:
+            skip_bytes(stream, length)
+            continue
+
+        payload = read_exactly(stream, length) if length else b''
+        if payload is None:
+            return
+        yield frame_uuid.decode('utf-8'), tag, payload
+
+
+def decode_frame_payload(tag, payload):
+    """Decodes a frame payload according to its encoding tag"""
+    if tag == b'm':
+        import msgpack
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+    if tag == b'c':
+        import cbor2
+        return cbor2.loads(payload)
+    raise ValueError('unknown frame encoding %r' % tag)
+
+
+def iter_frame_events(stream, runner_uuid=None):
+    """Yields every decoded event of a binary frame stream"""
+    for frame_uuid, tag, payload in iter_frames(stream, runner_uuid):
+        yield decode_frame_payload(tag, payload)
+
+
+def iter_json_line_events(stream, runner_uuid):
+    """Yields every decoded event of a "UUID { json doc }" text stream (opened in binary mode)"""
+    prefix = (runner_uuid + ' ').encode('utf-8')
+    for line in stream:
+        if line.startswith(prefix):
+            yield json.loads(line[len(prefix):])
+
+
+def expand_compact_events(events):
+    """Rebuilds the full events of a compact (X_ANSIBLE_RUNNER_COMPACT) stream, consuming its
+    definition events, see EventFieldInterner in x_stdout_json_lines.py"""
+    values = {}
+    for event in events:
+        if event.get('type') == 'def':
+            if event.get('reset'):
+                values.clear()
+            else:
+                values[event['id']] = event['value']
+            continue
+
+        for field in ('playId', 'taskId', 'item', 'host'):
+            if isinstance(event.get(field), int):
+                event[field] = values[event[field]]
+
+        data = event.get('data')
+        if isinstance(data, dict):
+            for field in ('host', 'name', 'item'):
+                if isinstance(data.get(field), int):
+                    data[field] = values[data[field]]
+
+        yield event
+
+
+# see DEDUP_HOST_KEYS in x_stdout_json_lines.py
+DEDUP_HOST_KEYS = ('start', 'end', 'delta', '_ansible_delegated_vars')
+
+
+def resolve_result_refs(events):
+    """Rebuilds the full results of a deduplicated (X_ANSIBLE_RUNNER_DEDUP) stream, a "resultRef" is
+    replaced by the content sent with the matching "resultHash" earlier in the same task, merged with the
+    host specific keys of the event (compact streams are to be expanded first)"""
+    results = {}
+    for event in events:
+        if event.get('type') == 'task' and event.get('event') in ('start', 'handler_start'):
+            results.clear()
+
+        data = event.get('data')
+        if isinstance(data, dict):
+            if 'resultHash' in data:
+                results[data.pop('resultHash')] = dict((key, value) for (key, value) in data['result'].items()
+                                                       if key not in DEDUP_HOST_KEYS)
+            elif 'resultRef' in data:
+                result = dict(results[data.pop('resultRef')])
+                result.update(data['result'])
+                data['result'] = result
+
+        yield event
+
+
+def iter_merged_shards(shards):
+    """Merges the events of the shards of a sharded (X_ANSIBLE_RUNNER_SHARDS) output back into a single
+    stream ordered by "i", the events written to every shard are only yielded once (compact streams are to
+    be expanded per shard first, deduplicated results resolved on the merged stream)"""
+    def keyed(events):
+        i = -1
+        for event in events:
+            i = event.get('i', i)
+            yield i, event
+
+    last = None
+    for i, event in heapq.merge(*[keyed(events) for events in shards], key=lambda entry: entry[0]):
+        if i == last and 'i' in event:
+            continue
+        if 'i' in event:
+            last = i
+        yield event
+
+
+def new_decompressor(compression):
+    """Returns a decompressor for a single gzip member / zstd frame of a X_ANSIBLE_RUNNER_COMPRESSION output"""
+    if compression == 'gzip':
+        return zlib.decompressobj(31)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError('unknown compression %r' % compression)
+
+
+class DecompressingStream(io.RawIOBase):
+    """Reads the decompressed content of a compressed output, member after member (frame after frame), the
+    stream may be positioned at any flush point first, see read_flush_points, reading again after the end
+    picks up what a live run appended meanwhile"""
+
+    def __init__(self, stream, compression, chunk_size=1024 * 1024):
+        self._stream = stream
+        self._compression = compression
+        self._chunk_size = chunk_size
+        self._decompressor = new_decompressor(compression)
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._stream.close()
+        io.RawIOBase.close(self)
+
+    def readinto(self, buffer):
+        while not self._pending:
+            data = self._stream.read(self._chunk_size)
+            if not data:
+                return 0
+            self._pending = self.decompress(data)
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def decompress(self, data):
+        chunks = []
+        while data:
+            decompressor = self._decompressor
+            chunks.append(decompressor.decompress(data))
+            if not decompressor.eof:
+                break
+            # the member/frame ended, the rest of the data starts the next one
+            data = decompressor.unused_data
+            self._decompressor = new_decompressor(self._compression)
+        return b''.join(chunks)
+
+
+def open_compressed(path, compression, offset=0):
+    """Opens a compressed output for reading (in binary mode) from one of its flush points, the result
+    can be handed to iter_json_line_events or iter_frame_events"""
+    stream = open(path, 'rb')
+    stream.seek(offset)
+    return io.BufferedReader(DecompressingStream(stream, compression), 1024 * 1024)
+
+
+def read_flush_points(path):
+    """Returns the (byte offset, epoch) of every flush point of a compressed output, from its .points file"""
+    points = []
+    with open(path + '.points') as points_file:
+        for line in points_file:
+            fields = line.split()
+            if len(fields) == 2:
+                points.append((int(fields[0]), int(fields[1])))
+    return points
+
+
+def iter_event_lines(path, runner_uuid, start=0):
+    """Yields (offset, json document bytes) for every "UUID { json doc }" line of a json lines output file,
+    from the byte offset start, the file is scanned through mmap for the runner prefix, so the lines of
+    other runners (and an incomplete last line of a live run) are skipped without being split or decoded"""
+    prefix = (runner_uuid + ' ').encode('utf-8')
+    marker = b'\n' + prefix
+
+    with open(path, 'rb') as stream:
+        if os.fstat(stream.fileno()).st_size <= start:
+            return
+        with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if view[start:start + len(prefix)] == prefix:
+                position = start
+            else:
+                position = view.find(marker, start)
+                position = position + 1 if position >= 0 else -1
+
+            while position >= 0:
+                end = view.find(b'\n', position)
+                if end < 0:
+                    return
+                yield position, view[position + len(prefix):end]
+
+                position = view.find(marker, end)
+                position = position + 1 if position >= 0 else -1
+
+
+class LazyEvent:
+    """An event line of a json lines output, its json document is only decoded on first access"""
+    __slots__ = ('offset', 'raw', '_event')
+
+    def __init__(self, offset, raw):
+        self.offset = offset
+        self.raw = raw
+        self._event = None
+
+    @property
+    def event(self):
+        if self._event is None:
+            self._event = json_loads(self.raw)
+        return self._event
+
+
+def iter_lazy_events(path, runner_uuid, start=0):
+    """Yields a LazyEvent for every event line of a json lines output file, see iter_event_lines"""
+    for offset, raw in iter_event_lines(path, runner_uuid, start):
+        yield LazyEvent(offset, raw)
+
+
+def read_event_at(stream, offset, runner_uuid):
+    """Decodes the event line starting at a byte offset of a json lines output (opened in binary mode)"""
+    stream.seek(offset)
+    line = stream.readline()
+    return json_loads(line[len(runner_uuid) + 1:])
+
+
+EVENT_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS strings (id INTEGER PRIMARY KEY, value TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS events (i INTEGER, offset INTEGER NOT NULL, type INTEGER, event INTEGER,
+                                   play INTEGER, task INTEGER, host INTEGER);
+CREATE INDEX IF NOT EXISTS events_i ON events (i);
+CREATE INDEX IF NOT EXISTS events_play ON events (play, event);
+CREATE INDEX IF NOT EXISTS events_task ON events (task, event);
+CREATE INDEX IF NOT EXISTS events_host ON events (host, event);
+"""
+
+
+class EventIndex:
+    """On-disk (sqlite) index of the byte offsets of the events of a json lines output, by i, type, event,
+    playId, taskId and host (repeated values are stored once), update() only indexes what was appended
+    since its previous call, so it can follow a live run, and the events found are read by seeking, several
+    instances (or processes) may share an index, each one picks up what the others indexed"""
+
+    def __init__(self, index_path, path, runner_uuid):
+        self.path = path
+        self.runner_uuid = runner_uuid
+        self._db = sqlite3.connect(index_path)
+        self._db.executescript(EVENT_INDEX_SCHEMA)
+
+        meta = dict(self._db.execute('SELECT key, value FROM meta'))
+        if meta and (meta.get('path') != os.path.abspath(path) or meta.get('runner_uuid') != runner_uuid):
+            raise ValueError('%s indexes %s (%s)' % (index_path, meta.get('path'), meta.get('runner_uuid')))
+        self.indexed_offset = None
+        self.refresh()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def refresh(self):
+        """Reloads the strings and the indexed offset when another instance updated the index meanwhile"""
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'offset'").fetchone()
+        offset = row[0] if row is not None else 0
+        if offset != self.indexed_offset:
+            self._strings = dict((value, id) for id, value in self._db.execute('SELECT id, value FROM strings'))
+            self.indexed_offset = offset
+
+    def string_id(self, value, new_strings):
+        if value is None:
+            return None
+        value = str(value)
+        id = self._strings.get(value)
+        if id is None:
+            id = self._strings[value] = len(self._strings) + 1
+            new_strings.append((id, value))
+        return id
+
+    def update(self):
+        """Indexes the complete lines appended since the previous update, returns the number of new events"""
+        self.refresh()
+        size = os.path.getsize(self.path)
+        if size < self.indexed_offset:
+            # the output was truncated or replaced, index it again from the start
+            self._db.execute('DELETE FROM events')
+            self.indexed_offset = 0
+
+        rows = []
+        new_strings = []
+        string_id = self.string_id
+        end = self.indexed_offset
+        for offset, raw in iter_event_lines(self.path, self.runner_uuid, self.indexed_offset):
+            event = json_loads(raw)
+            data = event.get('data')
+            host = data.get('host') if isinstance(data, dict) else None
+            rows.append((event.get('i'), offset, string_id(event.get('type'), new_strings),
+                         string_id(event.get('event'), new_strings), string_id(event.get('playId'), new_strings),
+                         string_id(event.get('taskId'), new_strings), string_id(host, new_strings)))
+            end = offset + len(self.runner_uuid) + 1 + len(raw) + 1
+
+        # past the lines of other runners too, up to the last complete line
+        if size > end:
+            with open(self.path, 'rb') as stream:
+                with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    end = max(end, view.rfind(b'\n', end) + 1)
+
+        with self._db:
+            self._db.executemany('INSERT INTO strings (id, value) VALUES (?, ?)', new_strings)
+            self._db.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self._db.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', [
+                ('path', os.path.abspath(self.path)), ('runner_uuid', self.runner_uuid), ('offset', end)])
+        self.indexed_offset = end
+        return len(rows)
+
+    def find(self, type=None, event=None, play_id=None, task_id=None, host=None):
+        """Returns the (i, byte offset) of the indexed events matching every given criteria, in order"""
+        clauses = []
+        params = []
+        for column, value in (('type', type), ('event', event), ('play', play_id), ('task', task_id), ('host', host)):
+            if value is not None:
+                # looked up in the index rather than in the strings loaded here, another instance may have added it
+                clauses.append('%s = (SELECT id FROM strings WHERE value = ?)' % column)
+                params.append(str(value))
+
+        query = 'SELECT i, offset FROM events'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        return self._db.execute(query + ' ORDER BY offset', params).fetchall()
+
+    def events(self, **criteria):
+        """Yields the decoded events matching the criteria of find(), read by seeking to each of them"""
+        with open(self.path, 'rb') as stream:
+            for i, offset in self.find(**criteria):
+                yield read_event_at(stream, offset, self.runner_uuid)